@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Tutorial,Session,UserSessionResult,History
+from .models import Tutorial,Session,UserSessionResult,History,AnalysisJob
 admin.site.register(Tutorial)
 admin.site.register(Session)
 admin.site.register(UserSessionResult)
-admin.site.register(History)
\ No newline at end of file
+admin.site.register(History)
+admin.site.register(AnalysisJob)
\ No newline at end of file
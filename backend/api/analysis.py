@@ -0,0 +1,356 @@
+"""
+The video scoring pipeline shared by the process_video view and the
+background job worker.
+"""
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .features import keypoint_features
+from .keypoint_cache import file_digest, get_keypoint_cache, upload_digest
+from .models import UserSessionResult
+from .pose import ExtractionTooLarge, PoolExhausted, SamplingOptions, extract_keypoints
+from .reference_index import get_reference_index, normalize_name
+from .reps import segment_reps
+from .search import search
+from .templates import search_templates
+from .video_uploads import schedule_upload
+
+logger = logging.getLogger(__name__)
+
+# MET values
+MET_VALUES = {
+    "pushup": 4.0,
+    "pullup": 8.0,
+    "russian_twist": 4.0,
+    "leg_raise": 3.5,
+    "deadlift": 6.0,
+    "bench_press": 6.0,
+    "tricep_pushdown": 3.5,
+    "lateral_raise": 3.5,
+    "squat": 5.0
+}
+
+
+# What DTW compares: raw landmarks, or the normalised joint-angle features
+# of features.py (smaller and independent of where the user stands)
+SCORING_MODES = ("keypoints", "features")
+
+# What a whole clip is compared with: every reference recording, or the
+# few DBA templates of manage.py build_templates (see templates.py)
+REFERENCE_MODES = ("references", "templates")
+
+# Retry-After (seconds) when no pose estimator is available
+POSE_RETRY_AFTER = 5
+
+
+class AnalysisError(Exception):
+    """A problem with the submitted video or session that retrying won't fix."""
+
+    def __init__(self, message, status_code=400, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        # Seconds after which the same request may succeed (503s)
+        self.retry_after = retry_after
+
+
+def sampling_options():
+    return SamplingOptions(
+        target_fps=settings.POSE_TARGET_FPS,
+        max_dimension=settings.POSE_MAX_DIMENSION,
+        max_duration=settings.POSE_MAX_DURATION,
+        max_frames=settings.POSE_MAX_FRAMES,
+        max_bytes=settings.POSE_MAX_KEYPOINT_BYTES,
+    )
+
+
+def scoring_mode(mode=None):
+    """Validate a requested scoring mode, falling back to settings.SCORING_MODE."""
+    mode = mode or settings.SCORING_MODE
+    if mode not in SCORING_MODES:
+        raise AnalysisError(f"Unknown scoring mode {mode!r}, expected one of {', '.join(SCORING_MODES)}")
+    return mode
+
+
+def reference_mode(mode=None):
+    """Validate a reference mode, falling back to settings.REFERENCE_MODE."""
+    mode = mode or settings.REFERENCE_MODE
+    if mode not in REFERENCE_MODES:
+        raise AnalysisError(f"Unknown reference mode {mode!r}, expected one of {', '.join(REFERENCE_MODES)}")
+    return mode
+
+
+def search_references(user_keypoints, session_name, mode=None, references_from=None):
+    """
+    Find the nearest and farthest reference of the session's exercise (see
+    search.py). ``references_from`` picks the REFERENCE_MODES entry.
+    """
+    mode = scoring_mode(mode)
+    references_from = reference_mode(references_from)
+    index = get_reference_index()
+    with metrics.stage('references'):
+        exercise_key, references = index.references_for_title(session_name)
+    metrics.note(exercise=exercise_key)
+    if exercise_key is None:
+        raise AnalysisError("No matching dataset found", status_code=404)
+
+    if not references:
+        raise AnalysisError("No .npy files found in dataset folder", status_code=404)
+
+    if len(user_keypoints) == 0:
+        raise AnalysisError("Could not read any frames from the video")
+
+    query = user_keypoints
+    if mode == "features":
+        with metrics.stage('features'):
+            query = keypoint_features(user_keypoints)
+            references = index.features(exercise_key)
+
+    templates = None
+    if references_from == "templates":
+        templates = index.templates(exercise_key, features=mode == "features")
+        if templates is None:
+            logger.warning("No templates built for %s, scoring against every reference", exercise_key)
+    if templates is not None:
+        with metrics.stage('dtw'):
+            result = search_templates(query, *templates, band=settings.DTW_BAND)
+        metrics.note(search=result.stats())
+        return result
+
+    with metrics.stage('dtw'):
+        result = search(
+            query,
+            [dataset_keypoints for _, dataset_keypoints in references],
+            bounds=index.bounds(exercise_key, features=mode == "features"),
+            band=settings.DTW_BAND,
+            mode=settings.DTW_SEARCH_MODE,
+            top_k=settings.DTW_SEARCH_TOP_K,
+        )
+    metrics.note(search=result.stats())
+    return result
+
+
+def accuracy_from_search(result):
+    return accuracy_from_distances(result.best, result.worst)
+
+
+def accuracy_from_distances(best_dist, worst_dist):
+    """Accuracy (0-100, one decimal) from the nearest and farthest reference distances."""
+    max_dist = worst_dist or 1
+    # The best distance is never above the average, so its accuracy is
+    # always the higher of the two and the average isn't needed
+    raw_accuracy = max(0, 100 * (1 - best_dist / max_dist))
+
+    # Round to 1 decimal place for consistency
+    return round(raw_accuracy, 1)
+
+
+def score_keypoints(user_keypoints, session_name, mode=None):
+    """Accuracy (0-100, one decimal) of a keypoint sequence against the session's references."""
+    return accuracy_from_search(search_references(user_keypoints, session_name, mode))
+
+
+def score_reps(user_keypoints, session_name, sample_fps, mode=None):
+    """
+    Split a keypoint sequence into repetitions (see reps.py) and score each
+    one against the exercise's single-rep templates, so the DTW work grows
+    with the number of reps instead of the square of the clip length.
+    Returns (reps, search stats summed over them), or None when no rep or
+    template was found and the clip has to be scored whole.
+    """
+    mode = scoring_mode(mode)
+    index = get_reference_index()
+    exercise_key = index.exercise_key(session_name)
+    if exercise_key is None or len(user_keypoints) == 0:
+        return None
+    profile = index.rep_profile(exercise_key)
+    if profile is None:
+        return None
+
+    with metrics.stage('features'):
+        features = keypoint_features(user_keypoints)
+    with metrics.stage('segmentation'):
+        segments = segment_reps(features, profile)
+        templates, bounds = index.rep_templates(exercise_key, features=mode == "features")
+    if not segments or not templates:
+        return None
+    metrics.note(exercise=exercise_key)
+
+    query = features if mode == "features" else user_keypoints
+    reps = []
+    stats = {}
+    with metrics.stage('dtw'):
+        for number, (start, end) in enumerate(segments, 1):
+            result = search(
+                query[start:end],
+                templates,
+                bounds=bounds,
+                band=settings.DTW_BAND,
+                mode=settings.DTW_SEARCH_MODE,
+                top_k=settings.DTW_SEARCH_TOP_K,
+            )
+            for key, value in result.stats().items():
+                stats[key] = stats.get(key, 0) + value
+            reps.append({
+                "rep": number,
+                "start": round(start / sample_fps, 2),
+                "end": round(end / sample_fps, 2),
+                "accuracy": accuracy_from_search(result),
+            })
+    metrics.note(search=stats)
+    return reps, stats
+
+
+def calories_burned(session_name, weight, duration_minutes):
+    met_value = MET_VALUES.get(normalize_name(session_name), 4.0)  # default 4.0 if not found
+    return round(met_value * float(weight) * duration_minutes * 0.0175, 2)
+
+
+def analyze_extraction(extraction, session_name, weight, mode=None, references_from=None):
+    """
+    Accuracy, calories and duration of an extraction. Clips are scored rep
+    by rep when REP_SCORING_ENABLED; ``references_from`` (REFERENCE_MODES)
+    only applies when they are scored whole.
+    """
+    metrics.note(frames=len(extraction.keypoints), duration_seconds=round(extraction.duration_seconds, 2))
+    duration_minutes = round(extraction.duration_seconds / 60, 2)
+    scored = None
+    if settings.REP_SCORING_ENABLED:
+        scored = score_reps(extraction.keypoints, session_name, extraction.sample_fps, mode)
+    if scored is not None:
+        reps, stats = scored
+        accuracy = round(sum(rep["accuracy"] for rep in reps) / len(reps), 1)
+    else:
+        result = search_references(extraction.keypoints, session_name, mode, references_from)
+        reps = [] if settings.REP_SCORING_ENABLED else None
+        accuracy, stats = accuracy_from_search(result), result.stats()
+    return {
+        "accuracy_score": accuracy,
+        "calories": calories_burned(session_name, weight, duration_minutes),
+        "duration": duration_minutes,
+        "sample_fps": round(extraction.sample_fps, 2),
+        "search": stats,
+        # None when rep scoring is off, empty when no rep was found
+        "reps": reps,
+    }
+
+
+def analyze_video(video_path, session_name, weight, mode=None):
+    """Run the whole pipeline on a local video file and return the numbers to store."""
+    options = sampling_options()
+    cache = get_keypoint_cache()
+    extraction = None
+    if cache is not None:
+        with metrics.stage('cache'):
+            with open(video_path, 'rb') as f:
+                cache_key = cache.key(file_digest(f), options)
+            extraction = cache.get(cache_key)
+    if extraction is None:
+        extraction = _extract(video_path, options)
+        metrics.add_stages(extraction.timings)
+        if cache is not None:
+            with metrics.stage('cache'):
+                cache.put(cache_key, extraction)
+    return analyze_extraction(extraction, session_name, weight, mode)
+
+
+@contextmanager
+def _extraction_errors():
+    try:
+        yield
+    except ExtractionTooLarge as exc:
+        raise AnalysisError(str(exc), 413)
+    except PoolExhausted as exc:
+        # Pool wait timed out, or the pose server is busy or unreachable
+        raise AnalysisError(f"Pose estimation is unavailable: {exc}", 503, retry_after=POSE_RETRY_AFTER)
+
+
+def _extract(video_path, options):
+    with _extraction_errors():
+        return extract_keypoints(video_path, options=options)
+
+
+def _extract_upload(uploaded_file, options):
+    streaming = getattr(uploaded_file, 'streaming_extraction', None)
+    extraction = None
+    if streaming is not None:
+        with metrics.stage('stream_wait'), _extraction_errors():
+            extraction = streaming.wait()
+    if extraction is not None:
+        # Decoding overlapped the upload, so its time includes waiting for bytes
+        metrics.add_stages({f"stream_{name}": seconds for name, seconds in extraction.timings.items()})
+        return extraction
+
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        extraction = _extract(uploaded_file.temporary_file_path(), options)
+    else:
+        with tempfile.NamedTemporaryFile(delete=True, suffix=".mp4") as temp_video:
+            for chunk in uploaded_file.chunks():
+                temp_video.write(chunk)
+            temp_video.flush()
+            extraction = _extract(temp_video.name, options)
+    metrics.add_stages(extraction.timings)
+    return extraction
+
+
+def analyze_upload(uploaded_file, session_name, weight, mode=None):
+    """
+    Like analyze_video, for an uploaded file. A cached result for the same
+    bytes skips decoding; otherwise the keypoints extracted while the upload
+    was streaming in are used, or the file Django spooled to disk is decoded
+    without copying it again.
+    """
+    options = sampling_options()
+    cache = get_keypoint_cache()
+    extraction = None
+    if cache is not None:
+        with metrics.stage('cache'):
+            cache_key = cache.key(upload_digest(uploaded_file), options)
+            extraction = cache.get(cache_key)
+
+    if extraction is not None:
+        metrics.note(cache_hit=True)
+        streaming = getattr(uploaded_file, 'streaming_extraction', None)
+        if streaming is not None:
+            streaming.cancel()
+    else:
+        extraction = _extract_upload(uploaded_file, options)
+        if cache is not None:
+            with metrics.stage('cache'):
+                cache.put(cache_key, extraction)
+    return analyze_extraction(extraction, session_name, weight, mode)
+
+
+def save_result(user, session, analysis, uploaded_video=None):
+    """Store an analysis; ``uploaded_video`` is None for client-side keypoints."""
+    result = UserSessionResult(
+        user=user,
+        session=session,
+        accuracy_score=analysis["accuracy_score"],
+        calories=analysis["calories"],
+        duration=analysis["duration"],
+        sample_fps=analysis.get("sample_fps"),
+        rep_count=len(analysis["reps"]) if analysis.get("reps") is not None else None,
+        rep_scores=analysis.get("reps") or [],
+        video_status=UserSessionResult.VIDEO_PENDING,
+        video_upload_after=timezone.now(),
+    )
+    if uploaded_video is None:
+        result.video_status = UserSessionResult.VIDEO_NONE
+        result.video_upload_after = None
+        with metrics.stage('db'):
+            result.save()
+        return result
+    # The video is only staged locally here; video_uploads copies it to the
+    # storage backend (Cloudinary) once the response is on its way
+    with metrics.stage('storage'):
+        result.staged_video.save(uploaded_video.name, uploaded_video, save=False)
+    with metrics.stage('db'):
+        result.save()
+    schedule_upload(result)
+    return result
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+        if settings.MEDIA_LOCAL_ONLY:
+            from .models import use_local_media_storage
+            use_local_media_storage()
@@ -0,0 +1,280 @@
+"""
+Microbenchmarks for the analysis hot path (``manage.py benchmark``).
+
+Everything runs offline on CPU: videos and keypoint sequences are generated
+from fixed seeds, and the process_video benchmark swaps Cloudinary for local
+file storage and rolls its database writes back. Results are written as
+JSON and can be compared against a saved baseline to flag regressions.
+"""
+import fnmatch
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from .dtw import dtw_distance, dtw_distances
+from .pose import extract_keypoints_from_video, get_pose_pool
+
+RESULTS_VERSION = 1
+
+# (frames, width, height)
+VIDEO_SIZES = [(60, 320, 240), (60, 640, 480)]
+DTW_LENGTHS = [(50, 50), (100, 100), (200, 200), (400, 400), (150, 300)]
+
+
+def synthetic_sequence(frames, seed=0):
+    """Smooth random walk shaped like extract_keypoints_from_video output."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(scale=0.01, size=(frames, 33, 4))
+    return np.clip(0.5 + np.cumsum(steps, axis=0), 0, 1)
+
+
+def synthetic_video(path, frames, width, height, fps=30, seed=0):
+    """A stick figure doing squats on a noisy background, encoded with mp4v."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(30, 90, size=(height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    unit = height / 10
+    cx = width // 2
+    for i in range(frames):
+        depth = 0.5 + 0.5 * np.sin(2 * np.pi * i / 30)  # one rep per second
+        frame = background.copy()
+        hip_y = int(5 * unit + depth * unit)
+        head = (cx, int(hip_y - 3.5 * unit))
+        shoulders = (cx, int(hip_y - 2.5 * unit))
+        hips = (cx, hip_y)
+        knees = (int(cx + depth * unit), int(hip_y + 1.5 * unit - depth * 0.5 * unit))
+        feet = (cx, int(9 * unit))
+        colour = (220, 200, 180)
+        thickness = max(2, int(unit / 4))
+        cv2.circle(frame, head, int(unit / 2), colour, -1)
+        for a, b in [(shoulders, hips), (hips, knees), (knees, feet),
+                     (shoulders, (cx - int(unit), hip_y - int(unit))),
+                     (shoulders, (cx + int(unit), hip_y - int(unit)))]:
+            cv2.line(frame, a, b, colour, thickness)
+        writer.write(frame)
+    writer.release()
+
+
+def measure(func, repeat=5, warmup=1):
+    """Wall-clock timings of ``func()`` in seconds."""
+    for _ in range(warmup):
+        func()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "mean": statistics.fmean(runs),
+        "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        "repeat": repeat,
+    }
+
+
+class Fixtures:
+    """Synthetic inputs, generated once per run in a temporary directory."""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='gymfreak-bench-')
+        self._videos = {}
+
+    def video(self, frames, width, height):
+        key = (frames, width, height)
+        if key not in self._videos:
+            path = os.path.join(self.directory, f"synthetic_{frames}_{width}x{height}.mp4")
+            synthetic_video(path, frames, width, height)
+            self._videos[key] = path
+        return self._videos[key]
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def bench_extract(fixtures, repeat):
+    pool = get_pose_pool()
+    pool.warm()
+    for frames, width, height in VIDEO_SIZES:
+        path = fixtures.video(frames, width, height)
+        yield f"extract/{frames}f-{width}x{height}", lambda: extract_keypoints_from_video(path, pool=pool), repeat
+
+
+def bench_dtw(fixtures, repeat):
+    for n, m in DTW_LENGTHS:
+        a = synthetic_sequence(n, seed=n)
+        b = synthetic_sequence(m, seed=m + 1)
+        yield f"dtw_distance/{n}x{m}", lambda: dtw_distance(a, b), repeat
+    query = synthetic_sequence(200, seed=1)
+    references = [synthetic_sequence(150 + 10 * i, seed=100 + i) for i in range(30)]
+    yield "dtw_distances/200-vs-30-refs", lambda: dtw_distances(query, references), repeat
+
+
+def bench_references(fixtures, repeat):
+    from django.conf import settings
+
+    from .reference_index import ReferenceIndex
+
+    def load():
+        ReferenceIndex(settings.REFERENCE_DATA_DIR).load()
+    yield "reference_index/load", load, repeat
+
+
+def bench_process_video(fixtures, repeat):
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import transaction
+    from django.test.utils import override_settings
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from .models import Session
+
+    path = fixtures.video(60, 640, 480)
+    with open(path, 'rb') as f:
+        video_bytes = f.read()
+    media_root = os.path.join(fixtures.directory, 'media')
+    local_storage = override_settings(
+        MEDIA_ROOT=media_root,
+        STORAGES={**settings.STORAGES, 'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': media_root},
+        }},
+        # Every run should decode and score, not hit the cache
+        KEYPOINT_CACHE_ENABLED=False,
+        RESULT_VIDEO_STAGING_DIR=os.path.join(fixtures.directory, 'staging'),
+        ANALYSIS_ASYNC_DEFAULT=False,
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+    )
+
+    def run():
+        with local_storage, transaction.atomic():
+            user = User.objects.create_user(username='benchmark-user')
+            session = Session.objects.create(title='Squat', description='', video='squat.mp4')
+            client = APIClient()
+            client.force_authenticate(user)
+            response = client.post(reverse('process_video'), {
+                'uploaded_video': SimpleUploadedFile('clip.mp4', video_bytes, content_type='video/mp4'),
+                'session': session.id,
+                'title': session.title,
+                'weight': 70,
+            }, format='multipart')
+            transaction.set_rollback(True)
+        if response.status_code != 200:
+            raise RuntimeError(f"process_video returned {response.status_code}: {response.content[:200]!r}")
+    yield "process_video/60f-640x480", run, max(1, repeat // 2)
+
+
+def bench_catalog(fixtures, repeat):
+    from django.db import transaction
+    from django.test.utils import override_settings
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from .catalog_cache import catalog_cache
+    from .models import Session
+
+    url = reverse('session-list')
+    client = APIClient()
+    hosts = override_settings(ALLOWED_HOSTS=['testserver'])
+
+    def requests(count=20, **headers):
+        def run():
+            for _ in range(count):
+                response = client.get(url, **headers)
+                if response.status_code not in (200, 304):
+                    raise RuntimeError(f"session list returned {response.status_code}")
+        return run
+
+    # A catalog of 50 sessions, rolled back when the suite is done
+    with hosts, transaction.atomic():
+        Session.objects.bulk_create(
+            Session(title=f"Session {i}", description="", video=f"tutorial_videos/session_{i}.mp4")
+            for i in range(50)
+        )
+        with override_settings(CATALOG_CACHE_ENABLED=False):
+            yield "catalog/sessions-50-uncached-x20", requests(), repeat
+        catalog_cache.invalidate()
+        etag = client.get(url)['ETag']
+        yield "catalog/sessions-50-cached-x20", requests(), repeat
+        yield "catalog/sessions-50-not-modified-x20", requests(HTTP_IF_NONE_MATCH=etag), repeat
+        transaction.set_rollback(True)
+
+
+SUITES = {
+    "extract": bench_extract,
+    "dtw": bench_dtw,
+    "references": bench_references,
+    "process_video": bench_process_video,
+    "catalog": bench_catalog,
+}
+
+
+def environment():
+    import mediapipe
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "mediapipe": mediapipe.__version__,
+    }
+
+
+def run_benchmarks(patterns=None, repeat=5, report=print):
+    """Run every benchmark whose name matches one of ``patterns`` (fnmatch)."""
+    fixtures = Fixtures()
+    results = {}
+    try:
+        for suite in SUITES.values():
+            for name, func, runs in suite(fixtures, repeat):
+                if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+                    continue
+                results[name] = measure(func, repeat=runs)
+                report(
+                    f"{name}: {results[name]['median'] * 1000:.1f} ms median, "
+                    f"{results[name]['min'] * 1000:.1f} ms min of {runs}"
+                )
+    finally:
+        fixtures.cleanup()
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=0.25):
+    """
+    Compare the fastest run of each benchmark present in both result sets
+    (the minimum is the least noisy statistic on a shared machine). Returns a
+    list of (name, baseline seconds, current seconds, ratio, verdict), the
+    verdict being 'regression' when the current run is more than
+    ``threshold`` slower, 'improvement' when it is more than ``threshold``
+    faster, else 'ok'.
+    """
+    rows = []
+    for name, result in sorted(current["results"].items()):
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        ratio = result["min"] / before["min"] if before["min"] else float('inf')
+        if ratio > 1 + threshold:
+            verdict = "regression"
+        elif ratio < 1 / (1 + threshold):
+            verdict = "improvement"
+        else:
+            verdict = "ok"
+        rows.append((name, before["min"], result["min"], ratio, verdict))
+    return rows
@@ -0,0 +1,121 @@
+"""
+Response cache for the tutorial and session catalog.
+
+The catalog changes rarely but is fetched on every app launch, and each
+response builds a Cloudinary URL per row. Serialized responses are kept in
+the CATALOG_CACHE_ALIAS cache (an in-process LRU by default) under a
+catalog version. Saving or deleting a Tutorial or Session starts a new
+version (see signals.py), so stale entries are never read again and age
+out of the cache.
+
+Responses carry an ETag (a hash of the body) and a Last-Modified time (the
+last catalog change), so clients revalidating with If-None-Match or
+If-Modified-Since get a 304 without a body.
+
+Invalidation only reaches processes sharing the cache. With several web
+workers, point CATALOG_CACHE_BACKEND at Redis or Memcached, or rely on
+CATALOG_CACHE_TIMEOUT to bound how long another worker serves old data.
+Queryset ``update()`` calls don't send signals; call ``invalidate()``.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import metrics
+
+STATE_KEY = 'catalog:state'
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    def _new_state(self):
+        return {"version": uuid.uuid4().hex, "modified": int(time.time())}
+
+    def state(self):
+        """The current catalog version and its Last-Modified timestamp."""
+        state = self.cache.get(STATE_KEY)
+        if state is None:
+            # First use, or evicted: start a version (another process may win the add)
+            self.cache.add(STATE_KEY, self._new_state(), timeout=None)
+            state = self.cache.get(STATE_KEY) or self._new_state()
+        return state
+
+    def invalidate(self):
+        self.cache.set(STATE_KEY, self._new_state(), timeout=None)
+
+    def get(self, key, build):
+        """
+        Return ``({"data", "etag"}, last_modified)`` for ``key``, calling
+        ``build()`` for the serialized data on a miss.
+        """
+        state = self.state()
+        cache_key = f"catalog:{state['version']}:{key}"
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            data = build()
+            body = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+            entry = {"data": data, "etag": f'"{hashlib.sha1(body).hexdigest()}"'}
+            self.cache.set(cache_key, entry, settings.CATALOG_CACHE_TIMEOUT)
+            self.count(key, "miss")
+        else:
+            self.count(key, "hit")
+        return entry, state["modified"]
+
+    def count(self, key, result):
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "miss":
+                self.misses += 1
+            else:
+                self.not_modified += 1
+        metrics.inc("gymfreak_catalog_requests_total", endpoint=key.split(':')[0], result=result)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+catalog_cache = CatalogCache()
+
+
+def catalog_response(request, key, build):
+    """A cached, conditional response for catalog ``key`` (e.g. ``sessions``)."""
+    if not settings.CATALOG_CACHE_ENABLED:
+        return Response(build())
+
+    entry, modified = catalog_cache.get(key, build)
+    response = get_conditional_response(request, etag=entry["etag"], last_modified=modified)
+    if response is None:
+        response = Response(entry["data"])
+    elif response.status_code == 304:
+        catalog_cache.count(key, "not_modified")
+    response['ETag'] = entry["etag"]
+    response['Last-Modified'] = http_date(modified)
+    # Clients may keep the body but must revalidate before using it
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,322 @@
+"""
+Dynamic time warping over keypoint sequences.
+
+Frame-to-frame Euclidean distances are computed in bulk with matrix products
+and the accumulated cost is filled one anti-diagonal at a time, stored so
+that each diagonal is a contiguous slice, so the Python overhead is a few
+array operations per diagonal instead of one callback per cell. Several
+references can be scored against the same query in one batched call.
+"""
+import numpy as np
+
+# Upper bound on the size of one batched cost tensor (references are split
+# into several batches above this).
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+
+def flatten(seq):
+    """(frames, 33, 4) -> (frames, 132) float64."""
+    seq = np.asarray(seq, dtype=np.float64)
+    return seq.reshape(seq.shape[0], int(np.prod(seq.shape[1:])))
+
+
+def flat_view(seq):
+    """
+    (frames, 33, 4) -> (frames, 132) without copying float32 or float64
+    data, so memory-mapped float32 references aren't converted whole on
+    every request. Mixed with float64 arrays, numpy computes in float64.
+    """
+    seq = np.asarray(seq)
+    if seq.dtype not in (np.float32, np.float64):
+        seq = seq.astype(np.float64)
+    return seq.reshape(seq.shape[0], int(np.prod(seq.shape[1:])))
+
+
+def pairwise_distances(x, y):
+    """
+    Euclidean distances between every frame of ``x`` (n, d) and every frame of
+    ``y``, which is either (m, d) or a batch (k, m, d).
+    """
+    # The expansion below cancels badly in float32
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x_sq = np.einsum('ij,ij->i', x, x)
+    y_sq = np.einsum('...j,...j->...', y, y)
+    d2 = x_sq[:, None] + y_sq[..., None, :] - 2.0 * (x @ np.swapaxes(y, -1, -2))
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+def band_radius(n, m, band):
+    """
+    Effective Sakoe-Chiba radius for an (n, m) alignment. The band follows the
+    line from (0, 0) to (n - 1, m - 1) and is widened when needed so a warping
+    path always exists. Returns None when the band is disabled.
+    """
+    if band is None or n < 2 or m < 2:
+        return None
+    slope = (m - 1) / (n - 1)
+    return max(float(band), (1.0 + slope) / 2.0)
+
+
+def band_mask(n, m, band):
+    """Boolean (n, m) mask of the cells inside the band, or None."""
+    radius = band_radius(n, m, band)
+    if radius is None:
+        return None
+    slope = (m - 1) / (n - 1)
+    centre = np.arange(n)[:, None] * slope
+    return np.abs(np.arange(m)[None, :] - centre) <= radius
+
+
+def _skew(cost):
+    """
+    Lay a (k, n, m) batch of cost matrices out by anti-diagonal: cell (i, j)
+    goes to [:, i + j + 1, i + 1], and the extra leading diagonal and row,
+    like every cell outside the matrix, hold inf. The three predecessors of
+    a diagonal's cells are then plain slices of the two diagonals before it.
+    """
+    k, n, m = cost.shape
+    # (n + m) * (n + 1) cells: callers put the shorter sequence first
+    skewed = np.full((k, n + m, n + 1), np.inf)
+    i, j = np.indices((n, m))
+    skewed[:, i + j + 1, i + 1] = cost
+    return skewed
+
+
+def _shorter_first(cost):
+    """
+    A (k, n, m) batch of cost matrices, transposed when n > m so that _skew
+    grows with the shorter sequence (DTW is symmetric). Returns (cost,
+    transposed).
+    """
+    if cost.shape[1] > cost.shape[2]:
+        return np.swapaxes(cost, 1, 2), True
+    return cost, False
+
+
+def _accumulate(cost, threshold=None):
+    """
+    DTW recurrence over a (k, n, m) batch of cost matrices. Returns the
+    accumulated costs in the layout of _skew, so the distance to the first
+    ``j + 1`` frames of a reference is ``acc[:, n + j, n]``.
+
+    With a ``threshold``, gives up and returns None once every alignment in
+    the batch is certain to cost at least that much: a warping path crosses
+    one of any two consecutive anti-diagonals and its accumulated cost never
+    decreases. Only valid for unpadded batches.
+    """
+    _, n, m = cost.shape
+    acc = _skew(cost)
+    previous = acc[:, 1, 1].copy()
+    for d in range(1, n + m - 1):
+        lo, hi = max(0, d - m + 1) + 1, min(n - 1, d) + 2
+        best = np.minimum(acc[:, d, lo - 1:hi - 1], acc[:, d, lo:hi])  # up, left
+        np.minimum(best, acc[:, d - 1, lo - 1:hi - 1], out=best)         # diagonal
+        current = acc[:, d + 1, lo:hi]
+        current += best
+        if threshold is not None:
+            current = current.min(axis=1)
+            if (np.minimum(previous, current) >= threshold).all():
+                return None
+            previous = current
+    return acc
+
+
+def dtw_distances(query, references, band=None, max_batch_bytes=MAX_BATCH_BYTES):
+    """
+    DTW distance between ``query`` and each sequence in ``references``.
+
+    With ``band=None`` the result is the exact DTW distance. Otherwise the
+    warping path is restricted to a Sakoe-Chiba band of ``band`` frames.
+    """
+    q = flatten(query)
+    # Cast to float64 one batch at a time, when copied into the batch below
+    refs = [flat_view(ref) for ref in references]
+    n = q.shape[0]
+    out = np.full(len(refs), np.inf)
+    if n == 0 or not refs:
+        return out
+
+    # Batch references of similar length together to keep padding small
+    lengths = np.array([ref.shape[0] for ref in refs])
+    order = np.argsort(lengths, kind='stable')
+    start = 0
+    while start < len(order):
+        # Grow the batch while the padded cost tensors fit in the budget
+        stop = start + 1
+        while stop < len(order):
+            width = lengths[order[stop]]
+            if (stop + 1 - start) * (n * width + (n + width) * (min(n, width) + 1)) * 8 > max_batch_bytes:
+                break
+            stop += 1
+
+        members = order[start:stop]
+        width = lengths[members[-1]]
+        batch = np.zeros((len(members), width, q.shape[1]))
+        for b, r in enumerate(members):
+            batch[b, :lengths[r]] = refs[r]
+        cost = pairwise_distances(q, batch)
+
+        for b, r in enumerate(members):
+            mask = band_mask(n, lengths[r], band)
+            if mask is not None:
+                cost[b, :, :lengths[r]][~mask] = np.inf
+
+        cost, transposed = _shorter_first(cost)
+        acc = _accumulate(cost)
+        for b, r in enumerate(members):
+            if lengths[r] > 0:
+                # Padding frames come after the reference's own either way
+                out[r] = acc[b, n + lengths[r] - 1, lengths[r] if transposed else n]
+        start = stop
+
+    return out
+
+
+def dtw_distance(seq1, seq2, band=None):
+    return float(dtw_distances(seq1, [seq2], band=band)[0])
+
+
+def dtw_distance_bounded(query, reference, threshold, band=None):
+    """
+    DTW distance, or inf as soon as it is certain to be at least
+    ``threshold`` (early abandoning).
+    """
+    q = flatten(query)
+    r = flat_view(reference)
+    n, m = q.shape[0], r.shape[0]
+    if n == 0 or m == 0:
+        return np.inf
+    cost = pairwise_distances(q, r)[None]
+    mask = band_mask(n, m, band)
+    if mask is not None:
+        cost[0][~mask] = np.inf
+    cost, _ = _shorter_first(cost)
+    acc = _accumulate(cost, threshold)
+    if acc is None:
+        return np.inf
+    return float(acc[0, n + m - 1, min(n, m)])
+
+
+def dtw_path(seq1, seq2):
+    """
+    Exact DTW distance and an optimal warping path between two sequences:
+    ``(distance, [(i, j), ...])`` from (0, 0) to the last frame of both.
+    """
+    x = flatten(seq1)
+    y = flatten(seq2)
+    n, m = x.shape[0], y.shape[0]
+    if n == 0 or m == 0:
+        return np.inf, []
+    acc = _accumulate(pairwise_distances(x, y)[None])[0]
+
+    def cell(i, j):
+        return acc[i + j + 1, i + 1] if i >= 0 and j >= 0 else np.inf
+
+    i, j = n - 1, m - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        i, j = min(((i - 1, j - 1), (i - 1, j), (i, j - 1)), key=lambda step: cell(*step))
+        path.append((i, j))
+    path.reverse()
+    return float(acc[n + m - 1, n]), path
+
+
+def envelope_distance(seq, lo, hi):
+    """
+    Sum over the frames of ``seq`` (n, d) of their distance to the box
+    [lo, hi]. ``lo``/``hi`` may be a batch (k, d), giving one value per box.
+    Every frame is matched to some frame of the sequence the box encloses,
+    so this is a lower bound on the DTW distance to it (LB_Keogh with an
+    unconstrained window, which also bounds banded DTW).
+    """
+    lo = np.atleast_2d(lo)
+    hi = np.atleast_2d(hi)
+    outside = np.maximum(lo[:, None, :] - seq[None], 0.0) + np.maximum(seq[None] - hi[:, None, :], 0.0)
+    return np.sqrt(np.einsum('knd,knd->kn', outside, outside)).sum(axis=1)
+
+
+def path_upper_bound(x, y):
+    """
+    Cost of the straight-line warping path between flattened sequences; an
+    upper bound on their DTW distance, banded or not.
+    """
+    n, m = x.shape[0], y.shape[0]
+    steps = max(n, m)
+    k = np.arange(steps)
+    i = np.rint(k * (n - 1) / max(steps - 1, 1)).astype(int)
+    j = np.rint(k * (m - 1) / max(steps - 1, 1)).astype(int)
+    return float(np.linalg.norm(x[i] - y[j], axis=1).sum())
+
+
+class StackedReferences:
+    """
+    References laid end to end in one (frames, d) matrix, so the distances
+    from a new query frame to every reference frame are one matrix-vector
+    product. Read-only; shared by every OnlineDTW over the same references.
+    """
+
+    def __init__(self, references):
+        flat = [flatten(ref) for ref in references]
+        self.lengths = np.array([len(ref) for ref in flat], dtype=np.intp)
+        self.width = int(self.lengths.max()) if len(flat) else 0
+        dim = next((ref.shape[1] for ref in flat if len(ref)), 0)
+        self.frames = np.concatenate(flat) if flat else np.zeros((0, dim))
+        self.squared = np.einsum('ij,ij->i', self.frames, self.frames)
+        # Position of each stacked frame in a (references, width) layout
+        self.rows = np.repeat(np.arange(len(flat)), self.lengths)
+        self.cols = np.concatenate([np.arange(n) for n in self.lengths]) if flat else np.zeros(0, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+class OnlineDTW:
+    """
+    Exact, unbanded DTW of a query that arrives one frame at a time against
+    fixed references.
+
+    Only the newest column of each accumulated cost matrix is kept, so
+    memory is proportional to the reference frames however long the query
+    grows, and each frame costs one distance per reference frame. After n
+    frames ``distances()`` equals ``dtw_distances(query[:n], references)``.
+
+    Within a column the recurrence D[j] = c[j] + min(a[j], D[j - 1]), where
+    a[j] is the better of the two cells of the previous column, is a
+    min-plus prefix scan: with S the running sum of c, D[j] is
+    S[j] + min over k <= j of (a[k] - S[k - 1]), which numpy computes with
+    cumsum and minimum.accumulate.
+    """
+
+    def __init__(self, stacked):
+        self.stacked = stacked
+        self.frames = 0
+        # column[:, j + 1] is the accumulated cost up to reference frame j;
+        # column[:, 0] is the cell before the first frame (0 only at the start)
+        self.column = np.full((len(stacked), stacked.width + 1), np.inf)
+        self.column[:, 0] = 0.0
+        self._cost = np.zeros((len(stacked), stacked.width))
+
+    def update(self, frame):
+        """Extend the query by one frame (any shape that flattens to d values)."""
+        stacked = self.stacked
+        x = np.asarray(frame, dtype=np.float64).ravel()
+        d2 = (x @ x) + stacked.squared - 2.0 * (stacked.frames @ x)
+        np.maximum(d2, 0.0, out=d2)
+        # Padding after each reference stays 0 and never feeds a real cell
+        self._cost[stacked.rows, stacked.cols] = np.sqrt(d2)
+
+        previous = self.column
+        best_previous = np.minimum(previous[:, :-1], previous[:, 1:])
+        total = np.cumsum(self._cost, axis=1)
+        offsets = np.minimum.accumulate(best_previous - (total - self._cost), axis=1)
+        previous[:, 0] = np.inf
+        np.add(total, offsets, out=previous[:, 1:])
+        self.frames += 1
+
+    def distances(self):
+        """DTW distance from the frames so far to each reference (inf before the first frame)."""
+        if self.frames == 0:
+            return np.full(len(self.stacked), np.inf)
+        return self.column[np.arange(len(self.stacked)), self.stacked.lengths].copy()
@@ -0,0 +1,60 @@
+"""
+Pose-normalised features for scoring.
+
+Raw keypoints are 33 landmarks x (x, y, z, visibility) = 132 numbers per
+frame and change with where the user stands and how far they are from the
+camera. ``keypoint_features`` reduces a frame to 12 joint angles plus 12
+limb vectors divided by torso length (36 numbers), which is unchanged by
+translation and by scale. Only image x/y are used; MediaPipe's z estimate
+is too noisy to help. Frames without a detected pose map to all zeros, as
+their keypoints do.
+"""
+import numpy as np
+
+# (a, b, c): the angle at landmark b between b->a and b->c
+JOINT_ANGLES = np.array([
+    (11, 13, 15), (12, 14, 16),  # elbows
+    (13, 11, 23), (14, 12, 24),  # shoulders
+    (11, 23, 25), (12, 24, 26),  # hips
+    (23, 25, 27), (24, 26, 28),  # knees
+    (13, 15, 19), (14, 16, 20),  # wrists
+    (25, 27, 31), (26, 28, 32),  # ankles
+])
+
+# (start, end) landmark pairs
+LIMBS = np.array([
+    (11, 13), (12, 14),  # upper arms
+    (13, 15), (14, 16),  # forearms
+    (23, 25), (24, 26),  # thighs
+    (25, 27), (26, 28),  # shins
+    (23, 11), (24, 12),  # torso sides
+    (11, 12), (23, 24),  # shoulder and hip lines
+])
+
+FEATURE_DIM = len(JOINT_ANGLES) + 2 * len(LIMBS)
+
+
+def keypoint_features(keypoints):
+    """(frames, 33, 4) keypoints -> (frames, FEATURE_DIM) float32 features."""
+    xy = np.asarray(keypoints, dtype=np.float32)[..., :2]
+    frames = len(xy)
+    if frames == 0:
+        return np.zeros((0, FEATURE_DIM), dtype=np.float32)
+
+    shoulders = (xy[:, 11] + xy[:, 12]) / 2
+    hips = (xy[:, 23] + xy[:, 24]) / 2
+    torso = np.linalg.norm(shoulders - hips, axis=-1)
+    detected = torso > 1e-6
+
+    ba = xy[:, JOINT_ANGLES[:, 0]] - xy[:, JOINT_ANGLES[:, 1]]
+    bc = xy[:, JOINT_ANGLES[:, 2]] - xy[:, JOINT_ANGLES[:, 1]]
+    cross = ba[..., 0] * bc[..., 1] - ba[..., 1] * bc[..., 0]
+    dot = np.einsum('fjk,fjk->fj', ba, bc)
+    angles = np.arctan2(np.abs(cross), dot) / np.pi  # 0..1
+
+    limbs = xy[:, LIMBS[:, 1]] - xy[:, LIMBS[:, 0]]
+    limbs /= np.where(detected, torso, 1.0)[:, None, None]
+
+    features = np.concatenate([angles, limbs.reshape(frames, -1)], axis=1)
+    features[~detected] = 0.0
+    return features.astype(np.float32, copy=False)
@@ -0,0 +1,62 @@
+"""
+Writing History entries with upserts.
+
+There is one History row per user and session (a unique constraint), so
+an entry is written with a single INSERT ... ON CONFLICT DO UPDATE
+statement instead of a lookup followed by an update or create, which
+could race and create duplicates.
+"""
+from django.db import transaction
+
+from .models import History
+
+UNIQUE_FIELDS = ['user', 'session']
+
+
+def upsert_history(user, entry):
+    """
+    Create or update the user's entry for ``entry['session']``. Only the
+    fields present in ``entry`` are changed on an existing row; creating a
+    row needs a weight. Returns 'updated', 'created', or None when there
+    was no row and no weight.
+    """
+    fields = {name: value for name, value in entry.items() if name != 'session'}
+    if History.objects.filter(user=user, session=entry['session']).update(**fields):
+        return 'updated'
+    if 'weight' not in fields:
+        return None
+    # Still an upsert: another request may have created the row since
+    History.objects.bulk_create(
+        [History(user=user, session=entry['session'], **fields)],
+        update_conflicts=True,
+        unique_fields=UNIQUE_FIELDS,
+        update_fields=list(fields),
+    )
+    return 'created'
+
+
+def sync_history(user, entries, batch_size=500):
+    """
+    Write a batch of entries (each with a weight) in one transaction. Later
+    entries for the same session win, field by field. Only the fields an
+    entry has are changed on an existing row, so entries are upserted in one
+    statement per set of fields. Returns the sessions written.
+    """
+    latest = {}
+    for entry in entries:
+        pk = entry['session'].pk
+        latest[pk] = {**latest.get(pk, {}), **entry}
+    groups = {}
+    for entry in latest.values():
+        fields = tuple(sorted(name for name in entry if name != 'session'))
+        groups.setdefault(fields, []).append(entry)
+    with transaction.atomic():
+        for fields, group in groups.items():
+            History.objects.bulk_create(
+                [History(user=user, **entry) for entry in group],
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=UNIQUE_FIELDS,
+                update_fields=list(fields),
+            )
+    return list(latest)
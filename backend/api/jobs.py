@@ -0,0 +1,217 @@
+"""
+Background execution of video analysis.
+
+process_video can store the upload in an AnalysisJob row and hand it to a
+queue backend instead of analysing it inside the request. The backend is
+chosen with settings.ANALYSIS_QUEUE_BACKEND:
+
+* DatabaseQueue - workers started with ``manage.py run_analysis_worker``
+  poll the AnalysisJob table. No external broker is needed.
+* InlineQueue - runs the job immediately in the enqueuing process
+  (development and tests).
+
+Another backend only has to implement ``enqueue`` and ``claim``; attempts,
+timeouts and results are always recorded on the AnalysisJob row.
+"""
+import logging
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .analysis import AnalysisError, analyze_video, save_result
+from .models import AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class BaseQueue:
+    def enqueue(self, job):
+        """Make a freshly created job available to workers."""
+        raise NotImplementedError
+
+    def claim(self, worker_id):
+        """Return the next job for ``worker_id`` marked as running, or None."""
+        raise NotImplementedError
+
+
+class DatabaseQueue(BaseQueue):
+    """Uses the AnalysisJob table itself as the queue."""
+
+    def enqueue(self, job):
+        # The row is already visible to polling workers
+        pass
+
+    def requeue_expired(self):
+        """Jobs whose worker died or overran its lease count as a timed out attempt."""
+        now = timezone.now()
+        expired = AnalysisJob.objects.filter(status=AnalysisJob.STATUS_RUNNING, locked_until__lt=now)
+        for job in expired:
+            fail_job(job, JobTimeout(f"Timed out after {job.timeout_seconds}s"), expected_status=AnalysisJob.STATUS_RUNNING)
+
+    def claim(self, worker_id):
+        self.requeue_expired()
+        now = timezone.now()
+        candidates = (
+            AnalysisJob.objects
+            .filter(status=AnalysisJob.STATUS_QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', 'timeout_seconds')[:10]
+        )
+        for job_id, timeout_seconds in candidates:
+            # Conditional update so two workers can't claim the same row
+            claimed = AnalysisJob.objects.filter(id=job_id, status=AnalysisJob.STATUS_QUEUED).update(
+                status=AnalysisJob.STATUS_RUNNING,
+                attempts=F('attempts') + 1,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=timeout_seconds + 30),
+                started_at=now,
+            )
+            if claimed:
+                return AnalysisJob.objects.select_related('user', 'session').get(id=job_id)
+        return None
+
+
+class InlineQueue(BaseQueue):
+    """Runs jobs as soon as they are enqueued, in the caller's process."""
+
+    def enqueue(self, job):
+        claimed = AnalysisJob.objects.filter(id=job.id, status=AnalysisJob.STATUS_QUEUED).update(
+            status=AnalysisJob.STATUS_RUNNING,
+            attempts=F('attempts') + 1,
+            locked_by='inline',
+            started_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            run_job(job)
+
+    def claim(self, worker_id):
+        return None
+
+
+_queue = None
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = import_string(settings.ANALYSIS_QUEUE_BACKEND)()
+    return _queue
+
+
+def create_job(user, session, title, weight, uploaded_file, scoring_mode=''):
+    job = AnalysisJob(
+        user=user,
+        session=session,
+        title=title,
+        weight=weight,
+        scoring_mode=scoring_mode or '',
+        max_attempts=settings.ANALYSIS_JOB_MAX_ATTEMPTS,
+        timeout_seconds=settings.ANALYSIS_JOB_TIMEOUT,
+    )
+    job.video.save(uploaded_file.name, uploaded_file, save=False)
+    job.save()
+    get_queue().enqueue(job)
+    return job
+
+
+@contextmanager
+def job_timeout(seconds):
+    """Raise JobTimeout after ``seconds``. Only enforceable in a process's main thread."""
+    if not seconds or threading.current_thread() is not threading.main_thread() or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def _timeout(signum, frame):
+        raise JobTimeout(f"Timed out after {seconds}s")
+
+    previous = signal.signal(signal.SIGALRM, _timeout)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _finish(job, **fields):
+    fields.setdefault('finished_at', timezone.now())
+    fields.setdefault('locked_until', None)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=list(fields))
+
+
+def _discard_upload(job):
+    if job.video:
+        job.video.delete(save=False)
+        job.save(update_fields=['video'])
+
+
+def fail_job(job, exc, expected_status=None):
+    """Schedule a retry with exponential backoff, or fail permanently."""
+    # AnalysisErrors are final, except a 503 (no pose estimator available)
+    transient = not isinstance(exc, AnalysisError) or exc.status_code == 503
+    retry = transient and job.attempts < job.max_attempts
+    message = exc.message if isinstance(exc, AnalysisError) else f"{type(exc).__name__}: {exc}"
+    jobs = AnalysisJob.objects.filter(id=job.id)
+    if expected_status:
+        jobs = jobs.filter(status=expected_status)
+
+    if retry:
+        delay = settings.ANALYSIS_JOB_RETRY_DELAY * (2 ** (job.attempts - 1))
+        updated = jobs.update(
+            status=AnalysisJob.STATUS_QUEUED,
+            run_after=timezone.now() + timedelta(seconds=delay),
+            locked_by='',
+            locked_until=None,
+            error=message,
+        )
+        if updated:
+            logger.warning("Analysis job %s attempt %s failed, retrying in %ss: %s", job.id, job.attempts, delay, message)
+    else:
+        updated = jobs.update(
+            status=AnalysisJob.STATUS_FAILED,
+            finished_at=timezone.now(),
+            locked_until=None,
+            error=message,
+        )
+        if updated:
+            logger.error("Analysis job %s failed: %s", job.id, message)
+            job.refresh_from_db()
+            _discard_upload(job)
+
+
+def run_job(job):
+    """Analyse a claimed (running) job and record the outcome on its row."""
+    with metrics.timed('analysis_job'):
+        try:
+            with job_timeout(job.timeout_seconds):
+                analysis = analyze_video(job.video.path, job.title, job.weight, job.scoring_mode or None)
+                with job.video.open('rb') as video:
+                    result = save_result(
+                        job.user, job.session, analysis,
+                        File(video, name=os.path.basename(job.video.name)),
+                    )
+        except Exception as exc:
+            metrics.note(outcome='error')
+            fail_job(job, exc)
+            return None
+
+        metrics.note(outcome='ok')
+        _finish(job, status=AnalysisJob.STATUS_SUCCEEDED, result=result, error='')
+        _discard_upload(job)
+    return result
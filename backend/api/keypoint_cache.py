@@ -0,0 +1,207 @@
+"""
+On-disk cache of extracted keypoints, keyed by the SHA-256 of the uploaded
+video bytes and the extraction settings, so re-uploads of the same clip skip
+pose estimation. Entries are evicted least recently used first once the
+store grows past its size limit. Hit/miss counters live next to the entries
+so every worker process and the management command see the same numbers.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .pose import POSE_OPTIONS, Extraction
+
+logger = logging.getLogger(__name__)
+
+# Bump when the extraction output changes so old entries stop matching
+# (2: float32 keypoints from preallocated buffers)
+CACHE_VERSION = 2
+
+STATS_FILE = 'stats.json'
+
+
+def file_digest(fileobj, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_digest(uploaded_file):
+    """SHA-256 of an UploadedFile, reusing the one computed while it streamed in."""
+    digest = getattr(uploaded_file, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+class KeypointCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, video_digest, options):
+        params = json.dumps({
+            "version": CACHE_VERSION,
+            "target_fps": options.target_fps,
+            "max_dimension": options.max_dimension,
+            "max_duration": options.max_duration,
+            # A fresh extraction over these limits fails; a cached one mustn't pass
+            "max_frames": options.max_frames,
+            "max_bytes": options.max_bytes,
+            "pose": POSE_OPTIONS,
+        }, sort_keys=True)
+        return hashlib.sha256(f"{video_digest}:{params}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    @contextmanager
+    def _stats_lock(self):
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_counters(self):
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock():
+            counters = self._read_counters()
+            counters[name] = counters.get(name, 0) + amount
+            with open(os.path.join(self.directory, STATS_FILE), 'w') as f:
+                json.dump(counters, f)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                extraction = Extraction(
+                    data['keypoints'],
+                    float(data['source_fps']),
+                    float(data['sample_fps']),
+                    float(data['duration_seconds']),
+                )
+        except (OSError, KeyError, ValueError):
+            self._count('misses')
+            return None
+        # The mtime doubles as the last-used time for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count('hits')
+        return extraction
+
+    def put(self, key, extraction):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    keypoints=extraction.keypoints,
+                    source_fps=extraction.source_fps,
+                    sample_fps=extraction.sample_fps,
+                    duration_seconds=extraction.duration_seconds,
+                )
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            logger.exception("Could not write keypoint cache entry")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+        return evicted
+
+    def stats(self):
+        entries = self._entries()
+        counters = self._read_counters()
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            **counters,
+            "hit_rate": round(counters.get('hits', 0) / lookups, 3) if lookups else None,
+        }
+
+    def purge(self, reset_counters=False):
+        removed = 0
+        for _, _, name in self._entries():
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if reset_counters:
+            with self._stats_lock():
+                try:
+                    os.unlink(os.path.join(self.directory, STATS_FILE))
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_keypoint_cache():
+    """The configured cache, or None when KEYPOINT_CACHE_ENABLED is off."""
+    global _cache
+    if not settings.KEYPOINT_CACHE_ENABLED:
+        return None
+    directory = str(settings.KEYPOINT_CACHE_DIR)
+    with _cache_lock:
+        if _cache is None or _cache.directory != directory:
+            _cache = KeypointCache(directory, settings.KEYPOINT_CACHE_MAX_BYTES)
+    return _cache
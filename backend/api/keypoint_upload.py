@@ -0,0 +1,92 @@
+"""
+Keypoint sequences computed on the client (process_keypoints).
+
+A client that runs pose estimation itself sends the landmarks in the layout
+extract_keypoints produces, ``(frames, 33, 4)`` of (x, y, z, visibility),
+as a ``.npy`` array or a ``.npz`` archive (``np.savez_compressed``, with
+the array stored as ``keypoints`` or as its only member). float16 is
+enough precision and keeps a minute at 30 fps around 0.5 MB before
+compression.
+
+Arrays are parsed from their header without pickle. Sizes are checked
+against the header before any data is read, so a small compressed
+archive can't expand into a huge allocation.
+"""
+import io
+import zipfile
+
+import numpy as np
+from django.conf import settings
+
+from .analysis import AnalysisError
+from .pose import Extraction
+
+FRAME_SHAPE = (33, 4)
+DTYPES = ("float16", "float32", "float64")
+
+
+def _read_npy(f):
+    try:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version in ((2, 0), (3, 0)):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            raise ValueError(f"unsupported npy version {version}")
+    except ValueError as exc:
+        raise AnalysisError(f"Not a valid .npy array: {exc}")
+
+    if dtype.name not in DTYPES:
+        raise AnalysisError(f"Keypoints must be one of {', '.join(DTYPES)}, got {dtype}")
+    if len(shape) != 3 or tuple(shape[1:]) != FRAME_SHAPE:
+        raise AnalysisError(f"Keypoints must have shape (frames, 33, 4), got {tuple(shape)}")
+    if shape[0] == 0:
+        raise AnalysisError("The keypoint sequence is empty")
+    if shape[0] > settings.KEYPOINT_UPLOAD_MAX_FRAMES:
+        raise AnalysisError(f"At most {settings.KEYPOINT_UPLOAD_MAX_FRAMES} frames are accepted, got {shape[0]}")
+
+    count = int(np.prod(shape))
+    data = f.read(count * dtype.itemsize)
+    if len(data) != count * dtype.itemsize:
+        raise AnalysisError("The keypoint array is truncated")
+    keypoints = np.frombuffer(data, dtype=dtype).reshape(shape, order='F' if fortran_order else 'C')
+    return keypoints.astype(np.float32)
+
+
+def read_keypoints(uploaded_file):
+    """Parse an uploaded .npy or .npz keypoint sequence into a float32 array."""
+    if uploaded_file.size > settings.KEYPOINT_UPLOAD_MAX_BYTES:
+        raise AnalysisError(f"Keypoint uploads are limited to {settings.KEYPOINT_UPLOAD_MAX_BYTES} bytes", 413)
+    content = uploaded_file.read()
+    if not content.startswith(b'PK'):
+        keypoints = _read_npy(io.BytesIO(content))
+    else:
+        try:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                names = archive.namelist()
+                name = 'keypoints.npy' if 'keypoints.npy' in names else (names[0] if len(names) == 1 else None)
+                if name is None:
+                    raise AnalysisError("The .npz archive must hold a 'keypoints' array or a single array")
+                with archive.open(name) as member:
+                    keypoints = _read_npy(member)
+        except zipfile.BadZipFile as exc:
+            raise AnalysisError(f"Not a valid .npz archive: {exc}")
+
+    if not np.isfinite(keypoints).all():
+        raise AnalysisError("Keypoints must be finite numbers")
+    return keypoints
+
+
+def keypoint_extraction(keypoints, fps, options):
+    """
+    An Extraction for a client-side sequence, sampled with the same
+    options as uploaded videos so it stays comparable to the references.
+    """
+    if not 0 < fps <= settings.KEYPOINT_UPLOAD_MAX_FPS:
+        raise AnalysisError(f"fps must be between 0 and {settings.KEYPOINT_UPLOAD_MAX_FPS}")
+    duration_seconds = len(keypoints) / fps
+    if options.max_duration:
+        keypoints = keypoints[:int(options.max_duration * fps)]
+    step = options.frame_step(fps)
+    return Extraction(keypoints[::step], fps, fps / step, duration_seconds)
@@ -0,0 +1,345 @@
+"""
+Load tests of the REST API over HTTP.
+
+``manage.py loadtest`` sends a weighted mix of requests (MIX) to a running
+server from a number of virtual users, ramping the concurrency through a
+list of stages, and reports throughput, latency percentiles and error
+rates per endpoint and stage. Each virtual user logs in as one of the
+seeded accounts and repeatedly picks an endpoint by weight:
+
+    token              POST api/token/
+    sessions           GET  api/sessions/
+    tutorials          GET  api/tutorials/
+    history            GET  api/history/
+    history_save       POST api/history/
+    usersessionresult  GET  api/usersessionresult/
+    process_video      POST api/process_video/ with a synthetic clip
+
+With ``--boot`` the command starts the server itself, on a temporary
+SQLite database or the Postgres one given with ``--database-url``.
+MEDIA_LOCAL_ONLY keeps uploads and session videos under a temporary
+MEDIA_ROOT instead of Cloudinary, so a run never leaves the machine.
+``seed`` creates the accounts, one session per reference exercise (so
+process_video has references to score against), tutorials and some
+history and results for the listings to return.
+"""
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import numpy as np
+
+LOADTEST_PASSWORD = 'loadtest-password'
+LOADTEST_USER_PREFIX = 'loadtest-'
+
+MIX = {
+    "token": 10,
+    "sessions": 25,
+    "tutorials": 15,
+    "history": 20,
+    "history_save": 5,
+    "usersessionresult": 20,
+    "process_video": 5,
+}
+
+
+def parse_mix(text):
+    """``"sessions=3,process_video=1"`` -> weights; endpoints left out get none."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in MIX:
+            raise ValueError(f"Unknown endpoint {name!r}; choose from {', '.join(MIX)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+def parse_ramp(text):
+    """``"1:10,4:20"`` -> [(concurrency, seconds), ...]."""
+    stages = []
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        concurrency, _, seconds = part.partition(':')
+        stages.append((int(concurrency), float(seconds or 10)))
+    if not stages or any(concurrency < 1 or seconds <= 0 for concurrency, seconds in stages):
+        raise ValueError("Stages are concurrency:seconds with both positive")
+    return stages
+
+
+def seed(users=20, results_per_user=5):
+    """
+    Create the load test accounts and the rows their requests read. Safe to
+    run again; existing rows are reused. Returns the number of sessions.
+    """
+    from django.contrib.auth.models import User
+    from django.db import transaction
+
+    from .models import History, Session, Tutorial, UserSessionResult
+    from .reference_index import get_reference_index
+
+    exercises = sorted(get_reference_index().stats()["exercises"]) or ["squat"]
+    with transaction.atomic():
+        sessions = []
+        for key in exercises:
+            title = key.replace('_', ' ').title()
+            session, _ = Session.objects.get_or_create(
+                title=title, defaults={"description": f"{title} (load test)", "video": f"tutorial_videos/{key}.mp4"},
+            )
+            sessions.append(session)
+            Tutorial.objects.get_or_create(
+                title=title, defaults={"description": f"{title} tutorial (load test)", "video": f"tutorial_videos/{key}.mp4"},
+            )
+
+        for i in range(users):
+            user, created = User.objects.get_or_create(username=f"{LOADTEST_USER_PREFIX}{i}")
+            if not created:
+                continue
+            user.set_password(LOADTEST_PASSWORD)
+            user.save()
+            for n in range(results_per_user):
+                session = sessions[(i + n) % len(sessions)]
+                History.objects.get_or_create(user=user, session=session, defaults={"weight": 70, "accuracy_score": 80})
+                UserSessionResult.objects.create(
+                    user=user, session=session, accuracy_score=60 + n, calories=10.0 + n, duration=1.5,
+                )
+    return len(sessions)
+
+
+class Client:
+    """One virtual user's keep-alive connection to the server."""
+
+    def __init__(self, base_url, username, timeout=120):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.prefix = parts.path.rstrip('/')
+        self.username = username
+        self.token = None
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        if content_type:
+            headers['Content-Type'] = content_type
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Start over with a fresh connection next time
+            self.connection.close()
+            raise
+        return response.status, data
+
+    def login(self):
+        status, data = self.request(
+            'POST', '/api/token/', json.dumps({"username": self.username, "password": LOADTEST_PASSWORD}),
+            'application/json',
+        )
+        if status == 200:
+            self.token = json.loads(data)["access"]
+        return status
+
+
+def multipart(fields, files):
+    """A multipart/form-data body: (content type, bytes)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+def _endpoints(sessions, clip):
+    """Name -> function(client, rng) making that request and returning its status."""
+    def history_save(client, rng):
+        session = rng.choice(sessions)
+        body = json.dumps({"session": session["id"], "accuracy_score": rng.uniform(50, 100), "weight": 70})
+        return client.request('POST', '/api/history/', body, 'application/json')[0]
+
+    def process_video(client, rng):
+        session = rng.choice(sessions)
+        content_type, body = multipart(
+            {"session": session["id"], "title": session["title"], "weight": 70},
+            {"uploaded_video": ("clip.mp4", clip, "video/mp4")},
+        )
+        return client.request('POST', '/api/process_video/', body, content_type)[0]
+
+    return {
+        "token": lambda client, rng: client.login(),
+        "sessions": lambda client, rng: client.request('GET', '/api/sessions/')[0],
+        "tutorials": lambda client, rng: client.request('GET', '/api/tutorials/')[0],
+        "history": lambda client, rng: client.request('GET', '/api/history/')[0],
+        "history_save": history_save,
+        "usersessionresult": lambda client, rng: client.request('GET', '/api/usersessionresult/')[0],
+        "process_video": process_video,
+    }
+
+
+def run_stage(base_url, mix, concurrency, seconds, clip, users=20, seed_value=0):
+    """
+    ``concurrency`` virtual users sending ``mix`` for ``seconds``. Returns
+    (endpoint, status or None on a connection error, seconds) samples and
+    the seconds until the last request finished.
+    """
+    probe = Client(base_url, f"{LOADTEST_USER_PREFIX}0")
+    if probe.login() != 200:
+        raise RuntimeError(f"Could not log in as {probe.username}; run manage.py loadtest --seed first")
+    status, data = probe.request('GET', '/api/sessions/')
+    sessions = json.loads(data) if status == 200 else []
+    sessions = sessions.get("results", sessions) if isinstance(sessions, dict) else sessions
+    if not sessions:
+        raise RuntimeError("The server has no sessions; run manage.py loadtest --seed first")
+
+    endpoints = _endpoints(sessions, clip)
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    samples = []
+    lock = threading.Lock()
+
+    def virtual_user(number):
+        rng = random.Random(seed_value * 1000 + number)
+        client = Client(base_url, f"{LOADTEST_USER_PREFIX}{number % users}")
+        client.login()
+        deadline = stage_started + seconds
+        mine = []
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = endpoints[name](client, rng)
+            except (OSError, http.client.HTTPException):
+                status = None
+            mine.append((name, status, time.perf_counter() - started))
+        with lock:
+            samples.extend(mine)
+
+    stage_started = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - stage_started
+
+
+def summarize(samples, seconds):
+    """Per-endpoint (and "all") request counts, throughput, error rate and latency percentiles."""
+    groups = {}
+    for name, status, elapsed in samples:
+        groups.setdefault(name, []).append((status, elapsed))
+        groups.setdefault("all", []).append((status, elapsed))
+    summary = {}
+    for name, rows in sorted(groups.items()):
+        latencies = np.array([elapsed for _, elapsed in rows]) * 1000
+        errors = sum(1 for status, _ in rows if status is None or status >= 400)
+        statuses = {}
+        for status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary[name] = {
+            "requests": len(rows),
+            "rps": round(len(rows) / seconds, 2),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4),
+            "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1),
+            "statuses": statuses,
+        }
+    return summary
+
+
+def synthetic_clip(frames=60, width=320, height=240):
+    """The bytes of a short mp4 of a figure doing squats (benchmarks.synthetic_video)."""
+    import tempfile
+
+    from .benchmarks import synthetic_video
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'clip.mp4')
+        synthetic_video(path, frames, width, height)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"The server didn't start listening on port {port} within {timeout}s")
+
+
+SERVERS = ("runserver", "gunicorn", "gunicorn-asgi")
+
+
+@contextmanager
+def boot(directory, database_url=None, server="runserver", workers=2, users=20, extra_env=None):
+    """
+    Start the project on a free local port with its data under ``directory``:
+    migrate, seed, then run ``server``. Yields the base URL.
+    """
+    manage = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'manage.py')]
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url or f"sqlite:///{os.path.join(directory, 'loadtest.sqlite3')}",
+        "MEDIA_LOCAL_ONLY": "True",
+        "MEDIA_ROOT": os.path.join(directory, 'media'),
+        "RESULT_VIDEO_STAGING_DIR": os.path.join(directory, 'result_uploads'),
+        "ANALYSIS_JOB_UPLOAD_DIR": os.path.join(directory, 'job_uploads'),
+        "KEYPOINT_CACHE_DIR": os.path.join(directory, 'keypoint_cache'),
+        **(extra_env or {}),
+    }
+    subprocess.run(manage + ['migrate', '--noinput', '-v', '0'], env=env, check=True)
+    subprocess.run(manage + ['loadtest', '--seed', '--users', str(users)], env=env, check=True)
+
+    port = _free_port()
+    if server == "runserver":
+        command = manage + ['runserver', f'127.0.0.1:{port}', '--noreload']
+    else:
+        command = [
+            sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '-w', str(workers), '--timeout', '300',
+        ]
+        if server == "gunicorn-asgi":
+            command += ['-k', 'uvicorn_worker.UvicornWorker', 'backend.asgi:application']
+        else:
+            command += ['-k', 'gthread', '--threads', '4', 'backend.wsgi:application']
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(manage[1]))
+    try:
+        _wait_for_port(port, process)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmark keypoint extraction, DTW, reference loading and process_video on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('patterns', nargs='*', help="Only run benchmarks matching these fnmatch patterns, e.g. 'dtw_distance/*'")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark (after one warm-up run)")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--compare', metavar='BASELINE', help="Compare against a JSON file written by --output")
+        parser.add_argument('--threshold', type=float, default=0.25, help="Relative slowdown counted as a regression")
+
+    def handle(self, *args, patterns, repeat, output, compare, threshold, **options):
+        baseline = None
+        if compare:
+            try:
+                with open(compare) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Could not read baseline {compare}: {exc}")
+
+        self.stdout.write(f"Suites: {', '.join(benchmarks.SUITES)}")
+        results = benchmarks.run_benchmarks(patterns, repeat=repeat, report=self.stdout.write)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {output}")
+
+        if baseline is None:
+            return
+        rows = benchmarks.compare(results, baseline, threshold)
+        for name, before, after, ratio, verdict in rows:
+            line = f"{name}: {before * 1000:.1f} -> {after * 1000:.1f} ms ({ratio:.2f}x) {verdict}"
+            if verdict == "regression":
+                self.stdout.write(self.style.ERROR(line))
+            elif verdict == "improvement":
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+        regressions = [row for row in rows if row[4] == "regression"]
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}")
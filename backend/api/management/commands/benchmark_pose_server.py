@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+import threading
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import synthetic_video
+from api.pose import SamplingOptions
+from api.pose_server import PoseServer, drive
+
+
+def read_frames(video_path, max_dimension, limit):
+    """The first ``limit`` frames of a video as RGB arrays, downscaled like uploads."""
+    options = SamplingOptions(max_dimension=max_dimension)
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(options.resize(frame), cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+class Command(BaseCommand):
+    help = "Measure pose server throughput and latency with concurrent videos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.POSE_SERVER_SOCKET, help="Socket of a running pose server")
+        parser.add_argument('--start-server', action='store_true',
+                            help="Start a server in this process (on a temporary socket unless --socket is given)")
+        parser.add_argument('--workers', type=int, default=settings.POSE_SERVER_WORKERS, help="With --start-server")
+        parser.add_argument('--batch-size', type=int, default=settings.POSE_SERVER_BATCH_SIZE, help="With --start-server")
+        parser.add_argument('--video', help="Clip to send; a synthetic 640x480 clip by default")
+        parser.add_argument('--frames', type=int, default=60, help="Frames per video")
+        parser.add_argument('--max-dimension', type=int, default=settings.POSE_MAX_DIMENSION or 640)
+        parser.add_argument('--concurrency', default='1,2,4,8', help="Comma-separated concurrent videos, run in turn")
+        parser.add_argument('--videos', type=int, help="Videos per concurrency level (default 2x the level)")
+        parser.add_argument('--window', type=int, default=1, help="Frames each client keeps in flight")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, socket, start_server, workers, batch_size, video, frames, max_dimension,
+               concurrency, videos, window, output, **options):
+        try:
+            levels = [int(level) for level in concurrency.split(',')]
+        except ValueError:
+            raise CommandError("--concurrency must be comma-separated integers")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            if video is None:
+                video = os.path.join(tmp, 'clip.mp4')
+                synthetic_video(video, frames, 640, 480)
+            clip = read_frames(video, max_dimension, frames)
+            if not clip:
+                raise CommandError(f"Could not read frames from {video}")
+
+            server = None
+            if start_server:
+                socket = socket or os.path.join(tmp, 'pose.sock')
+                server = PoseServer(socket, workers=workers, batch_size=batch_size, max_videos=max(levels))
+                threading.Thread(target=server.run, daemon=True).start()
+                server.ready.wait()
+            elif not socket:
+                raise CommandError("Pass --socket, set POSE_SERVER_SOCKET or use --start-server")
+
+            results = []
+            try:
+                for level in levels:
+                    result = drive(socket, clip, level, videos=videos or 2 * level, window=window)
+                    results.append(result)
+                    frame_ms, video_ms = result["frame_latency_ms"] or {}, result["video_latency_ms"] or {}
+                    self.stdout.write(
+                        f"concurrency {level}: {result['frames_per_second']} frames/s, "
+                        f"frame p50/p95/p99 {frame_ms.get('p50')}/{frame_ms.get('p95')}/{frame_ms.get('p99')} ms, "
+                        f"video p50 {video_ms.get('p50')} ms, mean batch {result['server']['mean_batch']}, "
+                        f"busy {result['busy']}, errors {result['errors']}"
+                    )
+            finally:
+                if server is not None:
+                    server.stop()
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {output}")
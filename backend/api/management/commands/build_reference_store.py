@@ -0,0 +1,51 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.reference_index import strip_suffix
+from api.reference_store import DTYPES, convert_folder
+
+
+class Command(BaseCommand):
+    help = "Pack the per-video .npy folders in REFERENCE_DATA_DIR into consolidated memory-mappable stores"
+
+    def add_arguments(self, parser):
+        parser.add_argument('exercises', nargs='*', help="Folder names to convert (default: all)")
+        parser.add_argument('--data-dir', default=str(settings.REFERENCE_DATA_DIR))
+        parser.add_argument('--dtype', choices=DTYPES, default='float32')
+        parser.add_argument(
+            '--remove-source', action='store_true',
+            help="Delete the per-video files once packed (preprocess_references will then re-extract them)",
+        )
+
+    def handle(self, *args, **options):
+        data_dir = options['data_dir']
+        if not os.path.isdir(data_dir):
+            raise CommandError(f"{data_dir} does not exist")
+        folders = sorted(
+            name for name in os.listdir(data_dir)
+            if os.path.isdir(os.path.join(data_dir, name)) and name.lower().endswith('_npy')
+        )
+        wanted = {strip_suffix(name).lower() for name in options['exercises']}
+        if wanted:
+            folders = [name for name in folders if strip_suffix(name).lower() in wanted]
+        if not folders:
+            raise CommandError("No reference folders to convert")
+
+        source_total = store_total = 0
+        for folder in folders:
+            try:
+                summary = convert_folder(
+                    os.path.join(data_dir, folder), data_dir,
+                    dtype=options['dtype'], remove_source=options['remove_source'],
+                )
+            except ValueError as exc:
+                raise CommandError(f"{folder}: {exc}")
+            source_total += summary['source_bytes']
+            store_total += summary['store_bytes']
+            self.stdout.write(
+                f"{summary['name']}: {summary['sequences']} sequences, {summary['frames']} frames, "
+                f"{summary['source_bytes'] / 1e6:.1f} MB -> {summary['store_bytes'] / 1e6:.1f} MB"
+            )
+        self.stdout.write(f"Total: {source_total / 1e6:.1f} MB -> {store_total / 1e6:.1f} MB")
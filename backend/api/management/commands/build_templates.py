@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.reference_index import ReferenceIndex
+from api.templates import DEFAULT_CLUSTERS, DEFAULT_ITERATIONS, build_templates, write_templates
+
+
+class Command(BaseCommand):
+    help = "Cluster each exercise's references and store one DBA template per cluster (REFERENCE_MODE=templates)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('exercises', nargs='*', help="Exercise keys to build, e.g. squat (default: all)")
+        parser.add_argument('--data-dir', default=str(settings.REFERENCE_DATA_DIR))
+        parser.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS, help="Templates per exercise")
+        parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help="DBA refinement rounds")
+
+    def handle(self, *args, exercises, data_dir, clusters, iterations, **options):
+        if not os.path.isdir(data_dir):
+            raise CommandError(f"{data_dir} does not exist")
+        if clusters < 2:
+            raise CommandError("--clusters must be at least 2: scores are relative to the farthest template")
+        index = ReferenceIndex(data_dir)
+        keys = sorted(index.load().references)
+        if exercises:
+            unknown = {name.lower() for name in exercises} - set(keys)
+            if unknown:
+                raise CommandError(f"Unknown exercises: {', '.join(sorted(unknown))}")
+            keys = [key for key in keys if key in {name.lower() for name in exercises}]
+
+        for key in keys:
+            references = index.references(key)
+            if len(references) < 2:
+                self.stdout.write(f"{key}: skipped, {len(references)} reference(s)")
+                continue
+            start = time.perf_counter()
+            built = build_templates(references, index.features(key), clusters, iterations)
+            write_templates(data_dir, key, built)
+            sizes = ', '.join(
+                f"{len(stats['members'])} (spread {stats['spread_mean']:.2f}/{stats['spread_max']:.2f})"
+                for _, _, stats in built['features']
+            )
+            self.stdout.write(
+                f"{key}: {len(references)} references -> {len(built['keypoints'])} templates "
+                f"in {time.perf_counter() - start:.1f}s; cluster sizes (feature spread mean/max): {sizes}"
+            )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.keypoint_cache import get_keypoint_cache
+
+
+class Command(BaseCommand):
+    help = "Show keypoint cache statistics, or purge the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge', action='store_true', help="Delete every cached entry")
+        parser.add_argument('--reset-counters', action='store_true', help="With --purge, also zero the hit/miss counters")
+        parser.add_argument('--evict', action='store_true', help="Evict entries until the cache fits its size limit")
+
+    def handle(self, *args, purge, reset_counters, evict, **options):
+        cache = get_keypoint_cache()
+        if cache is None:
+            raise CommandError("The keypoint cache is disabled (KEYPOINT_CACHE_ENABLED)")
+
+        if purge:
+            removed = cache.purge(reset_counters=reset_counters)
+            self.stdout.write(f"Removed {removed} entries")
+        elif evict:
+            self.stdout.write(f"Evicted {cache.evict()} entries")
+
+        stats = cache.stats()
+        self.stdout.write(f"Directory: {stats['directory']}")
+        self.stdout.write(
+            f"Entries: {stats['entries']} "
+            f"({stats['bytes'] / (1024 * 1024):.1f} of {stats['max_bytes'] / (1024 * 1024):.0f} MB)"
+        )
+        hit_rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else "n/a"
+        self.stdout.write(
+            f"Hits: {stats.get('hits', 0)}  Misses: {stats.get('misses', 0)}  "
+            f"Evictions: {stats.get('evictions', 0)}  Hit rate: {hit_rate}"
+        )
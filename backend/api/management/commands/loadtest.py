@@ -0,0 +1,70 @@
+import json
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import loadtest
+
+
+class Command(BaseCommand):
+    help = "Load test the REST API with a mix of requests and report throughput, latency and errors per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--boot', action='store_true',
+                            help="Start a server on a temporary database, with files kept locally instead of Cloudinary")
+        parser.add_argument('--database-url', help="With --boot, a (Postgres) database to use instead of temporary SQLite")
+        parser.add_argument('--server', choices=loadtest.SERVERS, default='runserver', help="With --boot")
+        parser.add_argument('--workers', type=int, default=2, help="With --boot and gunicorn")
+        parser.add_argument('--seed', action='store_true', help="Only create the load test accounts and data, then exit")
+        parser.add_argument('--users', type=int, default=20, help="Seeded accounts the virtual users log in as")
+        parser.add_argument('--mix', default=','.join(f"{name}={weight}" for name, weight in loadtest.MIX.items()),
+                            help="Endpoint weights, e.g. 'sessions=5,history=2,process_video=1'")
+        parser.add_argument('--ramp', default='1:10,4:20,8:20', help="Stages of concurrency:seconds, run in turn")
+        parser.add_argument('--clip-frames', type=int, default=60, help="Frames of the synthetic process_video clip")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, url, boot, database_url, server, workers, seed, users, mix, ramp, clip_frames, output,
+               **options):
+        if seed:
+            sessions = loadtest.seed(users=users)
+            self.stdout.write(f"Seeded {users} users and {sessions} sessions")
+            return
+        if bool(url) == boot:
+            raise CommandError("Pass either --url or --boot")
+        try:
+            weights = loadtest.parse_mix(mix)
+            stages = loadtest.parse_ramp(ramp)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        clip = loadtest.synthetic_clip(clip_frames) if weights.get("process_video") else b''
+
+        if not boot:
+            results = self.run_stages(url, weights, stages, clip, users)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                with loadtest.boot(directory, database_url, server, workers, users) as base_url:
+                    self.stdout.write(f"Started {server} at {base_url}")
+                    results = self.run_stages(base_url, weights, stages, clip, users)
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {output}")
+
+    def run_stages(self, base_url, weights, stages, clip, users):
+        results = []
+        for concurrency, seconds in stages:
+            try:
+                samples, elapsed = loadtest.run_stage(base_url, weights, concurrency, seconds, clip, users=users)
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            summary = loadtest.summarize(samples, elapsed)
+            results.append({"concurrency": concurrency, "seconds": round(elapsed, 2), "endpoints": summary})
+            self.stdout.write(f"\nconcurrency {concurrency} for {seconds:g}s")
+            self.stdout.write(f"{'endpoint':<20}{'requests':>9}{'rps':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+            for name, row in summary.items():
+                line = (f"{name:<20}{row['requests']:>9}{row['rps']:>9.2f}{row['error_rate']:>8.1%}"
+                        f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+                self.stdout.write(self.style.ERROR(line) if row['errors'] else line)
+        return results
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.pose import SamplingOptions
+from api.preprocessing import preprocess_dataset, update_stores
+from api.reference_store import DTYPES
+
+
+class Command(BaseCommand):
+    help = "Extract reference keypoints for new or changed clips into REFERENCE_DATA_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.REFERENCE_SOURCE_DIR), help="Folder of <exercise>/<clip> videos")
+        parser.add_argument('--output', default=str(settings.REFERENCE_DATA_DIR))
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument('--force', action='store_true', help="Re-extract every clip")
+        parser.add_argument('--prune', action='store_true', help="Delete outputs whose source clip is gone")
+        parser.add_argument('--csv', action='store_true', help="Also write a .csv copy of each sequence")
+        parser.add_argument(
+            '--consolidate', choices=DTYPES, nargs='?', const='float32', default=None,
+            help="Also pack exercises that changed and have no consolidated store yet (see "
+                 "build_reference_store); existing stores of changed exercises are always rebuilt",
+        )
+        # Defaults match what the API uses for uploads
+        parser.add_argument('--target-fps', type=float, default=settings.POSE_TARGET_FPS)
+        parser.add_argument('--max-dimension', type=int, default=settings.POSE_MAX_DIMENSION)
+        parser.add_argument('--max-duration', type=float, default=settings.POSE_MAX_DURATION)
+
+    def handle(self, *args, **options):
+        sampling = SamplingOptions(options['target_fps'], options['max_dimension'], options['max_duration'])
+        try:
+            summary = preprocess_dataset(
+                options['source'], options['output'], sampling,
+                workers=options['workers'], force=options['force'],
+                prune=options['prune'], csv=options['csv'],
+                report=self.stdout.write,
+            )
+        except FileNotFoundError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"Extracted {summary['extracted']}, skipped {summary['skipped']}, "
+            f"pruned {summary['pruned']}, failed {len(summary['failed'])} in {summary['seconds']}s"
+        )
+        update_stores(options['output'], summary, dtype=options['consolidate'], report=self.stdout.write)
+        if summary['failed']:
+            raise CommandError(f"{len(summary['failed'])} clips failed")
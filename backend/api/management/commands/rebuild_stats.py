@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-user progress statistics from UserSessionResult rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Users to rebuild (default: everyone)")
+
+    def handle(self, *args, usernames, **options):
+        users = User.objects.order_by('id')
+        if usernames:
+            users = users.filter(username__in=usernames)
+            missing = set(usernames) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        user_ids = list(users.values_list('id', flat=True))
+        # One transaction per user keeps locks short
+        for user_id in user_ids:
+            rebuild([user_id])
+        self.stdout.write(f"Rebuilt statistics for {len(user_ids)} users")
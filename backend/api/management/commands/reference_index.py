@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.reference_index import get_reference_index
+
+
+class Command(BaseCommand):
+    help = "Load the reference keypoint index and report its size and load time"
+
+    def handle(self, *args, **options):
+        index = get_reference_index()
+        index.load()
+        stats = index.stats()
+        for key, count in stats["exercises"].items():
+            self.stdout.write(f"{key}: {count} sequences")
+        self.stdout.write(
+            f"Total: {stats['sequences']} sequences, "
+            f"{stats['memory_bytes'] / (1024 * 1024):.1f} MB in memory, "
+            f"{stats['mapped_bytes'] / (1024 * 1024):.1f} MB mapped, "
+            f"loaded in {stats['load_seconds']:.2f}s"
+        )
+        if options["verbosity"] > 1:
+            self.stdout.write(json.dumps(stats, indent=2))
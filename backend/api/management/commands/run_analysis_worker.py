@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from api.jobs import get_queue, run_job
+from api.video_uploads import upload_due_videos
+
+
+def work(worker_id, poll_interval, once=False):
+    queue = get_queue()
+    while True:
+        close_old_connections()
+        job = queue.claim(worker_id)
+        if job is None:
+            # Idle: retry result video uploads that are due or were abandoned
+            if upload_due_videos():
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+
+
+class Command(BaseCommand):
+    help = "Run background video analysis jobs queued by process_video, and retry result video uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of worker processes")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit when there are no more jobs to run")
+
+    def handle(self, *args, concurrency, poll_interval, once, **options):
+        base_id = f"{socket.gethostname()}:{os.getpid()}"
+        if concurrency <= 1:
+            self.stdout.write(f"Worker {base_id} waiting for jobs")
+            work(base_id, poll_interval, once)
+            return
+
+        # Each process gets its own DB connection
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=work, args=(f"{base_id}/{n}", poll_interval, once), daemon=True)
+            for n in range(concurrency)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {concurrency} workers ({base_id})")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
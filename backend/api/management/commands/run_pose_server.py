@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.pose_server import PoseServer
+
+
+class Command(BaseCommand):
+    help = "Serve pose estimation to the web workers over a Unix socket (POSE_SERVER_SOCKET)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.POSE_SERVER_SOCKET, help="Path of the Unix socket to listen on")
+        parser.add_argument('--workers', type=int, default=settings.POSE_SERVER_WORKERS, help="Inference processes")
+        parser.add_argument('--batch-size', type=int, default=settings.POSE_SERVER_BATCH_SIZE,
+                            help="Most frames sent to a worker at once")
+        parser.add_argument('--window', type=int, default=settings.POSE_SERVER_WINDOW,
+                            help="Frames one video may have queued before its socket stops being read")
+        parser.add_argument('--max-videos', type=int, default=settings.POSE_SERVER_MAX_VIDEOS,
+                            help="Videos served at once; more connections are told the server is busy")
+
+    def handle(self, *args, socket, workers, batch_size, window, max_videos, **options):
+        if not socket:
+            raise CommandError("Pass --socket or set POSE_SERVER_SOCKET")
+        server = PoseServer(socket, workers=workers, batch_size=batch_size, window=window, max_videos=max_videos)
+        self.stdout.write(f"Serving pose estimation on {socket} with {workers} workers")
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            pass
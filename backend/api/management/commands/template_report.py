@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.analysis import SCORING_MODES
+from api.reference_index import ReferenceIndex
+from api.templates import DEFAULT_CLUSTERS, DEFAULT_ITERATIONS, compare_modes
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare whole-clip scores and DTW time against every reference and against DBA templates, "
+        "scoring held-out references of the dataset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('exercises', nargs='*', help="Exercise keys to compare (default: all)")
+        parser.add_argument('--data-dir', default=str(settings.REFERENCE_DATA_DIR))
+        parser.add_argument('--scoring-mode', choices=SCORING_MODES, default=settings.SCORING_MODE)
+        parser.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS)
+        parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+        parser.add_argument('--holdout-every', type=int, default=5, help="Every Nth reference is a query")
+        parser.add_argument('--output', help="Write the per-query results as JSON to this file")
+
+    def handle(self, *args, exercises, data_dir, scoring_mode, clusters, iterations, holdout_every, output,
+               **options):
+        index = ReferenceIndex(data_dir)
+        keys = sorted(index.load().references)
+        if exercises:
+            keys = [key for key in keys if key in {name.lower() for name in exercises}]
+        if not keys:
+            raise CommandError("No exercises to compare")
+
+        self.stdout.write(
+            f"{'exercise':<16} {'refs':>4} {'tmpl':>4} {'queries':>7} {'mean |diff|':>11} {'max |diff|':>10} "
+            f"{'corr':>5} {'full ms':>8} {'tmpl ms':>8} {'speedup':>7}"
+        )
+        report = {}
+        all_diffs = []
+        total_full = total_template = 0.0
+        for key in keys:
+            result = compare_modes(
+                index.references(key), index.features(key), scoring_mode, clusters, iterations,
+                holdout_every=holdout_every, band=settings.DTW_BAND,
+            )
+            if result is None:
+                self.stdout.write(f"{key:<16} skipped, too few references")
+                continue
+            rows = result["queries"]
+            full = np.array([row[1] for row in rows])
+            template = np.array([row[2] for row in rows])
+            diffs = np.abs(full - template)
+            all_diffs.extend(diffs)
+            full_seconds = sum(row[3] for row in rows)
+            template_seconds = sum(row[4] for row in rows)
+            total_full += full_seconds
+            total_template += template_seconds
+            corr = float('nan')
+            if len(rows) > 1 and full.std() and template.std():
+                corr = np.corrcoef(full, template)[0, 1]
+            self.stdout.write(
+                f"{key:<16} {result['references']:>4} {result['templates']:>4} {len(rows):>7} "
+                f"{diffs.mean():>11.1f} {diffs.max():>10.1f} {corr:>5.2f} "
+                f"{full_seconds / len(rows) * 1000:>8.1f} {template_seconds / len(rows) * 1000:>8.1f} "
+                f"{full_seconds / template_seconds:>6.1f}x"
+            )
+            report[key] = {
+                "references": result["references"],
+                "templates": result["templates"],
+                "build_seconds": round(result["build_seconds"], 2),
+                "queries": [
+                    {"name": name, "full": full_score, "templates": template_score,
+                     "full_ms": round(full_s * 1000, 2), "templates_ms": round(template_s * 1000, 2)}
+                    for name, full_score, template_score, full_s, template_s in rows
+                ],
+            }
+
+        if all_diffs:
+            self.stdout.write(
+                f"Overall: mean |diff| {np.mean(all_diffs):.1f} points, "
+                f"DTW time {total_full:.2f}s -> {total_template:.2f}s ({total_full / total_template:.1f}x faster)"
+            )
+        if output:
+            with open(output, 'w') as f:
+                json.dump({"scoring_mode": scoring_mode, "clusters": clusters, "exercises": report}, f, indent=2)
+            self.stdout.write(f"Wrote {output}")
@@ -0,0 +1,309 @@
+"""
+Per-stage timing of video analysis, and Prometheus metrics.
+
+A request (or background job) runs inside ``timed()``, which makes a
+StageTimer current for the code it calls. ``stage(name)`` blocks anywhere in
+the pipeline add their duration to it; decode and inference times measured
+by extract_keypoints come in through ``add_stages``. When the request ends
+the stages are sent as a Server-Timing header, logged as one JSON line on
+the ``api.metrics`` logger and added to histograms served by the
+``metrics`` view in the Prometheus text format.
+
+With METRICS_ENABLED off, ``timed()`` sets nothing and ``stage()`` returns
+a shared no-op context manager, so the cost is a context variable lookup.
+
+Each process keeps its own registry. With METRICS_DIR set, every process
+(web workers and run_analysis_worker alike) also writes its registry to
+``<METRICS_DIR>/<pid>.json`` after each request or job, and the endpoint
+serves the sum over all files.
+"""
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FRAME_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 2400, 4800)
+DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "gymfreak_stage_seconds": (
+        "histogram", "Time spent in each stage of video analysis", STAGE_BUCKETS),
+    "gymfreak_video_frames": (
+        "histogram", "Frames analysed per video", FRAME_BUCKETS),
+    "gymfreak_video_duration_seconds": (
+        "histogram", "Duration of analysed videos", DURATION_BUCKETS),
+    "gymfreak_dtw_evaluations_total": (
+        "counter", "Reference DTW alignments run to completion", None),
+    "gymfreak_dtw_avoided_total": (
+        "counter", "Reference DTW alignments pruned or abandoned early", None),
+    "gymfreak_analyses_total": (
+        "counter", "Analysed uploads by outcome", None),
+    "gymfreak_catalog_requests_total": (
+        "counter", "Catalog requests by cache result (hit, miss, not_modified)", None),
+    "gymfreak_stream_message_seconds": (
+        "histogram", "Time to score one message of a live stream", STAGE_BUCKETS),
+    "gymfreak_stream_frames_total": (
+        "counter", "Frames scored over live streams", None),
+}
+
+# Seconds between registry writes to METRICS_DIR triggered by inc()
+FLUSH_INTERVAL = 10
+
+_NULL = nullcontext()
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+class Registry:
+    """Histograms and counters of one process, keyed by metric name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}  # (name, labels) -> [bucket counts..., sum, count] or [total]
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self.values.setdefault(key, [0])
+            series[0] += amount
+
+    def dump(self):
+        with self._lock:
+            return [[name, list(labels), list(series)] for (name, labels), series in self.values.items()]
+
+
+registry = Registry()
+
+
+def merge(dumps):
+    merged = {}
+    for dump in dumps:
+        for name, labels, series in dump:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key in merged:
+                merged[key] = [a + b for a, b in zip(merged[key], series)]
+            else:
+                merged[key] = list(series)
+    return merged
+
+
+_last_flush = 0.0
+
+
+def flush():
+    """Write this process's registry to METRICS_DIR, if configured."""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    _last_flush = time.monotonic()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(registry.dump(), f)
+        os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+    except OSError:
+        logger.exception("Could not write metrics to %s", directory)
+
+
+def inc(name, amount=1, **labels):
+    """Count an event outside a timed request; a no-op when metrics are off."""
+    if not enabled():
+        return
+    registry.inc(name, amount, **labels)
+    if time.monotonic() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def observe(name, value, **labels):
+    """Add a histogram sample outside a timed request; a no-op when metrics are off."""
+    if not enabled():
+        return
+    registry.observe(name, value, **labels)
+    if time.monotonic() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def collect():
+    """All series, summed over every process when METRICS_DIR is set."""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return merge([registry.dump()])
+    flush()
+    dumps = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                dumps.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merge(dumps)
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(series, gauges=()):
+    """Prometheus text exposition of merged series plus (name, help, labels, value) gauges."""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (series_name, labels), values in sorted(series.items()):
+            if series_name != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {values[0]}")
+                continue
+            for bound, count in zip(buckets, values):
+                lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {values[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+
+    seen = set()
+    for name, help_text, labels, value in gauges:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def reference_gauges():
+    """Reference sequence counts per exercise, if this process has loaded the index."""
+    from .reference_index import get_reference_index
+
+    index = get_reference_index()
+    if not index.loaded:
+        return []
+    return [
+        ("gymfreak_reference_sequences", "Reference sequences loaded per exercise", {"exercise": key}, count)
+        for key, count in index.stats()["exercises"].items()
+    ]
+
+
+class StageTimer:
+    """Durations of the named stages of one request or job, in order."""
+
+    def __init__(self):
+        self.stages = {}
+        self.context = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+_current = contextvars.ContextVar('stage_timer', default=None)
+
+
+def stage(name):
+    """Time a block as ``name`` in the current request; a no-op when metrics are off."""
+    timer = _current.get()
+    if timer is None:
+        return _NULL
+    return timer.stage(name)
+
+
+def add_stages(stages):
+    """Add stage durations measured elsewhere (e.g. in the upload thread)."""
+    timer = _current.get()
+    if timer is not None and stages:
+        for name, seconds in stages.items():
+            timer.add(name, seconds)
+
+
+def note(**context):
+    """Attach facts about the request (exercise, frames, ...) to its log line and metrics."""
+    timer = _current.get()
+    if timer is not None:
+        timer.context.update(context)
+
+
+@contextmanager
+def timed(event):
+    """
+    Run a request or job with a current StageTimer and record it when done.
+    Yields the timer, or None when metrics are disabled.
+    """
+    if not enabled():
+        yield None
+        return
+    timer = StageTimer()
+    token = _current.set(timer)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+        timer.add('total', time.perf_counter() - start)
+        record(event, timer)
+
+
+def record(event, timer):
+    context = timer.context
+    exercise = context.get('exercise') or 'unknown'
+    for name, seconds in timer.stages.items():
+        registry.observe("gymfreak_stage_seconds", seconds, event=event, stage=name)
+    if context.get('frames') is not None:
+        registry.observe("gymfreak_video_frames", context['frames'], exercise=exercise)
+    if context.get('duration_seconds') is not None:
+        registry.observe("gymfreak_video_duration_seconds", context['duration_seconds'], exercise=exercise)
+    search = context.get('search')
+    if search:
+        registry.inc("gymfreak_dtw_evaluations_total", search['evaluated'], exercise=exercise)
+        registry.inc("gymfreak_dtw_avoided_total", search['avoided'], exercise=exercise)
+    registry.inc("gymfreak_analyses_total", event=event, outcome=context.get('outcome', 'unknown'))
+    flush()
+
+    logger.info(json.dumps({
+        "event": event,
+        "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in timer.stages.items()},
+        **{key: value for key, value in context.items() if key != 'search'},
+        **({"dtw": search} if search else {}),
+    }))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='sample_fps',
+            field=models.FloatField(blank=True, help_text='Frames per second actually analysed', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_usersessionresult_sample_fps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='scoring_mode',
+            field=models.CharField(blank=True, help_text='Blank uses settings.SCORING_MODE', max_length=16),
+        ),
+    ]
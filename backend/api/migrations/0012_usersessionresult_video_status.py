@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_analysisjob_scoring_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='staged_video',
+            field=models.FileField(blank=True, storage=api.models.result_video_staging_storage, upload_to='result_videos/'),
+        ),
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='video_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='video_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='video_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('stored', 'Stored'), ('failed', 'Failed')], db_index=True, default='stored', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='video_upload_after',
+            field=models.DateTimeField(blank=True, help_text='Next retry of a pending upload, or lease expiry of a running one', null=True),
+        ),
+        migrations.AlterField(
+            model_name='usersessionresult',
+            name='uploaded_video',
+            field=models.FileField(blank=True, help_text='Empty until video_status is stored', upload_to='tutorial_videos/'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_usersessionresult_video_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user', 'created_at'], name='history_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user', 'session'], name='history_user_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersessionresult',
+            index=models.Index(fields=['user', 'created_at'], name='result_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersessionresult',
+            index=models.Index(fields=['user', 'session'], name='result_user_session_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:33
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_history(apps, schema_editor):
+    # HistoryList.post updated the first (lowest id) row it found, so that
+    # one holds the latest values; racing POSTs created the others
+    History = apps.get_model('api', 'History')
+    duplicated = (
+        History.objects
+        .values('user', 'session')
+        .annotate(keep=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicated:
+        (History.objects
+         .filter(user=group['user'], session=group['session'])
+         .exclude(id=group['keep'])
+         .delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_history, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='history',
+            name='history_user_session_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='history',
+            constraint=models.UniqueConstraint(fields=('user', 'session'), name='history_unique_user_session'),
+        ),
+    ]
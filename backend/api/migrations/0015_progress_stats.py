@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_history_unique_user_session'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.PositiveIntegerField(default=0)),
+                ('calories', models.FloatField(default=0)),
+                ('duration', models.FloatField(default=0, help_text='Minutes')),
+                ('accuracy_sum', models.FloatField(default=0)),
+                ('accuracy_min', models.FloatField(blank=True, null=True)),
+                ('accuracy_max', models.FloatField(blank=True, null=True)),
+                ('last_day', models.DateField(blank=True, help_text='Most recent day with a result (UTC)', null=True)),
+                ('current_streak', models.PositiveIntegerField(default=0, help_text='Consecutive days with results up to last_day')),
+                ('longest_streak', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.PositiveIntegerField(default=0)),
+                ('calories', models.FloatField(default=0)),
+                ('duration', models.FloatField(default=0, help_text='Minutes')),
+                ('accuracy_sum', models.FloatField(default=0)),
+                ('accuracy_min', models.FloatField(blank=True, null=True)),
+                ('accuracy_max', models.FloatField(blank=True, null=True)),
+                ('day', models.DateField(help_text='UTC')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='daily_stats_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SessionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('results', models.PositiveIntegerField(default=0)),
+                ('calories', models.FloatField(default=0)),
+                ('duration', models.FloatField(default=0, help_text='Minutes')),
+                ('accuracy_sum', models.FloatField(default=0)),
+                ('accuracy_min', models.FloatField(blank=True, null=True)),
+                ('accuracy_max', models.FloatField(blank=True, null=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.session')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'session'), name='session_stats_unique')],
+            },
+        ),
+    ]
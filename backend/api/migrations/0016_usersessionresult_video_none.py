@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_progress_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersessionresult',
+            name='video_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('stored', 'Stored'), ('failed', 'Failed'), ('none', 'No video')], db_index=True, default='stored', max_length=16),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_usersessionresult_video_none'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='rep_count',
+            field=models.PositiveIntegerField(blank=True, help_text='Empty when scored without rep segmentation', null=True),
+        ),
+        migrations.AddField(
+            model_name='usersessionresult',
+            name='rep_scores',
+            field=models.JSONField(blank=True, default=list, help_text='Start and end seconds and accuracy of each rep'),
+        ),
+    ]
@@ -1,3 +1,7 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 
 from django.contrib.auth.models import User
@@ -43,18 +47,183 @@ class History(models.Model):
      weight = models.FloatField(help_text='Weight of the user')
      created_at = models.DateTimeField(default=timezone.now)
 
+     class Meta:
+         indexes = [
+             models.Index(fields=['user', 'created_at'], name='history_user_created_idx'),
+         ]
+         constraints = [
+             # One entry per user and session, updated in place (also serves (user, session) lookups)
+             models.UniqueConstraint(fields=['user', 'session'], name='history_unique_user_session'),
+         ]
+
+
+class SettingDirStorage(FileSystemStorage):
+    """Local storage under the directory named by a setting, looked up on use."""
+
+    def __init__(self, setting_name):
+        self.setting_name = setting_name
+        super().__init__()
+
+    @property
+    def base_location(self):
+        return getattr(settings, self.setting_name)
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def use_local_media_storage():
+    """Store the Cloudinary video fields under MEDIA_ROOT instead (MEDIA_LOCAL_ONLY)."""
+    for field in (Tutorial._meta.get_field('video'), Session._meta.get_field('video')):
+        field.storage = SettingDirStorage('MEDIA_ROOT')
+
+
+def result_video_staging_storage():
+    # Analysed uploads waiting to be copied to the default storage (see api/video_uploads.py)
+    return SettingDirStorage('RESULT_VIDEO_STAGING_DIR')
+
 
 class UserSessionResult(models.Model):
+    VIDEO_PENDING = 'pending'
+    VIDEO_UPLOADING = 'uploading'
+    VIDEO_STORED = 'stored'
+    VIDEO_FAILED = 'failed'
+    VIDEO_NONE = 'none'  # scored from client-side keypoints (process_keypoints)
+    VIDEO_STATUS_CHOICES = [
+        (VIDEO_PENDING, 'Pending'),
+        (VIDEO_UPLOADING, 'Uploading'),
+        (VIDEO_STORED, 'Stored'),
+        (VIDEO_FAILED, 'Failed'),
+        (VIDEO_NONE, 'No video'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     session = models.ForeignKey(Session, on_delete=models.CASCADE)
     accuracy_score = models.FloatField(help_text="Percentage accuracy of movements")
-    uploaded_video = models.FileField(upload_to='tutorial_videos/')
+    uploaded_video = models.FileField(upload_to='tutorial_videos/', blank=True, help_text='Empty until video_status is stored')
+    staged_video = models.FileField(upload_to='result_videos/', storage=result_video_staging_storage, blank=True)
+    video_status = models.CharField(max_length=16, choices=VIDEO_STATUS_CHOICES, default=VIDEO_STORED, db_index=True)
+    video_attempts = models.PositiveIntegerField(default=0)
+    video_upload_after = models.DateTimeField(
+        null=True, blank=True, help_text='Next retry of a pending upload, or lease expiry of a running one')
+    video_error = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     calories = models.FloatField(help_text='calories burned of the user', blank=True,null=True)
     duration = models.FloatField(help_text='Duration of exercises in minutes',blank=True,null=True)
+    sample_fps = models.FloatField(help_text='Frames per second actually analysed', blank=True, null=True)
+    rep_count = models.PositiveIntegerField(null=True, blank=True, help_text='Empty when scored without rep segmentation')
+    rep_scores = models.JSONField(default=list, blank=True, help_text='Start and end seconds and accuracy of each rep')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='result_user_created_idx'),
+            models.Index(fields=['user', 'session'], name='result_user_session_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.session.title} - {self.created_at.strftime('%Y-%m-%d')}"
 
 
 
+
+
+def analysis_job_storage():
+    # Uploads waiting for a worker; must be reachable from the worker processes
+    return SettingDirStorage('ANALYSIS_JOB_UPLOAD_DIR')
+
+
+class AnalysisJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE)
+    title = models.CharField(max_length=255, help_text='Session title sent with the upload')
+    weight = models.FloatField(default=0)
+    scoring_mode = models.CharField(max_length=16, blank=True, help_text='Blank uses settings.SCORING_MODE')
+    video = models.FileField(upload_to='analysis_jobs/', storage=analysis_job_storage, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    timeout_seconds = models.PositiveIntegerField(default=300)
+    run_after = models.DateTimeField(default=timezone.now, help_text='Not picked up before this time (retry backoff)')
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True, help_text='Lease expiry of the worker running the job')
+    error = models.TextField(blank=True)
+    result = models.ForeignKey(UserSessionResult, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"Job {self.pk} ({self.status}) - {self.user.username} - {self.title}"
+
+
+class StatsAggregate(models.Model):
+    """Running totals over a group of UserSessionResult rows (see api/stats.py)."""
+    results = models.PositiveIntegerField(default=0)
+    calories = models.FloatField(default=0)
+    duration = models.FloatField(default=0, help_text='Minutes')
+    accuracy_sum = models.FloatField(default=0)
+    accuracy_min = models.FloatField(null=True, blank=True)
+    accuracy_max = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def accuracy_avg(self):
+        return self.accuracy_sum / self.results if self.results else None
+
+    def add(self, result):
+        self.results += 1
+        self.calories += result.calories or 0
+        self.duration += result.duration or 0
+        self.accuracy_sum += result.accuracy_score
+        self.accuracy_min = min(self.accuracy_min, result.accuracy_score) if self.accuracy_min is not None else result.accuracy_score
+        self.accuracy_max = max(self.accuracy_max, result.accuracy_score) if self.accuracy_max is not None else result.accuracy_score
+
+    def remove(self, result, remaining):
+        """Take ``result`` out; min and max come from ``remaining``, the group's other results."""
+        self.results -= 1
+        self.calories -= result.calories or 0
+        self.duration -= result.duration or 0
+        self.accuracy_sum -= result.accuracy_score
+        bounds = remaining.aggregate(low=models.Min('accuracy_score'), high=models.Max('accuracy_score'))
+        self.accuracy_min, self.accuracy_max = bounds['low'], bounds['high']
+
+
+class UserStats(StatsAggregate):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    last_day = models.DateField(null=True, blank=True, help_text='Most recent day with a result (UTC)')
+    current_streak = models.PositiveIntegerField(default=0, help_text='Consecutive days with results up to last_day')
+    longest_streak = models.PositiveIntegerField(default=0)
+
+
+class SessionStats(StatsAggregate):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'session'], name='session_stats_unique')]
+
+
+class DailyStats(StatsAggregate):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField(help_text='UTC')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'day'], name='daily_stats_unique')]
+
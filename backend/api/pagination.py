@@ -0,0 +1,15 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Newest first, keyed on (created_at, id) so a page is one index range scan
+    on (user, created_at) however far back the client has scrolled.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.LISTING_PAGE_SIZE
+        self.max_page_size = settings.LISTING_MAX_PAGE_SIZE
@@ -0,0 +1,431 @@
+"""
+MediaPipe pose estimation.
+
+Building a ``Pose`` graph loads the model and costs more than running it on
+a short clip, so initialised graphs are kept in a per-process PosePool and
+lent out to callers, or in a pose server shared by every process (see
+pose_server.py). This module doesn't need Django, so the scripts in
+``scripts/`` can use it as well.
+"""
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+POSE_OPTIONS = {
+    "static_image_mode": False,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5,
+}
+
+_BLANK_FRAME = np.zeros((64, 64, 3), dtype=np.uint8)
+
+# Bytes of keypoints per frame: 33 landmarks of (x, y, z, visibility) float32
+FRAME_BYTES = 33 * 4 * 4
+# Frames added when a video turns out longer than its container said
+GROW_FRAMES = 256
+# Default frames per KeypointReader.blocks() array
+BLOCK_FRAMES = 64
+
+_END = object()
+
+
+class PoolExhausted(Exception):
+    """No pose estimator could be had in time; retrying later may succeed."""
+
+
+def create_pose(**pose_options):
+    """
+    A new MediaPipe ``Pose`` graph. MediaPipe is imported here rather than at
+    the top so processes that use a pose server (see pose_server.py) never
+    load it.
+    """
+    import mediapipe as mp
+    return mp.solutions.pose.Pose(**{**POSE_OPTIONS, **pose_options})
+
+
+class ExtractionTooLarge(Exception):
+    """The video has more frames than SamplingOptions.max_frames / max_bytes allow."""
+
+
+class PosePool:
+    """
+    A bounded set of warm MediaPipe ``Pose`` instances.
+
+    ``acquire()`` hands out an instance with no tracking state left over from
+    a previous video. Instances are reset in the background after being
+    returned, so the next caller doesn't wait for it.
+    """
+
+    def __init__(self, size=1, timeout=None, health_interval=0, **pose_options):
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.pose_options = {**POSE_OPTIONS, **pose_options}
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._live = 0
+        self._last_health_check = time.monotonic()
+        self.stats = {"created": 0, "reused": 0, "replaced": 0}
+
+    def _create(self):
+        pose = create_pose(**self.pose_options)
+        self.stats["created"] += 1
+        return pose
+
+    def _take(self):
+        try:
+            pose = self._idle.get_nowait()
+            self.stats["reused"] += 1
+            return pose
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._live < self.size:
+                self._live += 1
+                try:
+                    return self._create()
+                except Exception:
+                    self._live -= 1
+                    raise
+
+        try:
+            pose = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolExhausted(f"No pose estimator became free within {self.timeout}s")
+        self.stats["reused"] += 1
+        return pose
+
+    def _discard(self, pose):
+        with self._lock:
+            self._live -= 1
+        try:
+            pose.close()
+        except Exception:
+            logger.exception("Error closing pose estimator")
+
+    def _reset_and_return(self, pose):
+        try:
+            pose.reset()
+        except Exception:
+            logger.exception("Pose estimator failed to reset, replacing it")
+            self.stats["replaced"] += 1
+            self._discard(pose)
+            return
+        self._idle.put(pose)
+
+    @contextmanager
+    def acquire(self):
+        if self.health_interval and time.monotonic() - self._last_health_check >= self.health_interval:
+            self.check_health()
+        pose = self._take()
+        try:
+            yield pose
+        except Exception:
+            # The graph may be in a bad state; don't lend it out again
+            self.stats["replaced"] += 1
+            self._discard(pose)
+            raise
+        except GeneratorExit:
+            # A generator holding the instance was closed early; nothing went wrong
+            self._release(pose)
+            raise
+        self._release(pose)
+
+    def _release(self, pose):
+        threading.Thread(target=self._reset_and_return, args=(pose,), daemon=True).start()
+
+    def warm(self):
+        """Create every instance up front (e.g. at worker start)."""
+        poses = []
+        try:
+            while len(poses) < self.size:
+                with self._lock:
+                    if self._live >= self.size:
+                        break
+                    self._live += 1
+                poses.append(self._create())
+        finally:
+            for pose in poses:
+                self._idle.put(pose)
+
+    def check_health(self):
+        """Run a blank frame through every idle instance, replacing broken ones."""
+        self._last_health_check = time.monotonic()
+        healthy = failed = 0
+        checked = []
+        while True:
+            try:
+                pose = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                pose.process(_BLANK_FRAME)
+                pose.reset()
+            except Exception:
+                logger.exception("Pose estimator failed health check, replacing it")
+                self.stats["replaced"] += 1
+                self._discard(pose)
+                failed += 1
+                continue
+            healthy += 1
+            checked.append(pose)
+        for pose in checked:
+            self._idle.put(pose)
+        return {"healthy": healthy, "failed": failed, "live": self._live, "size": self.size}
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pose_pool():
+    """
+    The process-wide pool, sized from settings.POSE_POOL_SIZE, or a client
+    of the pose server at settings.POSE_SERVER_SOCKET when that is set.
+    """
+    global _pool
+    if _pool is None:
+        from django.conf import settings
+        with _pool_lock:
+            if _pool is None and settings.POSE_SERVER_SOCKET:
+                from .pose_server import RemotePosePool
+                _pool = RemotePosePool(settings.POSE_SERVER_SOCKET, timeout=settings.POSE_POOL_TIMEOUT)
+            elif _pool is None:
+                _pool = PosePool(
+                    size=settings.POSE_POOL_SIZE,
+                    timeout=settings.POSE_POOL_TIMEOUT,
+                    health_interval=settings.POSE_POOL_HEALTH_INTERVAL,
+                )
+    return _pool
+
+
+class SamplingOptions:
+    """
+    How frames are picked from a video before pose inference.
+
+    target_fps: analyse about this many frames per second; skipped frames are
+        only grabbed, not decoded. None keeps every frame.
+    max_dimension: downscale frames whose longer side exceeds this (pixels).
+    max_duration: stop after this many seconds of video.
+    max_frames, max_bytes: hard limits on the sampled frames and on the size
+        of their keypoints; extraction raises ExtractionTooLarge past either
+        instead of truncating.
+
+    References and uploads must be sampled the same way for their DTW
+    distances to be comparable.
+    """
+
+    def __init__(self, target_fps=None, max_dimension=None, max_duration=None, max_frames=None, max_bytes=None):
+        self.target_fps = target_fps
+        self.max_dimension = max_dimension
+        self.max_duration = max_duration
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return (f"SamplingOptions(target_fps={self.target_fps}, "
+                f"max_dimension={self.max_dimension}, max_duration={self.max_duration}, "
+                f"max_frames={self.max_frames}, max_bytes={self.max_bytes})")
+
+    def frame_step(self, source_fps):
+        if not self.target_fps or not source_fps or source_fps <= self.target_fps:
+            return 1
+        return max(1, int(round(source_fps / self.target_fps)))
+
+    def frame_limit(self):
+        """The most sampled frames allowed by max_frames and max_bytes, or None."""
+        limits = [self.max_frames] if self.max_frames else []
+        if self.max_bytes:
+            limits.append(self.max_bytes // FRAME_BYTES)
+        return min(limits) if limits else None
+
+    def resize(self, frame):
+        if not self.max_dimension:
+            return frame
+        height, width = frame.shape[:2]
+        longest = max(height, width)
+        if longest <= self.max_dimension:
+            return frame
+        scale = self.max_dimension / longest
+        return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class Extraction:
+    """Keypoints of the sampled frames plus what is known about the source video."""
+
+    def __init__(self, keypoints, source_fps, sample_fps, duration_seconds, timings=None):
+        self.keypoints = keypoints
+        self.source_fps = source_fps
+        self.sample_fps = sample_fps
+        self.duration_seconds = duration_seconds
+        # Seconds spent decoding and in pose inference; None when loaded from a cache
+        self.timings = timings
+
+
+class KeypointReader:
+    """
+    Pose estimation over the frames of ``video_path`` selected by ``options``.
+
+    The video is read once; its duration comes from the same pass.
+    ``video_path`` may be a pipe. ``cancel`` is an optional threading.Event
+    that stops early. Keypoints are float32 ``(frames, 33, 4)`` and are
+    written straight into preallocated arrays, either all at once
+    (``read()``) or a block at a time (``blocks()``). Once read,
+    ``source_fps``, ``sample_fps``, ``duration_seconds`` and ``timings``
+    describe the video.
+    """
+
+    def __init__(self, video_path, options=None, pool=None, cancel=None):
+        self.video_path = video_path
+        self.options = options or SamplingOptions()
+        self.pool = pool or get_pose_pool()
+        self.cancel = cancel
+        self.source_fps = 0.0
+        self.sample_fps = 0.0
+        self.duration_seconds = 0.0
+        self.timings = None
+        self.frames = 0         # sampled frames read so far
+        self.expected = None    # sampled frames the container claims to hold
+
+    def _poses(self):
+        # Pose landmarks (or None) of every sampled frame, enforcing the limits
+        clock = time.perf_counter
+        started = clock()
+        cap = cv2.VideoCapture(self.video_path)
+        self.source_fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        container_frames = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0), 0)
+        step = self.options.frame_step(self.source_fps)
+        self.sample_fps = self.source_fps / step
+        max_frames = (int(self.options.max_duration * self.source_fps)
+                      if self.options.max_duration and self.source_fps else None)
+        self.expected = -(-min(container_frames, max_frames or container_frames) // step) or None
+        limit = self.options.frame_limit()
+        reached_end = too_large = False
+        index = 0
+        inference = 0.0
+
+        try:
+            with self.pool.acquire() as pose:
+                while max_frames is None or index < max_frames:
+                    if self.cancel is not None and self.cancel.is_set():
+                        break
+                    if index % step:
+                        # Skipped frames are demuxed but never decoded
+                        if not cap.grab():
+                            reached_end = True
+                            break
+                        index += 1
+                        continue
+
+                    ret, frame = cap.read()
+                    if not ret:
+                        reached_end = True
+                        break
+                    index += 1
+                    if limit is not None and self.frames >= limit:
+                        too_large = True
+                        break
+
+                    frame_rgb = cv2.cvtColor(self.options.resize(frame), cv2.COLOR_BGR2RGB)
+                    inference_start = clock()
+                    results = pose.process(frame_rgb)
+                    inference += clock() - inference_start
+                    self.frames += 1
+                    yield results.pose_landmarks
+        finally:
+            cap.release()
+        if too_large:
+            # Raised outside acquire() so the pool keeps the healthy graph
+            raise ExtractionTooLarge(
+                f"The video has more than {limit} frames to analyse ({limit * FRAME_BYTES} bytes of keypoints)"
+            )
+
+        elapsed = clock() - started
+        # Frames actually walked are authoritative; the container count only
+        # matters when we stopped before the end
+        total_frames = index if reached_end else max(index, container_frames)
+        self.duration_seconds = total_frames / self.source_fps if self.source_fps else 0.0
+        self.timings = {"decode": elapsed - inference, "inference": inference}
+
+    def read(self):
+        """All keypoints in one array, sized from the container's frame count."""
+        poses = self._poses()
+        landmarks = next(poses, _END)
+        limit = self.options.frame_limit()
+        capacity = self.expected or GROW_FRAMES
+        if limit is not None:
+            capacity = min(capacity, limit)
+        keypoints = np.empty((max(capacity, 1), 33, 4), dtype=np.float32)
+        count = 0
+        while landmarks is not _END:
+            if count == len(keypoints):
+                # The container's count was wrong (or missing); grow by half
+                grown = count + max(GROW_FRAMES, count // 2)
+                keypoints.resize((min(grown, limit) if limit is not None else grown, 33, 4), refcheck=False)
+            _write_landmarks(keypoints[count], landmarks)
+            count += 1
+            landmarks = next(poses, _END)
+        keypoints.resize((count, 33, 4), refcheck=False)
+        return keypoints
+
+    def blocks(self, block_frames=BLOCK_FRAMES):
+        """Yield the keypoints as consecutive arrays of up to ``block_frames`` frames."""
+        block = np.empty((block_frames, 33, 4), dtype=np.float32)
+        count = 0
+        for landmarks in self._poses():
+            _write_landmarks(block[count], landmarks)
+            count += 1
+            if count == block_frames:
+                yield block
+                block = np.empty((block_frames, 33, 4), dtype=np.float32)
+                count = 0
+        if count:
+            yield block[:count]
+
+    def extraction(self, keypoints):
+        return Extraction(
+            keypoints, self.source_fps, self.sample_fps, self.duration_seconds, timings=self.timings,
+        )
+
+
+def extract_keypoints(video_path, options=None, pool=None, cancel=None):
+    """
+    Run pose estimation on the frames of ``video_path`` selected by ``options``
+    and return an Extraction (see KeypointReader).
+    """
+    reader = KeypointReader(video_path, options=options, pool=pool, cancel=cancel)
+    return reader.extraction(reader.read())
+
+
+def extract_keypoints_from_video(video_path, pool=None, options=None):
+    """
+    Extracts pose keypoints from a video and returns a numpy array of shape:
+    (frames, 33, 4) where each keypoint is (x, y, z, visibility)
+    """
+    return extract_keypoints(video_path, options=options, pool=pool).keypoints
+
+
+def _write_landmarks(row, landmarks):
+    # One (33, 4) row in place; zeros when no pose was detected. A pose
+    # server sends the landmarks as an array already
+    if landmarks is None:
+        row.fill(0)
+    elif isinstance(landmarks, np.ndarray):
+        row[:] = landmarks
+    else:
+        row[:] = [(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks.landmark]
@@ -0,0 +1,516 @@
+"""
+Pose inference in a separate server process shared by the web workers.
+
+Every web worker running MediaPipe itself holds its own copy of the model
+and competes for cores with the others. With POSE_SERVER_SOCKET set,
+``get_pose_pool()`` returns a RemotePosePool instead: videos are still
+decoded (and downscaled) in the web worker, but each sampled frame is sent
+over a Unix domain socket to ``manage.py run_pose_server``, which owns a
+fixed set of worker processes running the Pose graphs. Web workers never
+import MediaPipe.
+
+One connection carries one video. Every message is a HEADER (kind,
+sequence number, body length) followed by the body:
+
+    FRAME  client -> server  uint16 height and width, then the RGB bytes
+    POSE   server -> client  (33, 4) float32 landmarks, empty if none found
+    BUSY   server -> client  the server already has max_videos connections
+    ERROR  server -> client  utf-8 message
+    STATS  both ways         empty request, JSON reply
+
+MediaPipe tracks the pose from one frame to the next, so a video is pinned
+to the worker with the fewest videos when it connects and its frames all go
+through the same graph. Each worker has one batch in flight at a time; a
+batch takes a frame from each of the worker's videos in turn, up to
+``batch_size``, so a long video can't hold up the short ones. A video may
+have ``window`` frames queued or being processed. Past that the server
+stops reading its socket, and a client sending faster than the workers
+keep up blocks in ``send`` instead of filling the server's memory.
+
+``drive`` (``manage.py benchmark_pose_server``) measures throughput and
+latency of a running server under concurrent videos.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from .pose import PoolExhausted, create_pose
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<BII')
+FRAME_DIMENSIONS = struct.Struct('<HH')
+FRAME, POSE, BUSY, ERROR, STATS = range(5)
+LANDMARKS_SHAPE = (33, 4)
+# Largest frame body accepted (4K RGB); clients downscale well below this
+MAX_FRAME_BYTES = FRAME_DIMENSIONS.size + 3840 * 2160 * 3
+
+
+class PoseServerError(PoolExhausted):
+    """The pose server is unreachable, timed out or failed the video."""
+
+
+def _work(conn, pose_factory):
+    """A worker process: run batches of frames through one Pose graph per video."""
+    poses = {}
+    idle = []
+    while True:
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if kind == "stop":
+            return
+        if kind == "close":
+            pose = poses.pop(payload, None)
+            if pose is not None:
+                pose.reset()
+                idle.append(pose)
+            continue
+
+        results = []
+        for video_id, seq, frame in payload:
+            pose = poses.get(video_id)
+            if pose is None:
+                pose = poses[video_id] = idle.pop() if idle else pose_factory()
+            try:
+                landmarks = pose.process(frame).pose_landmarks
+            except Exception as exc:
+                # The graph may be in a bad state; the video gets a new one
+                logger.exception("Pose inference failed")
+                poses.pop(video_id, None)
+                results.append((video_id, seq, None, f"{type(exc).__name__}: {exc}"))
+                continue
+            if landmarks is not None:
+                landmarks = np.array(
+                    [(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks.landmark], dtype=np.float32,
+                )
+            results.append((video_id, seq, landmarks, None))
+        conn.send(results)
+
+
+def _send(writer, kind, seq, body=b''):
+    writer.write(HEADER.pack(kind, seq, len(body)) + body)
+
+
+def _decode_frame(body):
+    if len(body) < FRAME_DIMENSIONS.size:
+        raise PoseServerError("Frame message too short")
+    height, width = FRAME_DIMENSIONS.unpack_from(body)
+    if len(body) != FRAME_DIMENSIONS.size + height * width * 3:
+        raise PoseServerError(f"Frame body doesn't hold {height}x{width} RGB pixels")
+    return np.frombuffer(body, dtype=np.uint8, offset=FRAME_DIMENSIONS.size).reshape(height, width, 3)
+
+
+class _Worker:
+    def __init__(self, pose_factory):
+        self.pose_factory = pose_factory
+        self.videos = []
+        self.turn = 0       # position of the round-robin over videos
+        self.busy = False
+        self.start()
+
+    def start(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(child, self.pose_factory), daemon=True)
+        self.process.start()
+        child.close()
+        # One thread per worker keeps messages on the pipe whole and in order
+        self.sender = ThreadPoolExecutor(max_workers=1)
+        self.busy = False
+        self.stopped = False
+
+    def send(self, message):
+        if not self.stopped:  # handlers still closing videos while the server shuts down
+            self.sender.submit(self.conn.send, message)
+
+    def stop(self):
+        # Other workers forked later hold this pipe too, so closing it alone
+        # wouldn't reach the process
+        if self.process.is_alive():
+            self.send(("stop", None))
+        self.stopped = True
+        self.sender.shutdown(wait=True)
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class _Video:
+    def __init__(self, video_id, writer, worker):
+        self.id = video_id
+        self.writer = writer
+        self.worker = worker
+        self.pending = deque()   # (seq, frame) not yet sent to the worker
+        self.outstanding = 0     # frames pending or being processed
+        self.space = asyncio.Event()
+
+
+class PoseServer:
+    """The scheduler in front of ``workers`` pose-estimation processes."""
+
+    def __init__(self, socket_path, workers=2, batch_size=4, window=8, max_videos=32, pose_factory=create_pose):
+        self.socket_path = socket_path
+        self.worker_count = workers
+        self.batch_size = batch_size
+        self.window = window
+        self.max_videos = max_videos
+        self.pose_factory = pose_factory
+        self.workers = []
+        self.ready = threading.Event()
+        self.stats = {"videos": 0, "frames": 0, "batches": 0, "batched_frames": 0, "busy": 0, "errors": 0}
+        self._videos = {}
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._stopped = None
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """Stop serving; safe to call from another thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.workers = [_Worker(self.pose_factory) for _ in range(self.worker_count)]
+        for worker in self.workers:
+            self._loop.add_reader(worker.conn.fileno(), self._on_results, worker)
+        if os.path.exists(self.socket_path):
+            # Left behind by a previous run that didn't shut down cleanly
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        self.ready.set()
+        try:
+            async with server:
+                await self._stopped.wait()
+        finally:
+            for worker in self.workers:
+                self._loop.remove_reader(worker.conn.fileno())
+                worker.stop()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.ready.clear()
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "workers": len(self.workers),
+            "connected": len(self._videos),
+            "queued": sum(len(video.pending) for video in self._videos.values()),
+            "mean_batch": round(self.stats["batched_frames"] / self.stats["batches"], 2) if self.stats["batches"] else 0,
+        }
+
+    async def _handle(self, reader, writer):
+        try:
+            kind, seq, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        if kind == STATS:
+            _send(writer, STATS, seq, json.dumps(self.snapshot()).encode())
+            await writer.drain()
+            writer.close()
+            return
+        if len(self._videos) >= self.max_videos:
+            self.stats["busy"] += 1
+            _send(writer, BUSY, seq, f"The pose server is busy with {len(self._videos)} videos".encode())
+            await writer.drain()
+            writer.close()
+            return
+
+        worker = min(self.workers, key=lambda w: len(w.videos))
+        video = _Video(next(self._ids), writer, worker)
+        self._videos[video.id] = video
+        worker.videos.append(video)
+        self.stats["videos"] += 1
+        try:
+            while True:
+                if kind != FRAME:
+                    raise PoseServerError(f"Unexpected message kind {kind}")
+                if length > MAX_FRAME_BYTES:
+                    raise PoseServerError(f"Frames are limited to {MAX_FRAME_BYTES} bytes")
+                frame = _decode_frame(await reader.readexactly(length))
+                while video.outstanding >= self.window:
+                    video.space.clear()
+                    await video.space.wait()
+                video.outstanding += 1
+                video.pending.append((seq, frame))
+                self._dispatch(worker)
+                kind, seq, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the client is done with the video
+        except PoseServerError as exc:
+            _send(writer, ERROR, seq, str(exc).encode())
+        finally:
+            self._videos.pop(video.id, None)
+            if video in video.worker.videos:
+                video.worker.videos.remove(video)
+                video.worker.send(("close", video.id))
+            writer.close()
+
+    def _dispatch(self, worker):
+        # One frame from each video with frames waiting, in turn, until the batch is full
+        if worker.busy or not worker.videos:
+            return
+        videos = worker.videos
+        batch = []
+        empty_turns = 0
+        while len(batch) < self.batch_size and empty_turns < len(videos):
+            video = videos[worker.turn % len(videos)]
+            worker.turn += 1
+            if video.pending:
+                seq, frame = video.pending.popleft()
+                batch.append((video.id, seq, frame))
+                empty_turns = 0
+            else:
+                empty_turns += 1
+        if not batch:
+            return
+        worker.busy = True
+        self.stats["batches"] += 1
+        self.stats["batched_frames"] += len(batch)
+        worker.send(("batch", batch))
+
+    def _on_results(self, worker):
+        try:
+            results = worker.conn.recv()
+        except (EOFError, OSError):
+            self._restart(worker)
+            return
+        worker.busy = False
+        for video_id, seq, landmarks, error in results:
+            video = self._videos.get(video_id)
+            if video is None:
+                continue  # disconnected while its frame was processed
+            video.outstanding -= 1
+            video.space.set()
+            if error is not None:
+                self.stats["errors"] += 1
+                _send(video.writer, ERROR, seq, error.encode())
+            else:
+                self.stats["frames"] += 1
+                _send(video.writer, POSE, seq, b'' if landmarks is None else landmarks.tobytes())
+        self._dispatch(worker)
+
+    def _restart(self, worker):
+        logger.error("Pose worker %s exited, restarting it", worker.process.pid)
+        self._loop.remove_reader(worker.conn.fileno())
+        for video in worker.videos:
+            # Their tracking state is gone with the process
+            self._videos.pop(video.id, None)
+            video.outstanding = 0
+            video.space.set()
+            _send(video.writer, ERROR, 0, b"The pose worker stopped")
+            video.writer.close()
+        worker.videos = []
+        worker.stop()
+        worker.start()
+        self._loop.add_reader(worker.conn.fileno(), self._on_results, worker)
+
+
+class RemoteResult:
+    """What RemotePose.process returns, shaped like a MediaPipe result."""
+
+    def __init__(self, seq, pose_landmarks):
+        self.seq = seq
+        self.pose_landmarks = pose_landmarks  # (33, 4) float32 or None
+
+
+def _read_message(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise PoseServerError("The pose server closed the connection")
+    kind, seq, length = HEADER.unpack(header)
+    body = stream.read(length)
+    if len(body) < length:
+        raise PoseServerError("The pose server closed the connection")
+    return kind, seq, body
+
+
+class RemotePose:
+    """One video's connection to the pose server, used like a MediaPipe Pose."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._stream = sock.makefile('rb')
+        self._seq = 0
+
+    def submit(self, frame_rgb):
+        """Send a frame without waiting for its result; returns its sequence number."""
+        frame = np.ascontiguousarray(frame_rgb, dtype=np.uint8)
+        height, width = frame.shape[:2]
+        self._seq += 1
+        header = HEADER.pack(FRAME, self._seq, FRAME_DIMENSIONS.size + frame.nbytes)
+        try:
+            self.sock.sendall(header + FRAME_DIMENSIONS.pack(height, width))
+            self.sock.sendall(frame.data)
+        except (BrokenPipeError, ConnectionResetError) as exc:
+            # The server may have said why before closing (BUSY)
+            self.receive()
+            raise PoseServerError(f"The pose server closed the connection: {exc}")
+        except OSError as exc:
+            raise PoseServerError(f"Sending a frame to the pose server failed: {exc}")
+        return self._seq
+
+    def receive(self):
+        """The result of the oldest frame submitted and not yet received."""
+        try:
+            kind, seq, body = _read_message(self._stream)
+        except OSError as exc:
+            # Including timeouts (POSE_POOL_TIMEOUT)
+            raise PoseServerError(f"No answer from the pose server: {exc}")
+        if kind == BUSY:
+            raise PoolExhausted(body.decode())
+        if kind != POSE:
+            raise PoseServerError(body.decode() or f"Unexpected message kind {kind}")
+        landmarks = np.frombuffer(body, dtype=np.float32).reshape(LANDMARKS_SHAPE) if body else None
+        return RemoteResult(seq, landmarks)
+
+    def process(self, frame_rgb):
+        self.submit(frame_rgb)
+        return self.receive()
+
+    def close(self):
+        self._stream.close()
+        self.sock.close()
+
+
+class RemotePosePool:
+    """PosePool's interface over a pose server: each acquire() is one video's connection."""
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.stats = {"connections": 0}
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as exc:
+            sock.close()
+            raise PoseServerError(f"No pose server at {self.socket_path}: {exc}")
+        return sock
+
+    @contextmanager
+    def acquire(self):
+        pose = RemotePose(self._connect())
+        self.stats["connections"] += 1
+        try:
+            yield pose
+        finally:
+            pose.close()
+
+    def warm(self):
+        # The server owns the graphs; there's nothing to load here
+        pass
+
+    def check_health(self):
+        return self.server_stats()
+
+    def server_stats(self):
+        sock = self._connect()
+        try:
+            sock.sendall(HEADER.pack(STATS, 0, 0))
+            with sock.makefile('rb') as stream:
+                _, _, body = _read_message(stream)
+        finally:
+            sock.close()
+        return json.loads(body)
+
+    def close(self):
+        pass
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return None
+    values = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {"p50": round(values[0], 2), "p95": round(values[1], 2), "p99": round(values[2], 2)}
+
+
+def drive(socket_path, frames, concurrency, videos=None, window=1, timeout=60):
+    """
+    Send ``videos`` copies of ``frames`` (RGB arrays) to the server at
+    ``socket_path``, ``concurrency`` at a time, keeping up to ``window``
+    frames of each in flight. Returns throughput and the latency
+    percentiles of frames (sent to result) and whole videos.
+    """
+    pool = RemotePosePool(socket_path, timeout=timeout)
+    videos = videos or concurrency
+    todo = iter(range(videos))
+    lock = threading.Lock()
+    frame_latency, video_latency = [], []
+    outcomes = {"busy": 0, "errors": 0}
+
+    def run_video():
+        sent = {}
+        latencies = []
+        started = time.perf_counter()
+        with pool.acquire() as pose:
+            for frame in frames:
+                sent[pose.submit(frame)] = time.perf_counter()
+                if len(sent) >= window:
+                    result = pose.receive()
+                    latencies.append(time.perf_counter() - sent.pop(result.seq))
+            while sent:
+                result = pose.receive()
+                latencies.append(time.perf_counter() - sent.pop(result.seq))
+        return latencies, time.perf_counter() - started
+
+    def client():
+        while True:
+            with lock:
+                if next(todo, None) is None:
+                    return
+            try:
+                latencies, seconds = run_video()
+            except PoseServerError:
+                logger.exception("Video failed")
+                with lock:
+                    outcomes["errors"] += 1
+                continue
+            except PoolExhausted:
+                with lock:
+                    outcomes["busy"] += 1
+                continue
+            with lock:
+                frame_latency.extend(latencies)
+                video_latency.append(seconds)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "videos": videos,
+        "completed": len(video_latency),
+        "frames": len(frame_latency),
+        "seconds": round(elapsed, 3),
+        "frames_per_second": round(len(frame_latency) / elapsed, 1) if elapsed else 0.0,
+        "frame_latency_ms": _percentiles(frame_latency),
+        "video_latency_ms": _percentiles(video_latency),
+        **outcomes,
+        "server": pool.server_stats(),
+    }
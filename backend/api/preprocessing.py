@@ -0,0 +1,270 @@
+"""
+Builds the reference dataset (Workout_npy) from the raw clips in
+datasets/workout.
+
+Videos are spread over a process pool, each process keeping one warm Pose
+graph. A manifest in the output directory records the size, mtime and hash
+of every source clip along with the sampling options used, so later runs only
+re-extract clips that are new or changed. Outputs are written to a temporary
+name and renamed into place, so a crashed run never leaves a partial file.
+
+ReferenceIndex reads an exercise's consolidated store (reference_store.py)
+in preference to its folder, so ``update_stores`` rebuilds the existing
+store of every exercise whose outputs changed. A clip whose output is only
+in the store (built with ``remove_source``) counts as extracted.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .pose import PosePool, SamplingOptions, extract_keypoints
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def output_folder_name(exercise_name):
+    return f"{exercise_name}_npy"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_save(path, array):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_text(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def options_dict(options):
+    return {
+        "target_fps": options.target_fps,
+        "max_dimension": options.max_dimension,
+        "max_duration": options.max_duration,
+    }
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "options": None, "videos": {}}
+    manifest.setdefault("videos", {})
+    return manifest
+
+
+def save_manifest(output_dir, manifest):
+    atomic_write_text(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def find_videos(source_dir):
+    """Yield (exercise folder, relative path, absolute path) for every clip."""
+    for exercise_name in sorted(os.listdir(source_dir)):
+        exercise_path = os.path.join(source_dir, exercise_name)
+        if not os.path.isdir(exercise_path):
+            continue
+        for video_file in sorted(os.listdir(exercise_path)):
+            if video_file.lower().endswith(VIDEO_EXTENSIONS):
+                yield exercise_name, f"{exercise_name}/{video_file}", os.path.join(exercise_path, video_file)
+
+
+def stored_sequences(output_dir):
+    """Map of output folder name to the sequence names held in its consolidated store."""
+    from .reference_store import find_stores, load_manifest as load_store_manifest
+
+    stored = {}
+    for name in find_stores(output_dir):
+        try:
+            entries = load_store_manifest(output_dir, name)["sequences"]
+        except (OSError, ValueError):
+            continue
+        stored[output_folder_name(name)] = {entry["name"] for entry in entries}
+    return stored
+
+
+# Per worker process
+_pool = None
+
+
+def _init_worker():
+    global _pool
+    _pool = PosePool(size=1)
+    _pool.warm()
+
+
+def _process_video(video_path, output_path, options, csv):
+    start = time.perf_counter()
+    extraction = extract_keypoints(video_path, options=SamplingOptions(**options), pool=_pool)
+    keypoints = extraction.keypoints
+    if len(keypoints) == 0:
+        raise ValueError("no frames could be decoded")
+    atomic_save(output_path, keypoints)
+    if csv:
+        flat_keypoints = keypoints.reshape(keypoints.shape[0], -1)  # flatten to (frames, 33*4)
+        csv_path = os.path.splitext(output_path)[0] + ".csv"
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(csv_path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            np.savetxt(f, flat_keypoints, delimiter=",")
+        os.replace(tmp_path, csv_path)
+    return len(keypoints), time.perf_counter() - start
+
+
+def preprocess_dataset(source_dir, output_dir, options=None, workers=None, force=False,
+                       prune=False, csv=False, report=print):
+    """
+    Extract keypoints for new or changed clips in ``source_dir`` into
+    ``output_dir/<exercise>_npy/<clip>.npy``. Returns a summary dict.
+    """
+    options = options or SamplingOptions()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    if manifest.get("options") != options_dict(options):
+        if manifest["videos"] and not force:
+            report("Sampling options changed since the last run, re-extracting everything")
+        force = True
+    videos = manifest["videos"]
+    stored = stored_sequences(output_dir)
+
+    def output_exists(output_rel):
+        folder, filename = os.path.split(output_rel)
+        return os.path.exists(os.path.join(output_dir, output_rel)) or filename in stored.get(folder, ())
+
+    todo = []
+    seen = set()
+    skipped = 0
+    for exercise_name, rel_path, abs_path in find_videos(source_dir):
+        seen.add(rel_path)
+        st = os.stat(abs_path)
+        entry = videos.get(rel_path)
+        output_rel = os.path.join(
+            output_folder_name(exercise_name),
+            os.path.splitext(os.path.basename(abs_path))[0] + ".npy",
+        )
+        output_ok = entry is not None and output_exists(entry["output"])
+
+        if not force and output_ok and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            skipped += 1
+            continue
+        digest = file_sha256(abs_path)
+        if not force and output_ok and entry["sha256"] == digest:
+            # Touched but identical
+            entry["mtime"] = st.st_mtime
+            skipped += 1
+            continue
+        todo.append((rel_path, abs_path, output_rel, digest, st))
+
+    report(f"{len(todo)} clips to extract, {skipped} up to date")
+    failures = {}
+    changed = set()
+    started = time.perf_counter()
+    if todo:
+        for folder in {os.path.dirname(output_rel) for _, _, output_rel, _, _ in todo}:
+            os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(
+                    _process_video, abs_path, os.path.join(output_dir, output_rel),
+                    options_dict(options), csv,
+                ): (rel_path, output_rel, digest, st)
+                for rel_path, abs_path, output_rel, digest, st in todo
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                rel_path, output_rel, digest, st = futures[future]
+                try:
+                    frames, seconds = future.result()
+                except Exception as exc:
+                    failures[rel_path] = f"{type(exc).__name__}: {exc}"
+                    report(f"[{done}/{len(todo)}] FAILED {rel_path}: {failures[rel_path]}")
+                    continue
+                videos[rel_path] = {
+                    "output": output_rel,
+                    "sha256": digest,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "frames": frames,
+                    "seconds": round(seconds, 3),
+                }
+                changed.add(os.path.dirname(output_rel))
+                report(f"[{done}/{len(todo)}] {rel_path}: {frames} frames in {seconds:.1f}s")
+                # Save as we go so an interrupted run keeps its progress
+                manifest["options"] = options_dict(options)
+                save_manifest(output_dir, manifest)
+
+    removed = []
+    if prune:
+        for rel_path in sorted(set(videos) - seen):
+            output_rel = videos.pop(rel_path)["output"]
+            changed.add(os.path.dirname(output_rel))
+            output_path = os.path.join(output_dir, output_rel)
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+            removed.append(output_rel)
+
+    manifest["version"] = MANIFEST_VERSION
+    manifest["options"] = options_dict(options)
+    save_manifest(output_dir, manifest)
+    return {
+        "extracted": len(todo) - len(failures),
+        "skipped": skipped,
+        "failed": failures,
+        "pruned": len(removed),
+        "removed": removed,  # outputs of the pruned clips
+        "changed": sorted(changed),  # output folders that were written to or pruned
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def update_stores(output_dir, summary, dtype=None, report=print):
+    """
+    Rebuild the consolidated store of every folder in ``summary['changed']``
+    that has one, keeping its own dtype, so ReferenceIndex doesn't go on
+    reading the old sequences. With ``dtype``, folders without a store are
+    packed too. Returns the convert_folder summaries.
+    """
+    from .reference_index import strip_suffix
+    from .reference_store import convert_folder, find_stores, load_manifest as load_store_manifest
+
+    stores = find_stores(output_dir)
+    packed = []
+    for folder in summary["changed"]:
+        name = strip_suffix(folder)
+        if name in stores:
+            store_dtype = dtype or load_store_manifest(output_dir, name)["dtype"]
+        elif dtype and os.path.isdir(os.path.join(output_dir, folder)):
+            store_dtype = dtype
+        else:
+            continue
+        drop = [os.path.basename(output_rel) for output_rel in summary["removed"]
+                if os.path.dirname(output_rel) == folder]
+        result = convert_folder(
+            os.path.join(output_dir, folder), output_dir, dtype=store_dtype, carry_over=True, drop=drop,
+        )
+        report(f"Packed {result['name']}: {result['sequences']} sequences")
+        packed.append(result)
+    return packed
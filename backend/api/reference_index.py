@@ -0,0 +1,336 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+
+from .dtw import StackedReferences
+from .features import keypoint_features
+from .reference_store import (
+    FEATURES, TEMPLATE_FEATURES, TEMPLATES, find_stores, load_manifest, load_store, read_folder, store_paths,
+)
+from .reps import rep_profile, rep_templates
+from .search import ReferenceBounds
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_name(name):
+    return name.lower().replace(' ', '_')
+
+
+def strip_suffix(name, suffix="_npy"):
+    if name.lower().endswith(suffix):
+        return name[:-len(suffix)]
+    return name
+
+
+def spread_within(lengths, max_frames):
+    """
+    Indices of references spread evenly over the list whose lengths add up
+    to at most ``max_frames`` (all of them when it is falsy or not exceeded).
+    """
+    count = len(lengths)
+    for keep in range(count, 0, -1):
+        indices = np.unique(np.linspace(0, count - 1, keep).round().astype(int))
+        if not max_frames or sum(lengths[i] for i in indices) <= max_frames:
+            return [int(i) for i in indices]
+    return []
+
+
+class _Snapshot:
+    """Immutable view of the loaded dataset. Swapped as a whole on reload."""
+
+    def __init__(self, references, features, title_map, fingerprint, load_seconds, templates=None):
+        self.references = references      # exercise key -> list of (name, array)
+        self.features = features          # exercise key -> list of (name, features), same order
+        self.templates = templates or {}  # exercise key -> {'keypoints'/'features': (arrays, spread)}
+        self.title_map = title_map        # session title -> exercise key
+        self.bounds = {}                  # (set, exercise key) -> ReferenceBounds, filled on first use
+        self.stacks = {}                  # (set, exercise key, frame budget) -> StackedReferences, likewise
+        self.rep_profiles = {}            # exercise key -> RepProfile or None, likewise
+        self.rep_templates = {}           # (set, exercise key) -> (templates, ReferenceBounds), likewise
+        self.fingerprint = fingerprint
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        arrays = [arr for sets in (references, features) for refs in sets.values() for _, arr in refs]
+        # Memory-mapped store views live in the page cache, not in this process
+        self.mapped_bytes = sum(arr.nbytes for arr in arrays if isinstance(arr, np.memmap))
+        self.nbytes = sum(arr.nbytes for arr in arrays) - self.mapped_bytes
+
+
+class ReferenceIndex:
+    """
+    Holds every exercise's reference keypoint sequences in memory so that
+    process_video never has to scan or read Workout_npy per request.
+
+    An exercise is read from its consolidated store (see reference_store.py)
+    when there is one, and from its ``<exercise>_npy`` folder otherwise.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = str(base_dir)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def _scan(self):
+        """Map of exercise key to ('store', name) or ('folder', path)."""
+        sources = {}
+        for foldername in sorted(os.listdir(self.base_dir)):
+            path = os.path.join(self.base_dir, foldername)
+            if os.path.isdir(path):
+                sources[strip_suffix(foldername).lower()] = ('folder', path)
+        for name in find_stores(self.base_dir):
+            sources[name.lower()] = ('store', name)
+        return sources
+
+    def _source_path(self, kind, location):
+        if kind == 'store':
+            return store_paths(self.base_dir, location)[1]
+        return location
+
+    def _template_stores(self):
+        """Map of exercise key to the name of its template stores (manage.py build_templates)."""
+        return {name.lower(): name for name in find_stores(self.base_dir, TEMPLATES)}
+
+    def _fingerprint(self, sources):
+        return tuple(
+            (key, kind, os.stat(self._source_path(kind, location)).st_mtime_ns)
+            for key, (kind, location) in sorted(sources.items())
+        ) + tuple(
+            (key, TEMPLATES, os.stat(store_paths(self.base_dir, name, TEMPLATES)[1]).st_mtime_ns)
+            for key, name in sorted(self._template_stores().items())
+        )
+
+    def _read(self, key, kind, location):
+        if kind == 'store':
+            try:
+                return load_store(self.base_dir, location, mmap=getattr(settings, 'REFERENCE_STORE_MMAP', True))
+            except (OSError, ValueError):
+                folder = os.path.join(self.base_dir, location + '_npy')
+                if not os.path.isdir(folder):
+                    raise
+                logger.exception("Could not open the %s reference store, reading %s instead", key, folder)
+                return read_folder(folder)
+        return read_folder(location)
+
+    def _read_features(self, key, kind, location, refs):
+        """Precomputed features from the feature store when it matches, else computed here."""
+        if kind == 'store' and os.path.exists(store_paths(self.base_dir, location, FEATURES)[1]):
+            try:
+                features = load_store(
+                    self.base_dir, location, mmap=getattr(settings, 'REFERENCE_STORE_MMAP', True), kind=FEATURES,
+                )
+            except (OSError, ValueError):
+                logger.exception("Could not open the %s feature store", key)
+            else:
+                if [name for name, _ in features] == [name for name, _ in refs]:
+                    return features
+                logger.warning("The %s feature store is out of date, recomputing features", key)
+        return [(name, keypoint_features(array)) for name, array in refs]
+
+    def _read_templates(self, key, name):
+        """Both template sets of an exercise with the spread of their clusters, or None."""
+        templates = {}
+        try:
+            for mode, kind in (("keypoints", TEMPLATES), ("features", TEMPLATE_FEATURES)):
+                sequences = load_store(self.base_dir, name, mmap=False, kind=kind)
+                manifest = load_manifest(self.base_dir, name, kind)
+                spread = np.array([entry.get("spread_max", 0.0) for entry in manifest["sequences"]])
+                templates[mode] = ([array for _, array in sequences], spread)
+        except (OSError, ValueError):
+            logger.exception("Could not open the %s template stores", key)
+            return None
+        return templates
+
+    def _session_titles(self):
+        from .models import Session
+        try:
+            return list(Session.objects.values_list('title', flat=True))
+        except DatabaseError:
+            logger.warning("Could not read session titles; mapping them lazily")
+            return []
+
+    def load(self):
+        """Read the whole dataset and atomically replace the current snapshot."""
+        with self._lock:
+            start = time.perf_counter()
+            sources = self._scan()
+            references = {}
+            features = {}
+            for key, (kind, location) in sources.items():
+                references[key] = self._read(key, kind, location)
+                features[key] = self._read_features(key, kind, location, references[key])
+            templates = {}
+            for key, name in self._template_stores().items():
+                if key in references:
+                    templates[key] = self._read_templates(key, name)
+
+            title_map = {}
+            for title in self._session_titles():
+                normalized = normalize_name(title)
+                if normalized in references:
+                    title_map[title] = normalized
+
+            snapshot = _Snapshot(
+                references, features, title_map, self._fingerprint(sources),
+                time.perf_counter() - start,
+                templates={key: entry for key, entry in templates.items() if entry is not None},
+            )
+            self._snapshot = snapshot
+            self._last_check = time.monotonic()
+
+        logger.info(
+            "Loaded reference index: %d exercises, %d sequences, %.1f MB in memory, %.1f MB mapped in %.2fs",
+            len(snapshot.references),
+            sum(len(refs) for refs in snapshot.references.values()),
+            snapshot.nbytes / (1024 * 1024),
+            snapshot.mapped_bytes / (1024 * 1024),
+            snapshot.load_seconds,
+        )
+        return snapshot
+
+    reload = load
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.load()
+
+        interval = getattr(settings, 'REFERENCE_INDEX_RELOAD_INTERVAL', 0)
+        now = time.monotonic()
+        if interval and now - self._last_check >= interval:
+            self._last_check = now
+            if self._fingerprint(self._scan()) != snapshot.fingerprint:
+                logger.info("Reference dataset changed on disk, reloading")
+                return self.load()
+        return snapshot
+
+    def exercise_key(self, session_title):
+        snapshot = self._current()
+        key = snapshot.title_map.get(session_title)
+        if key is None:
+            # Sessions created after the index was loaded
+            normalized = normalize_name(session_title)
+            if normalized in snapshot.references:
+                key = normalized
+        return key
+
+    def references(self, exercise_key):
+        """Return the list of (filename, keypoints) for an exercise key."""
+        return self._current().references.get(exercise_key, [])
+
+    def features(self, exercise_key):
+        """Return the list of (filename, features) for an exercise key."""
+        return self._current().features.get(exercise_key, [])
+
+    def templates(self, exercise_key, features=False):
+        """An exercise's DBA templates (see templates.py) as (arrays, spread), or None if not built."""
+        entry = self._current().templates.get(exercise_key)
+        if entry is None:
+            return None
+        return entry['features' if features else 'keypoints']
+
+    def bounds(self, exercise_key, features=False):
+        """Lower-bound data (see search.py) for an exercise's references or features."""
+        snapshot = self._current()
+        cache_key = ('features' if features else 'keypoints', exercise_key)
+        bounds = snapshot.bounds.get(cache_key)
+        if bounds is None:
+            sequences = (snapshot.features if features else snapshot.references).get(exercise_key, [])
+            bounds = snapshot.bounds[cache_key] = ReferenceBounds([array for _, array in sequences])
+        return bounds
+
+    def stacked(self, exercise_key, features=False, max_frames=None):
+        """
+        An exercise's references (or features) stacked for online DTW (see
+        dtw.OnlineDTW), limited to ``max_frames`` reference frames in total.
+        Returns (StackedReferences, indices of the references used).
+        """
+        snapshot = self._current()
+        cache_key = ('features' if features else 'keypoints', exercise_key, max_frames)
+        entry = snapshot.stacks.get(cache_key)
+        if entry is None:
+            sets = snapshot.features if features else snapshot.references
+            sequences = [array for _, array in sets.get(exercise_key, [])]
+            indices = spread_within([len(array) for array in sequences], max_frames)
+            entry = snapshot.stacks[cache_key] = (StackedReferences([sequences[i] for i in indices]), indices)
+        return entry
+
+    def rep_profile(self, exercise_key):
+        """How reps of an exercise are counted (see reps.py), or None."""
+        snapshot = self._current()
+        if exercise_key not in snapshot.rep_profiles:
+            snapshot.rep_profiles[exercise_key] = rep_profile(
+                [array for _, array in snapshot.features.get(exercise_key, [])]
+            )
+        return snapshot.rep_profiles[exercise_key]
+
+    def rep_templates(self, exercise_key, features=False):
+        """
+        Single-rep templates cut from an exercise's references (or features),
+        at most REP_TEMPLATES_MAX, with their lower-bound data. Returns
+        (templates, ReferenceBounds); no templates without a rep profile.
+        """
+        snapshot = self._current()
+        cache_key = ('features' if features else 'keypoints', exercise_key)
+        entry = snapshot.rep_templates.get(cache_key)
+        if entry is None:
+            profile = self.rep_profile(exercise_key)
+            feature_sequences = [array for _, array in snapshot.features.get(exercise_key, [])]
+            sets = snapshot.features if features else snapshot.references
+            sequences = [array for _, array in sets.get(exercise_key, [])]
+            templates = [] if profile is None else rep_templates(
+                sequences, feature_sequences, profile, limit=getattr(settings, 'REP_TEMPLATES_MAX', None),
+            )
+            entry = snapshot.rep_templates[cache_key] = (templates, ReferenceBounds(templates))
+        return entry
+
+    def references_for_title(self, session_title):
+        key = self.exercise_key(session_title)
+        if key is None:
+            return None, []
+        return key, self.references(key)
+
+    def stats(self):
+        snapshot = self._current()
+        return {
+            "base_dir": self.base_dir,
+            "exercises": {key: len(refs) for key, refs in snapshot.references.items()},
+            "templates": {key: len(entry['keypoints'][0]) for key, entry in snapshot.templates.items()},
+            "sequences": sum(len(refs) for refs in snapshot.references.values()),
+            "memory_bytes": snapshot.nbytes,
+            "mapped_bytes": snapshot.mapped_bytes,
+            "load_seconds": round(snapshot.load_seconds, 4),
+            "loaded_at": snapshot.loaded_at,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_reference_index():
+    """Per-process singleton; the dataset is read on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ReferenceIndex(settings.REFERENCE_DATA_DIR)
+    return _index
+
+
+def warm_reference_index():
+    if getattr(settings, 'REFERENCE_INDEX_PRELOAD', True):
+        try:
+            get_reference_index().load()
+        except OSError:
+            logger.exception("Failed to preload reference index")
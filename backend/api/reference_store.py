@@ -0,0 +1,169 @@
+"""
+Consolidated reference store.
+
+Each exercise's reference sequences are packed into one contiguous array,
+``<exercise>.refs.npy`` of shape (total frames, 33, 4), next to a
+``<exercise>.refs.json`` manifest holding the name, offset and length of
+every sequence. The array is opened with ``mmap_mode='r'``, so the
+sequences handed out are read-only views and every worker process on the
+host shares the same pages through the OS cache instead of holding its own
+float64 copy.
+
+Other per-exercise sequence sets use the same layout under a different
+kind: ``<exercise>.features.npy`` holds the precomputed scoring features
+(see features.py) of every reference, in the same order, and
+``<exercise>.templates.npy`` / ``<exercise>.template_features.npy`` the
+DBA templates built by ``manage.py build_templates`` (see templates.py),
+whose manifest entries also carry their cluster's spread.
+"""
+import json
+import os
+
+import numpy as np
+
+from .features import keypoint_features
+from .preprocessing import atomic_save, atomic_write_text
+
+STORE_VERSION = 1
+DTYPES = ("float32", "float16")
+
+KEYPOINTS = "refs"
+FEATURES = "features"
+TEMPLATES = "templates"
+TEMPLATE_FEATURES = "template_features"
+
+
+def store_paths(directory, name, kind=KEYPOINTS):
+    return (
+        os.path.join(directory, f"{name}.{kind}.npy"),
+        os.path.join(directory, f"{name}.{kind}.json"),
+    )
+
+
+def find_stores(directory, kind=KEYPOINTS):
+    """Map of store name (e.g. ``pull_Up``) to its array path."""
+    suffix = f".{kind}.npy"
+    stores = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(suffix):
+            name = filename[:-len(suffix)]
+            if os.path.exists(store_paths(directory, name, kind)[1]):
+                stores[name] = os.path.join(directory, filename)
+    return stores
+
+
+def write_store(directory, name, sequences, dtype="float32", kind=KEYPOINTS, extra=None):
+    """
+    Pack ``sequences`` (a list of (name, array)) into one store. ``extra``
+    is an optional list of dicts, one per sequence, added to its manifest
+    entry. Returns the manifest that was written.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported store dtype {dtype!r}")
+    frame_shape = None
+    entries = []
+    offset = 0
+    for seq_name, array in sequences:
+        if frame_shape is None:
+            frame_shape = array.shape[1:]
+        elif array.shape[1:] != frame_shape:
+            raise ValueError(f"{seq_name} has frames of shape {array.shape[1:]}, expected {frame_shape}")
+        entries.append({
+            **(extra[len(entries)] if extra else {}),
+            "name": seq_name, "offset": offset, "frames": len(array),
+        })
+        offset += len(array)
+
+    packed = np.empty((offset,) + tuple(frame_shape or (33, 4)), dtype=dtype)
+    for entry, (_, array) in zip(entries, sequences):
+        packed[entry["offset"]:entry["offset"] + entry["frames"]] = array
+
+    manifest = {
+        "version": STORE_VERSION,
+        "dtype": dtype,
+        "frame_shape": list(packed.shape[1:]),
+        "total_frames": offset,
+        "sequences": entries,
+    }
+    array_path, manifest_path = store_paths(directory, name, kind)
+    atomic_save(array_path, packed)
+    atomic_write_text(manifest_path, json.dumps(manifest, indent=2))
+    return manifest
+
+
+def load_manifest(directory, name, kind=KEYPOINTS):
+    manifest_path = store_paths(directory, name, kind)[1]
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_VERSION:
+        raise ValueError(f"{manifest_path}: unsupported store version {manifest.get('version')}")
+    return manifest
+
+
+def load_store(directory, name, mmap=True, kind=KEYPOINTS):
+    """Return the list of (name, array view) held in a store."""
+    array_path = store_paths(directory, name, kind)[0]
+    manifest = load_manifest(directory, name, kind)
+
+    packed = np.load(array_path, mmap_mode='r' if mmap else None)
+    if len(packed) != manifest["total_frames"]:
+        raise ValueError(f"{array_path} does not match its manifest (rewritten mid-read?)")
+    return [
+        (entry["name"], packed[entry["offset"]:entry["offset"] + entry["frames"]])
+        for entry in manifest["sequences"]
+    ]
+
+
+def read_folder(path):
+    """The (name, array) pairs of a folder of per-video .npy files."""
+    return [
+        (npy_file, np.load(os.path.join(path, npy_file)))
+        for npy_file in sorted(os.listdir(path))
+        if npy_file.endswith(".npy")
+    ]
+
+
+def convert_folder(folder_path, output_dir, dtype="float32", remove_source=False, carry_over=False, drop=()):
+    """
+    Build the keypoint and feature stores for one ``<exercise>_npy`` folder.
+    The stores are named after the folder without its ``_npy`` suffix.
+
+    With ``carry_over``, sequences of the existing store that the folder no
+    longer has (it was built with ``remove_source``), other than the names
+    in ``drop``, are kept; the folder's files replace the rest.
+    """
+    from .reference_index import strip_suffix
+
+    name = strip_suffix(os.path.basename(os.path.normpath(folder_path)))
+    sequences = read_folder(folder_path) if os.path.isdir(folder_path) else []
+    if carry_over and name in find_stores(output_dir):
+        present = {seq_name for seq_name, _ in sequences} | set(drop)
+        sequences = sorted(sequences + [
+            (seq_name, array) for seq_name, array in load_store(output_dir, name, mmap=False)
+            if seq_name not in present
+        ], key=lambda item: item[0])
+    source_bytes = sum(array.nbytes for _, array in sequences)
+    manifest = write_store(output_dir, name, sequences, dtype=dtype)
+    # Features stay float32: they are small and angles lose too much in float16
+    write_store(
+        output_dir, name,
+        [(seq_name, keypoint_features(array)) for seq_name, array in sequences],
+        kind=FEATURES,
+    )
+    if remove_source:
+        for seq_name, _ in sequences:
+            if not os.path.exists(os.path.join(folder_path, seq_name)):
+                continue  # carried over from the store
+            os.unlink(os.path.join(folder_path, seq_name))
+            csv_path = os.path.join(folder_path, os.path.splitext(seq_name)[0] + ".csv")
+            if os.path.exists(csv_path):
+                os.unlink(csv_path)
+        if os.path.isdir(folder_path) and not os.listdir(folder_path):
+            os.rmdir(folder_path)
+    return {
+        "name": name,
+        "sequences": len(manifest["sequences"]),
+        "frames": manifest["total_frames"],
+        "source_bytes": source_bytes,
+        "store_bytes": os.path.getsize(store_paths(output_dir, name)[0]),
+    }
@@ -0,0 +1,177 @@
+"""
+Repetition counting from one joint angle.
+
+Each exercise moves one joint much more than the others (knees in a squat,
+elbows in a push-up, shoulders in a lateral raise). ``rep_profile`` picks
+that joint from the exercise's reference features (see features.py),
+averaging its left and right angles so it doesn't matter which side faces
+the camera, and derives how far it has to move to count as a rep.
+``RepCounter`` follows the angle frame by frame in constant memory: a rep
+is counted when the angle turns back after travelling away from where the
+set started, which for a squat is the bottom of the movement.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .features import JOINT_ANGLES
+
+# Fraction of the references' typical range of motion the angle has to move
+# before a change of direction counts
+REP_HYSTERESIS = 0.3
+# Weight of the newest frame in the exponential moving average
+REP_SMOOTHING = 0.5
+
+
+@dataclass(frozen=True)
+class RepProfile:
+    joint: int          # pair of JOINT_ANGLES rows 2 * joint (left) and 2 * joint + 1 (right)
+    hysteresis: float   # in features.py angle units (0..1)
+
+    def signal(self, features):
+        """The joint's mean left/right angle of feature rows (..., FEATURE_DIM)."""
+        return (features[..., 2 * self.joint] + features[..., 2 * self.joint + 1]) / 2
+
+
+def _joint_angles(features):
+    features = np.asarray(features)
+    return (features[..., 0:len(JOINT_ANGLES):2] + features[..., 1:len(JOINT_ANGLES):2]) / 2
+
+
+def _motion_range(sequence):
+    # Range of each joint's angle over a sequence, ignoring undetected frames
+    angles = _joint_angles(sequence)
+    angles = angles[np.any(angles != 0, axis=1)]
+    if len(angles) == 0:
+        return np.zeros(len(JOINT_ANGLES) // 2)
+    return np.percentile(angles, 95, axis=0) - np.percentile(angles, 5, axis=0)
+
+
+def rep_profile(feature_sequences):
+    """The joint that moves most across an exercise's references, or None."""
+    ranges = [_motion_range(sequence) for sequence in feature_sequences if len(sequence)]
+    if not ranges:
+        return None
+    typical = np.median(ranges, axis=0)
+    joint = int(np.argmax(typical))
+    if typical[joint] <= 0:
+        return None
+    return RepProfile(joint, float(typical[joint]) * REP_HYSTERESIS)
+
+
+class RepCounter:
+    """
+    Online rep counter over one joint angle of successive feature rows.
+
+    ``update`` returns a rep dict when the frame completes the outward half
+    of a rep, else None. Frames without a detected pose are skipped.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.reps = 0
+        self.frame = -1
+        self._value = None       # smoothed angle
+        self._direction = 0      # +1 / -1 while moving, 0 before the first move
+        self._outward = 0        # direction of the first move, away from the rest position
+        self._extreme = None     # farthest value in the current direction, and its frame
+        self._extreme_frame = 0
+        self._rest = None        # value and frame where the current rep started
+        self._rest_frame = 0
+        self._low = self._high = None  # lowest and highest (value, frame) before the first move
+
+    def update(self, features):
+        self.frame += 1
+        if not np.any(features):
+            return None
+        raw = float(self.profile.signal(features))
+        value = raw if self._value is None else REP_SMOOTHING * raw + (1 - REP_SMOOTHING) * self._value
+        self._value = value
+
+        if self._rest is None:
+            self._low = self._high = (value, self.frame)
+            self._rest = value
+            return None
+
+        hysteresis = self.profile.hysteresis
+        if self._direction == 0:
+            # Wait for the first real move; the set starts from the last
+            # lowest (or highest) point before it, not where the stream began
+            if value <= self._low[0]:
+                self._low = (value, self.frame)
+            if value >= self._high[0]:
+                self._high = (value, self.frame)
+            if value - self._low[0] >= hysteresis:
+                self._direction = self._outward = 1
+                self._rest, self._rest_frame = self._low
+            elif self._high[0] - value >= hysteresis:
+                self._direction = self._outward = -1
+                self._rest, self._rest_frame = self._high
+            else:
+                return None
+            self._extreme, self._extreme_frame = value, self.frame
+            return None
+
+        if (value - self._extreme) * self._direction >= 0:
+            self._extreme, self._extreme_frame = value, self.frame
+            return None
+        if (self._extreme - value) * self._direction < hysteresis:
+            return None
+
+        # Turned back at the extreme
+        turn, turn_frame = self._extreme, self._extreme_frame
+        rep = None
+        if self._direction == self._outward:
+            self.reps += 1
+            rep = {
+                "rep": self.reps,
+                "start_frame": self._rest_frame,
+                "peak_frame": turn_frame,
+                "range": round(abs(turn - self._rest), 4),
+            }
+        else:
+            self._rest, self._rest_frame = turn, turn_frame
+        self._direction = -self._direction
+        self._extreme, self._extreme_frame = value, self.frame
+        return rep
+
+
+def segment_reps(features, profile):
+    """
+    Split a feature sequence into repetitions: a list of (start, end) frame
+    ranges, end exclusive. A rep runs from where it started to where the
+    next one starts; the last is assumed to take as long to come back as it
+    took to go out.
+    """
+    counter = RepCounter(profile)
+    reps = [rep for rep in map(counter.update, features) if rep is not None]
+    segments = []
+    for rep, following in zip(reps, reps[1:] + [None]):
+        if following is not None:
+            end = following["start_frame"]
+        else:
+            end = min(len(features), 2 * rep["peak_frame"] - rep["start_frame"] + 1)
+        segments.append((rep["start_frame"], end))
+    return segments
+
+
+def rep_templates(sequences, feature_sequences, profile, limit=None):
+    """
+    Single repetitions cut out of whole reference ``sequences`` (keypoints
+    or features), segmented on their ``feature_sequences``, without the
+    ones much shorter than usual. With ``limit``, at most that many, spread
+    evenly over the references.
+    """
+    templates = [
+        sequence[start:end]
+        for sequence, features in zip(sequences, feature_sequences)
+        for start, end in segment_reps(features, profile)
+    ]
+    if templates:
+        # Fragments from jittery recordings aren't useful templates
+        shortest = max(2, 0.25 * np.median([len(template) for template in templates]))
+        templates = [template for template in templates if len(template) >= shortest]
+    if limit and len(templates) > limit:
+        picked = np.unique(np.linspace(0, len(templates) - 1, limit).round().astype(int))
+        templates = [templates[i] for i in picked]
+    return templates
@@ -0,0 +1,155 @@
+"""
+Nearest-reference search with a lower-bound pruning cascade.
+
+accuracy_score only depends on the smallest and the largest DTW distance
+between the upload and an exercise's references (the average never beats
+the best), so most full DTW evaluations can be skipped:
+
+* every reference gets a cheap lower bound (LB_Kim on the first and last
+  frames, and an LB_Keogh-style envelope bound both ways) and an upper bound
+  (the cost of the straight warping path);
+* the largest distance is found by evaluating references in decreasing
+  upper-bound order until no remaining upper bound exceeds the worst
+  distance seen;
+* the smallest distance is found by evaluating the rest in increasing
+  lower-bound order, stopping at the first bound that can't beat the best so
+  far, with early-abandoning DTW for references that can only matter as the
+  nearest one.
+
+``exact`` mode returns the same best and worst distances as evaluating every
+reference. ``top_k`` mode is approximate: it runs at most ``k`` full DTWs for
+the nearest reference plus one for the farthest.
+"""
+import numpy as np
+
+from .dtw import dtw_distance_bounded, dtw_distances, envelope_distance, flat_view, flatten, path_upper_bound
+
+SEARCH_MODES = ("all", "exact", "top_k")
+
+
+class ReferenceBounds:
+    """Envelopes and end frames of a list of references, computed once per index load."""
+
+    def __init__(self, references):
+        flat = [flat_view(ref) for ref in references]
+        width = next((ref.shape[1] for ref in flat if len(ref)), 0)
+        self.lengths = np.array([len(ref) for ref in flat])
+        empty = np.zeros(width)
+        self.first = np.array([ref[0] if len(ref) else empty for ref in flat])
+        self.last = np.array([ref[-1] if len(ref) else empty for ref in flat])
+        self.lo = np.array([ref.min(axis=0) if len(ref) else empty for ref in flat])
+        self.hi = np.array([ref.max(axis=0) if len(ref) else empty for ref in flat])
+
+
+class SearchResult:
+    def __init__(self, best, worst, best_index, references, evaluated, abandoned):
+        self.best = best
+        self.worst = worst
+        self.best_index = best_index
+        self.references = references
+        self.evaluated = evaluated        # full DTWs run to completion
+        self.abandoned = abandoned        # DTWs stopped early
+        self.pruned = references - evaluated - abandoned
+
+    def stats(self):
+        return {
+            "references": self.references,
+            "evaluated": self.evaluated,
+            "abandoned": self.abandoned,
+            "pruned": self.pruned,
+            "avoided": self.references - self.evaluated,
+        }
+
+
+def lower_bounds(q, references, bounds):
+    """Lower bound on the DTW distance from flattened query ``q`` to each reference."""
+    # LB_Kim: every warping path starts at the first cells and ends at the
+    # last ones, which are the same cell when both sequences have one frame
+    lb = np.linalg.norm(bounds.first - q[0], axis=1)
+    last = np.linalg.norm(bounds.last - q[-1], axis=1)
+    if len(q) == 1:
+        last[bounds.lengths == 1] = 0
+    lb += last
+    q_lo, q_hi = q.min(axis=0), q.max(axis=0)
+    for r, ref in enumerate(references):
+        if bounds.lengths[r] == 0:
+            lb[r] = np.inf
+            continue
+        lb[r] = max(
+            lb[r],
+            envelope_distance(q, bounds.lo[r], bounds.hi[r])[0],
+            envelope_distance(flat_view(ref), q_lo, q_hi)[0],
+        )
+    return lb
+
+
+def search(query, references, bounds=None, band=None, mode="exact", top_k=3):
+    """Best and worst DTW distance from ``query`` to ``references``."""
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode!r}")
+    count = len(references)
+    if mode == "all" or len(query) == 0 or count == 0:
+        distances = dtw_distances(query, references, band=band)
+        best_index = int(np.argmin(distances)) if count else None
+        return SearchResult(
+            float(distances.min()) if count else np.inf,
+            float(distances.max()) if count else np.inf,
+            best_index, count, count, 0,
+        )
+
+    q = flatten(query)
+    bounds = bounds or ReferenceBounds(references)
+    lb = lower_bounds(q, references, bounds)
+    ub = np.array([
+        path_upper_bound(q, flat_view(ref)) if bounds.lengths[r] else np.inf
+        for r, ref in enumerate(references)
+    ])
+
+    distances = np.full(count, np.nan)
+    # An empty reference is infinitely far without running anything
+    distances[bounds.lengths == 0] = np.inf
+    evaluated = abandoned = 0
+
+    def evaluate(r, threshold=None):
+        nonlocal evaluated, abandoned
+        if threshold is None:
+            distances[r] = dtw_distances(query, [references[r]], band=band)[0]
+            evaluated += 1
+            return
+        distance = dtw_distance_bounded(query, references[r], threshold, band=band)
+        if np.isinf(distance):
+            abandoned += 1
+        else:
+            distances[r] = distance
+            evaluated += 1
+
+    def known():
+        return distances[~np.isnan(distances)]
+
+    # Farthest reference
+    for r in np.argsort(-ub, kind='stable'):
+        if not np.isnan(distances[r]):
+            continue
+        worst = known().max(initial=-np.inf)
+        if ub[r] <= worst:
+            break
+        evaluate(r)
+        if mode == "top_k":
+            break
+
+    # Nearest reference
+    budget = top_k if mode == "top_k" else None
+    for r in np.argsort(lb, kind='stable'):
+        if not np.isnan(distances[r]):
+            continue
+        best = known().min(initial=np.inf)
+        if lb[r] >= best or budget == 0:
+            break
+        # Below the worst distance already found it can only matter as the nearest
+        evaluate(r, threshold=best if ub[r] <= known().max(initial=-np.inf) else None)
+        if budget is not None:
+            budget -= 1
+
+    found = known()
+    best_index = int(np.nanargmin(np.where(np.isnan(distances), np.inf, distances)))
+    return SearchResult(float(found.min()), float(found.max()), best_index, count, evaluated, abandoned)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Session,UserSessionResult,History
+from .models import Session,UserSessionResult,History,AnalysisJob
+from .models import DailyStats, SessionStats, UserStats
 
 from .models import Tutorial
 class UserSerializer(serializers.ModelSerializer):
@@ -56,8 +58,12 @@ class UserSessionResultSerializer(serializers.ModelSerializer):
             'created_at',
             'calories',
             'duration',
+            'sample_fps',
+            'video_status',
+            'rep_count',
+            'rep_scores',
         ]
-        read_only_fields = ['id', 'user', 'created_at']
+        read_only_fields = ['id', 'user', 'created_at', 'sample_fps', 'video_status', 'rep_count', 'rep_scores']
 
 
 class HistorySerializer(serializers.ModelSerializer):
@@ -86,3 +92,77 @@ class HistorySerializer(serializers.ModelSerializer):
         if obj.session.video:
             return obj.session.video.url  # Cloudinary URL
         return None
+
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    result = UserSessionResultSerializer(read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = [
+            'id',
+            'session',
+            'scoring_mode',
+            'status',
+            'attempts',
+            'max_attempts',
+            'error',
+            'created_at',
+            'started_at',
+            'finished_at',
+            'result',
+        ]
+        read_only_fields = fields
+
+
+class HistoryEntrySerializer(serializers.Serializer):
+    """One entry of a history upsert; the user comes from the request."""
+    session = serializers.PrimaryKeyRelatedField(queryset=Session.objects.all())
+    accuracy_score = serializers.FloatField(required=False, allow_null=True)
+    weight = serializers.FloatField(required=False)
+    created_at = serializers.DateTimeField(required=False)
+
+    def validate_accuracy_score(self, value):
+        # Stored with one decimal place
+        return None if value is None else round(value, 1)
+
+
+class HistorySyncSerializer(serializers.Serializer):
+    entries = HistoryEntrySerializer(many=True, allow_empty=False)
+
+    def validate_entries(self, entries):
+        if len(entries) > settings.HISTORY_SYNC_MAX_ENTRIES:
+            raise serializers.ValidationError(
+                f"At most {settings.HISTORY_SYNC_MAX_ENTRIES} entries per request")
+        missing = [i for i, entry in enumerate(entries) if 'weight' not in entry]
+        if missing:
+            raise serializers.ValidationError(f"Entries {missing} have no weight")
+        return entries
+
+
+STATS_FIELDS = ['results', 'calories', 'duration', 'accuracy_min', 'accuracy_avg', 'accuracy_max']
+
+
+class DailyStatsSerializer(serializers.ModelSerializer):
+    accuracy_avg = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DailyStats
+        fields = ['day'] + STATS_FIELDS
+
+
+class SessionStatsSerializer(serializers.ModelSerializer):
+    session_title = serializers.CharField(source='session.title', read_only=True)
+    accuracy_avg = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SessionStats
+        fields = ['session', 'session_title'] + STATS_FIELDS
+
+
+class UserStatsSerializer(serializers.ModelSerializer):
+    accuracy_avg = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = UserStats
+        fields = STATS_FIELDS + ['last_day', 'longest_streak']
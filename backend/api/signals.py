@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import stats
+from .catalog_cache import catalog_cache
+from .models import Session, Tutorial, UserSessionResult
+
+
+@receiver([post_save, post_delete], sender=Tutorial)
+@receiver([post_save, post_delete], sender=Session)
+def invalidate_catalog(sender, **kwargs):
+    # After commit, so a concurrent request can't cache the old rows under the new version
+    transaction.on_commit(catalog_cache.invalidate)
+
+
+@receiver(post_save, sender=UserSessionResult)
+def count_result(sender, instance, created, raw=False, **kwargs):
+    # Results aren't edited after they are created; rebuild_stats covers manual changes
+    if created and not raw:
+        stats.record_result(instance)
+
+
+@receiver(post_delete, sender=UserSessionResult)
+def uncount_result(sender, instance, **kwargs):
+    stats.forget_result(instance)
@@ -0,0 +1,165 @@
+"""
+Per-user progress statistics kept in summary tables.
+
+UserStats (all results), SessionStats (per exercise session) and
+DailyStats (per UTC day) hold counts, calorie and duration sums and
+accuracy sum/min/max. They are updated in the same transaction as the
+result they count, from the UserSessionResult save/delete signals (see
+signals.py), with the user's UserStats row locked so concurrent uploads
+don't lose updates. Minimum and maximum can't be taken back when a result
+is deleted, so those are re-read from the group's remaining results.
+
+A user without a UserStats row (results from before this existed) is
+rebuilt from scratch on first use; ``manage.py rebuild_stats`` does the
+same for everyone.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyStats, SessionStats, UserSessionResult, UserStats
+
+
+def result_day(result):
+    return timezone.localdate(result.created_at, timezone=datetime.timezone.utc)
+
+
+def _day_range(day):
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+def streaks(days):
+    """(current streak ending at the last day, longest streak) of sorted distinct days."""
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and day == previous + datetime.timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+@transaction.atomic
+def record_result(result):
+    stats = UserStats.objects.select_for_update().filter(user_id=result.user_id).first()
+    if stats is None:
+        rebuild([result.user_id])
+        return
+
+    day = result_day(result)
+    session_stats, _ = SessionStats.objects.get_or_create(user_id=result.user_id, session_id=result.session_id)
+    daily_stats, _ = DailyStats.objects.get_or_create(user_id=result.user_id, day=day)
+    for row in (stats, session_stats, daily_stats):
+        row.add(result)
+        row.save()
+
+    if stats.last_day is None or day > stats.last_day:
+        continues = stats.last_day is not None and day == stats.last_day + datetime.timedelta(days=1)
+        stats.current_streak = stats.current_streak + 1 if continues else 1
+        stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+        stats.last_day = day
+        stats.save(update_fields=['last_day', 'current_streak', 'longest_streak'])
+
+
+@transaction.atomic
+def forget_result(result):
+    stats = UserStats.objects.select_for_update().filter(user_id=result.user_id).first()
+    if stats is None:
+        # Never counted, or the user is being deleted
+        return
+
+    day = result_day(result)
+    results = UserSessionResult.objects.filter(user_id=result.user_id).exclude(id=result.id)
+    groups = [
+        (stats, results),
+        (SessionStats.objects.filter(user_id=result.user_id, session_id=result.session_id).first(),
+         results.filter(session_id=result.session_id)),
+        (DailyStats.objects.filter(user_id=result.user_id, day=day).first(),
+         results.filter(created_at__range=_day_range(day))),
+    ]
+    day_emptied = False
+    for row, remaining in groups:
+        if row is None:
+            continue
+        row.remove(result, remaining)
+        if row.results <= 0 and row is not stats:
+            row.delete()
+            day_emptied = day_emptied or isinstance(row, DailyStats)
+        else:
+            row.save()
+
+    if day_emptied:
+        days = list(DailyStats.objects.filter(user_id=result.user_id).order_by('day').values_list('day', flat=True))
+        stats.last_day = days[-1] if days else None
+        stats.current_streak, stats.longest_streak = streaks(days)
+        stats.save(update_fields=['last_day', 'current_streak', 'longest_streak'])
+
+
+def _aggregate(rows, model, **extra):
+    return model(
+        results=rows['results'],
+        calories=rows['calories'] or 0,
+        duration=rows['duration'] or 0,
+        accuracy_sum=rows['accuracy_sum'] or 0,
+        accuracy_min=rows['accuracy_min'],
+        accuracy_max=rows['accuracy_max'],
+        **extra,
+    )
+
+
+AGGREGATES = {
+    'results': Count('id'),
+    'calories': Sum('calories'),
+    'duration': Sum('duration'),
+    'accuracy_sum': Sum('accuracy_score'),
+    'accuracy_min': Min('accuracy_score'),
+    'accuracy_max': Max('accuracy_score'),
+}
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Recompute every summary row of ``user_ids`` from their results."""
+    for user_id in user_ids:
+        # Lock (or create) the user's row first so incremental updates wait
+        stats, _ = UserStats.objects.select_for_update().get_or_create(user_id=user_id)
+        SessionStats.objects.filter(user_id=user_id).delete()
+        DailyStats.objects.filter(user_id=user_id).delete()
+
+        results = UserSessionResult.objects.filter(user_id=user_id).order_by()
+        SessionStats.objects.bulk_create(
+            _aggregate(rows, SessionStats, user_id=user_id, session_id=rows['session_id'])
+            for rows in results.values('session_id').annotate(**AGGREGATES)
+        )
+        daily = [
+            _aggregate(rows, DailyStats, user_id=user_id, day=rows['day'])
+            for rows in results.annotate(day=TruncDate('created_at', tzinfo=datetime.timezone.utc))
+                               .values('day').annotate(**AGGREGATES).order_by('day')
+        ]
+        DailyStats.objects.bulk_create(daily)
+
+        totals = _aggregate(results.aggregate(**AGGREGATES), UserStats, id=stats.id, user_id=user_id)
+        days = [row.day for row in daily]
+        totals.last_day = days[-1] if days else None
+        totals.current_streak, totals.longest_streak = streaks(days)
+        totals.save(force_update=True)
+
+
+def get_user_stats(user):
+    stats = UserStats.objects.filter(user=user).first()
+    if stats is None:
+        rebuild([user.id])
+        stats = UserStats.objects.get(user=user)
+    return stats
+
+
+def current_streak(stats, today=None):
+    """The streak as of today: broken once a whole day has passed without a result."""
+    today = today or timezone.localdate(timezone=datetime.timezone.utc)
+    if stats.last_day is None or stats.last_day < today - datetime.timedelta(days=1):
+        return 0
+    return stats.current_streak
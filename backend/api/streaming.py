@@ -0,0 +1,317 @@
+"""
+Live scoring of client-side keypoints over a WebSocket.
+
+A client running pose estimation itself (as for process_keypoints) opens
+
+    ws(s)://<host>/ws/stream/?token=<access token>&session=<id>&fps=30&weight=70
+
+with optional ``scoring_mode`` and ``dtype`` (``float32``, the default, or
+``float16``). It then sends frames as binary messages, each a little-endian
+``(frames, 33, 4)`` array in that dtype without a header, or as text
+``{"type": "frames", "keypoints": [...]}``. Frames are sampled like uploads
+(POSE_TARGET_FPS) and compared with the session's references by
+``dtw.OnlineDTW``, one frame at a time.
+
+After every message the server sends
+``{"type": "progress", "frames", "accuracy", "reps", "elapsed_ms"}``, and a
+``{"type": "rep", ...}`` message for each rep the message completed (see
+reps.py). ``accuracy`` is the score the frames so far would get as an
+upload. ``{"type": "end", "save": true}`` ends the stream with a
+``{"type": "summary", ...}`` and, with ``save``, stores it as a result.
+Errors are sent as ``{"type": "error", "error"}`` before the socket is
+closed with code 4000 + the matching HTTP status (4400, 4401, 4404).
+
+Nothing grows with the length of the stream: a connection holds one DTW
+column per reference and the rep counter's few values, and frames are
+dropped once scored. Work per frame is bounded by
+STREAM_MAX_REFERENCE_FRAMES and runs in a thread pool so other
+connections on the event loop aren't held up.
+"""
+import json
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import metrics
+from .analysis import (
+    AnalysisError, accuracy_from_distances, calories_burned, sampling_options, save_result, scoring_mode,
+)
+from .dtw import OnlineDTW
+from .features import keypoint_features
+from .keypoint_upload import FRAME_SHAPE
+from .models import Session
+from .reference_index import get_reference_index
+from .reps import RepCounter
+
+STREAM_DTYPES = ("float32", "float16")
+
+
+class LiveScorer:
+    """Running accuracy and reps of a keypoint stream against one exercise's references."""
+
+    def __init__(self, stacked, profile, mode, fps, step):
+        self.dtw = OnlineDTW(stacked)
+        self.counter = RepCounter(profile) if profile is not None else None
+        self.mode = mode
+        self.fps = fps
+        self.step = step
+        self.received = 0   # frames received, before sampling
+
+    @property
+    def sample_fps(self):
+        return self.fps / self.step
+
+    def feed(self, keypoints):
+        """Score a (frames, 33, 4) batch; returns the rep events it completed."""
+        offset = -self.received % self.step
+        self.received += len(keypoints)
+        sampled = keypoints[offset::self.step]
+        features = keypoint_features(sampled)
+        events = []
+        for frame, row in zip(sampled, features):
+            self.dtw.update(row if self.mode == "features" else frame)
+            rep = self.counter.update(row) if self.counter is not None else None
+            if rep is not None:
+                events.append({
+                    "type": "rep",
+                    **rep,
+                    "time": round(rep["peak_frame"] / self.sample_fps, 2),
+                    "accuracy": self.accuracy(),
+                })
+        return events
+
+    def accuracy(self):
+        """Accuracy of the frames so far, or None before the first one."""
+        distances = self.dtw.distances()
+        if self.dtw.frames == 0 or not np.isfinite(distances).any():
+            return None
+        distances = distances[np.isfinite(distances)]
+        return accuracy_from_distances(float(distances.min()), float(distances.max()))
+
+    def progress(self):
+        return {
+            "type": "progress",
+            "frames": self.received,
+            "accuracy": self.accuracy(),
+            "reps": self.counter.reps if self.counter is not None else None,
+        }
+
+
+class Stream:
+    """One connection: who is streaming which session, and its scorer."""
+
+    def __init__(self, user, session, exercise_key, weight, dtype, scorer):
+        self.user = user
+        self.session = session
+        self.exercise_key = exercise_key
+        self.weight = weight
+        self.dtype = dtype
+        self.scorer = scorer
+
+    def analysis(self):
+        accuracy = self.scorer.accuracy()
+        if accuracy is None:
+            raise AnalysisError("No frames were received")
+        duration_minutes = round(self.scorer.received / self.scorer.fps / 60, 2)
+        return {
+            "accuracy_score": accuracy,
+            "calories": calories_burned(self.session.title, self.weight, duration_minutes),
+            "duration": duration_minutes,
+            "sample_fps": round(self.scorer.sample_fps, 2),
+        }
+
+    def finish(self, save):
+        analysis = self.analysis()
+        summary = {
+            "type": "summary",
+            "accuracy_score": analysis["accuracy_score"],
+            "calories_burned": analysis["calories"],
+            "duration": analysis["duration"],
+            "frames": self.scorer.received,
+            "reps": self.scorer.counter.reps if self.scorer.counter is not None else None,
+        }
+        if save:
+            summary["result_id"] = save_result(self.user, self.session, analysis).id
+        return summary
+
+
+def _param(params, name):
+    values = params.get(name)
+    return values[-1] if values else None
+
+
+def _authenticate(scope, params):
+    raw_token = _param(params, 'token')
+    if raw_token is None:
+        # Non-browser clients may send the usual header instead
+        for name, value in scope.get('headers', []):
+            if name == b'authorization' and value.lower().startswith(b'bearer '):
+                raw_token = value[7:].decode('latin-1')
+    if not raw_token:
+        raise AnalysisError("Authentication required", 401)
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        raise AnalysisError("Invalid or expired token", 401)
+
+
+def open_stream(scope, params):
+    """Validate a connection's query parameters and set up its scorer."""
+    user = _authenticate(scope, params)
+    try:
+        session_id = int(_param(params, 'session'))
+        fps = float(_param(params, 'fps'))
+        weight = float(_param(params, 'weight') or 0)
+    except (TypeError, ValueError):
+        raise AnalysisError("session, fps and weight must be numbers")
+    if not 0 < fps <= settings.KEYPOINT_UPLOAD_MAX_FPS:
+        raise AnalysisError(f"fps must be between 0 and {settings.KEYPOINT_UPLOAD_MAX_FPS}")
+    dtype = _param(params, 'dtype') or "float32"
+    if dtype not in STREAM_DTYPES:
+        raise AnalysisError(f"dtype must be one of {', '.join(STREAM_DTYPES)}")
+    mode = scoring_mode(_param(params, 'scoring_mode'))
+
+    session = Session.objects.filter(id=session_id).first()
+    if session is None:
+        raise AnalysisError("Session not found", 404)
+    index = get_reference_index()
+    exercise_key = index.exercise_key(session.title)
+    if exercise_key is None:
+        raise AnalysisError("No matching dataset found", 404)
+    stacked, _ = index.stacked(
+        exercise_key, features=mode == "features", max_frames=settings.STREAM_MAX_REFERENCE_FRAMES,
+    )
+    if not len(stacked):
+        raise AnalysisError("No .npy files found in dataset folder", 404)
+
+    step = sampling_options().frame_step(fps)
+    scorer = LiveScorer(stacked, index.rep_profile(exercise_key), mode, fps, step)
+    return Stream(user, session, exercise_key, weight, dtype, scorer)
+
+
+def _check_frames(keypoints):
+    if keypoints.ndim != 3 or keypoints.shape[1:] != FRAME_SHAPE:
+        raise AnalysisError("Frames must have shape (frames, 33, 4)")
+    if len(keypoints) > settings.STREAM_MAX_MESSAGE_FRAMES:
+        raise AnalysisError(f"At most {settings.STREAM_MAX_MESSAGE_FRAMES} frames are accepted per message")
+    if not np.isfinite(keypoints).all():
+        raise AnalysisError("Keypoints must be finite numbers")
+    return keypoints
+
+
+def decode_frames(data, dtype):
+    """A binary message: raw little-endian (frames, 33, 4) values."""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    values_per_frame = int(np.prod(FRAME_SHAPE))
+    if len(data) % (dtype.itemsize * values_per_frame):
+        raise AnalysisError("Binary messages must hold whole (33, 4) frames")
+    keypoints = np.frombuffer(data, dtype=dtype).reshape((-1,) + FRAME_SHAPE)
+    return _check_frames(keypoints.astype(np.float32))
+
+
+def frames_from_json(payload):
+    try:
+        keypoints = np.asarray(payload.get('keypoints'), dtype=np.float32)
+    except (TypeError, ValueError):
+        raise AnalysisError("keypoints must be a list of (33, 4) frames")
+    return _check_frames(keypoints)
+
+
+def _with_db(func):
+    # Like a request: the connection may have gone stale since the last call
+    def call(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(call)
+
+
+async def _send_json(send, payload):
+    await send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+
+async def _fail(send, exc):
+    await _send_json(send, {"type": "error", "error": exc.message})
+    await send({'type': 'websocket.close', 'code': 4000 + exc.status_code})
+
+
+async def stream_application(scope, receive, send):
+    """The ASGI application behind STREAM_PATH."""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    # Accept first so errors reach the client as messages, not a failed handshake
+    await send({'type': 'websocket.accept'})
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        stream = await _with_db(open_stream)(scope, params)
+    except AnalysisError as exc:
+        await _fail(send, exc)
+        return
+
+    await _send_json(send, {
+        "type": "ready",
+        "exercise": stream.exercise_key,
+        "references": len(stream.scorer.dtw.stacked),
+        "sample_fps": round(stream.scorer.sample_fps, 2),
+    })
+    feed = sync_to_async(stream.scorer.feed, thread_sensitive=False)
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        try:
+            if message.get('bytes') is not None:
+                keypoints = decode_frames(message['bytes'], stream.dtype)
+            else:
+                try:
+                    payload = json.loads(message.get('text') or '')
+                except ValueError:
+                    raise AnalysisError("Text messages must be JSON")
+                if not isinstance(payload, dict):
+                    raise AnalysisError("Text messages must be JSON objects")
+                if payload.get('type') == 'end':
+                    summary = await _with_db(stream.finish)(bool(payload.get('save')))
+                    await _send_json(send, summary)
+                    await send({'type': 'websocket.close', 'code': 1000})
+                    return
+                keypoints = frames_from_json(payload)
+
+            start = time.perf_counter()
+            events = await feed(keypoints)
+            elapsed = time.perf_counter() - start
+        except AnalysisError as exc:
+            await _fail(send, exc)
+            return
+
+        metrics.observe("gymfreak_stream_message_seconds", elapsed, exercise=stream.exercise_key)
+        metrics.inc("gymfreak_stream_frames_total", len(keypoints), exercise=stream.exercise_key)
+        for event in events:
+            await _send_json(send, event)
+        await _send_json(send, {**stream.scorer.progress(), "elapsed_ms": round(elapsed * 1000, 2)})
+
+
+def route_websockets(http_application):
+    """
+    Wrap Django's ASGI application: WebSocket connections to STREAM_PATH go
+    to stream_application, other WebSockets are refused and everything else
+    is passed through.
+    """
+    async def application(scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await http_application(scope, receive, send)
+        if scope['path'] == settings.STREAM_PATH:
+            return await stream_application(scope, receive, send)
+        await receive()
+        await send({'type': 'websocket.close'})
+    return application
@@ -0,0 +1,181 @@
+"""
+DTW barycenter templates of each exercise's references.
+
+``manage.py build_templates`` clusters an exercise's references by the DTW
+distance between their features (k-medoids) and averages every cluster
+with DTW barycenter averaging (DBA, Petitjean et al. 2011): starting from
+the medoid, each member is aligned to the current average and every frame
+of the average becomes the mean of the member frames aligned to it, until
+it stops changing. The template of each cluster is stored for both scoring
+modes, raw keypoints and features, together with the DTW distances of the
+cluster's members to it (its spread).
+
+With REFERENCE_MODE = 'templates', whole-clip scoring compares an upload
+with those few templates instead of every reference. Rep-by-rep scoring
+(REP_SCORING_ENABLED) doesn't use them: a template averages whole clips,
+so it only matters for clips scored whole. The full mode's
+accuracy is relative to the farthest reference, which the templates no
+longer contain, so it is estimated as the farthest template plus the
+largest member distance of its cluster.
+"""
+import time
+
+import numpy as np
+
+from .dtw import dtw_distances, dtw_path, flatten
+from .reference_store import TEMPLATE_FEATURES, TEMPLATES, write_store
+from .search import SearchResult, search
+
+DEFAULT_CLUSTERS = 4
+DEFAULT_ITERATIONS = 10
+
+
+def pairwise_dtw(sequences):
+    """Symmetric matrix of DTW distances between every pair of sequences."""
+    count = len(sequences)
+    distances = np.zeros((count, count))
+    for i in range(count - 1):
+        distances[i, i + 1:] = dtw_distances(sequences[i], sequences[i + 1:])
+        distances[i + 1:, i] = distances[i, i + 1:]
+    return distances
+
+
+def kmedoids(distances, k, max_iterations=100):
+    """
+    Cluster with k-medoids over a distance matrix. Starts from the most
+    central item and then the items farthest from the medoids so far, so the
+    result is deterministic. Returns (labels, medoid indices).
+    """
+    count = len(distances)
+    k = max(1, min(k, count))
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(distances[:, medoids].min(axis=1))))
+
+    for _ in range(max_iterations):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        updated = []
+        for cluster in range(k):
+            members = np.flatnonzero(labels == cluster)
+            within = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmin(within)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return np.argmin(distances[:, medoids], axis=1), medoids
+
+
+def dba(sequences, initial, iterations=DEFAULT_ITERATIONS, tolerance=1e-6):
+    """DTW barycenter average of ``sequences``, refined from ``initial``."""
+    shape = np.asarray(initial).shape
+    average = flatten(initial).copy()
+    members = [flatten(sequence) for sequence in sequences]
+    for _ in range(iterations):
+        sums = np.zeros_like(average)
+        counts = np.zeros(len(average))
+        for member in members:
+            _, path = dtw_path(average, member)
+            rows, cols = np.array(path).T
+            np.add.at(sums, rows, member[cols])
+            np.add.at(counts, rows, 1)
+        updated = sums / counts[:, None]
+        change = np.abs(updated - average).max()
+        average = updated
+        if change < tolerance:
+            break
+    return average.reshape(shape)
+
+
+def build_templates(references, features, clusters=DEFAULT_CLUSTERS, iterations=DEFAULT_ITERATIONS):
+    """
+    DBA templates of one exercise. ``references`` and ``features`` are the
+    exercise's (name, array) lists in the same order. Returns
+    ``{"keypoints": [...], "features": [...]}``, each a list of
+    (template name, array, stats) with one entry per cluster.
+    """
+    names = [name for name, _ in references]
+    keypoints = [np.asarray(array, dtype=np.float64) for _, array in references]
+    feature_arrays = [np.asarray(array, dtype=np.float64) for _, array in features]
+    labels, medoids = kmedoids(pairwise_dtw(feature_arrays), clusters)
+
+    built = {"keypoints": [], "features": []}
+    for cluster, medoid in enumerate(medoids):
+        members = [int(i) for i in np.flatnonzero(labels == cluster)]
+        for kind, sequences in (("keypoints", keypoints), ("features", feature_arrays)):
+            member_sequences = [sequences[i] for i in members]
+            template = dba(member_sequences, sequences[medoid], iterations)
+            spread = dtw_distances(template, member_sequences)
+            built[kind].append((f"cluster{cluster}", template, {
+                "members": [names[i] for i in members],
+                "medoid": names[medoid],
+                "spread_mean": round(float(spread.mean()), 4),
+                "spread_max": round(float(spread.max()), 4),
+            }))
+    return built
+
+
+def write_templates(directory, name, built):
+    """Store built templates as the TEMPLATES and TEMPLATE_FEATURES stores of ``name``."""
+    for kind, store_kind in (("keypoints", TEMPLATES), ("features", TEMPLATE_FEATURES)):
+        write_store(
+            directory, name,
+            [(template_name, template) for template_name, template, _ in built[kind]],
+            kind=store_kind,
+            extra=[stats for _, _, stats in built[kind]],
+        )
+
+
+def search_templates(query, templates, spread, band=None):
+    """
+    A SearchResult for ``query`` against templates: the nearest template,
+    and the farthest one plus its cluster's spread as the stand-in for the
+    farthest reference.
+    """
+    distances = dtw_distances(query, templates, band=band)
+    best_index = int(np.argmin(distances))
+    worst = float(np.max(distances + np.asarray(spread)))
+    return SearchResult(float(distances[best_index]), worst, best_index, len(templates), len(templates), 0)
+
+
+def compare_modes(references, features, mode="keypoints", clusters=DEFAULT_CLUSTERS,
+                  iterations=DEFAULT_ITERATIONS, holdout_every=5, band=None):
+    """
+    Score held-out references against the rest of an exercise in both modes.
+    Every ``holdout_every``-th reference is a query; templates are built
+    from the others only, so no query is scored against itself. Returns a
+    dict of the per-query accuracies and timings.
+    """
+    from .analysis import accuracy_from_search
+
+    held_out = set(range(0, len(references), holdout_every))
+    train = [i for i in range(len(references)) if i not in held_out]
+    if not held_out or len(train) < 2:
+        return None
+
+    start = time.perf_counter()
+    built = build_templates(
+        [references[i] for i in train], [features[i] for i in train], clusters, iterations,
+    )
+    build_seconds = time.perf_counter() - start
+
+    sets = features if mode == "features" else references
+    full_set = [np.asarray(sets[i][1]) for i in train]
+    templates = [template for _, template, _ in built[mode]]
+    spread = [stats["spread_max"] for _, _, stats in built[mode]]
+
+    rows = []
+    for i in sorted(held_out):
+        query = np.asarray(sets[i][1])
+        start = time.perf_counter()
+        full = accuracy_from_search(search(query, full_set, band=band, mode="exact"))
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        template = accuracy_from_search(search_templates(query, templates, spread, band=band))
+        template_seconds = time.perf_counter() - start
+        rows.append((references[i][0], full, template, full_seconds, template_seconds))
+    return {
+        "references": len(train),
+        "templates": len(templates),
+        "build_seconds": build_seconds,
+        "queries": rows,
+    }
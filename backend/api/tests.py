@@ -1,3 +1,1238 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from fastdtw import fastdtw
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from scipy.spatial.distance import euclidean
+
+from . import jobs, loadtest, preprocessing, video_uploads
+from .analysis import AnalysisError, analyze_extraction, score_keypoints
+from .pose import (
+    Extraction, ExtractionTooLarge, KeypointReader, PoolExhausted, PosePool, SamplingOptions, extract_keypoints,
+)
+from .pose_server import PoseServer, PoseServerError, RemotePosePool
+from .benchmarks import compare as compare_benchmarks
+from .catalog_cache import catalog_cache
+from .dtw import (
+    OnlineDTW, StackedReferences, _accumulate, band_mask, dtw_distance, dtw_distance_bounded, dtw_distances,
+    flat_view, flatten, pairwise_distances,
+)
+from .features import FEATURE_DIM, keypoint_features
+from .keypoint_cache import KeypointCache, get_keypoint_cache
+from .models import (
+    AnalysisJob, DailyStats, History, Session, SessionStats, Tutorial, UserSessionResult, UserStats,
+    use_local_media_storage,
+)
+from .reference_index import ReferenceIndex, get_reference_index
+from .reference_store import FEATURES, TEMPLATES, convert_folder, find_stores, load_store
+from .reps import RepCounter, RepProfile, segment_reps
+from .search import ReferenceBounds, lower_bounds, search
+from .stats import rebuild as rebuild_stats
+from .streaming import route_websockets
+from .templates import build_templates, dba, kmedoids, pairwise_dtw, search_templates, write_templates
+from .uploads import StreamingExtraction, is_streamable
+
+
+def synthetic_sequence(rng, frames):
+    """Smooth random walk shaped like extract_keypoints_from_video output."""
+    steps = rng.normal(scale=0.01, size=(frames, 33, 4))
+    return np.clip(0.5 + np.cumsum(steps, axis=0), 0, 1)
+
+
+def synthetic_video(path, frames=12, size=(160, 120), fps=10):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(frames):
+        frame = np.full((size[1], size[0], 3), 40, dtype=np.uint8)
+        cv2.circle(frame, (20 + 8 * i, size[1] // 2), 10, (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def exact_fastdtw(seq1, seq2):
+    # fastdtw falls back to full DTW when the radius covers both sequences
+    radius = max(len(seq1), len(seq2))
+    distance, _ = fastdtw(seq1.reshape(len(seq1), -1), seq2.reshape(len(seq2), -1),
+                          radius=radius, dist=euclidean)
+    return distance
+
+
+class DTWTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def test_matches_exact_fastdtw(self):
+        for n, m in [(1, 1), (1, 7), (12, 12), (20, 35), (48, 17)]:
+            a = synthetic_sequence(self.rng, n)
+            b = synthetic_sequence(self.rng, m)
+            self.assertAlmostEqual(dtw_distance(a, b), exact_fastdtw(a, b), places=6)
+
+    def test_never_worse_than_approximate_fastdtw(self):
+        a = synthetic_sequence(self.rng, 60)
+        b = synthetic_sequence(self.rng, 45)
+        approx, _ = fastdtw(a.reshape(60, -1), b.reshape(45, -1), dist=euclidean)
+        self.assertLessEqual(dtw_distance(a, b), approx + 1e-9)
+
+    def test_batch_matches_pairwise(self):
+        query = synthetic_sequence(self.rng, 30)
+        references = [synthetic_sequence(self.rng, m) for m in (25, 40, 5, 31)]
+        batched = dtw_distances(query, references)
+        expected = [exact_fastdtw(query, ref) for ref in references]
+        np.testing.assert_allclose(batched, expected, rtol=1e-9)
+
+    def test_long_queries_are_skewed_along_the_reference(self):
+        query = synthetic_sequence(self.rng, 2000)
+        references = [synthetic_sequence(self.rng, m) for m in (20, 8)]
+        swapped = [dtw_distance(ref, query) for ref in references]
+        np.testing.assert_allclose(dtw_distances(query, references), swapped, rtol=1e-9)
+        # The band isn't symmetric; compare with the recurrence laid out along the query
+        q, ref = query.reshape(len(query), -1), references[0].reshape(20, -1)
+        cost = pairwise_distances(q, ref)
+        cost[~band_mask(len(q), len(ref), 5)] = np.inf
+        expected = _accumulate(cost[None])[0, len(q) + len(ref) - 1, len(q)]
+        self.assertAlmostEqual(dtw_distance(query, references[0], band=5), expected)
+        self.assertAlmostEqual(dtw_distance_bounded(query, references[0], np.inf, band=5), expected)
+        tracemalloc.start()
+        try:
+            dtw_distances(query, references[:1])
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Skewed along the query, the accumulated costs alone were 32 MB
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+    def test_batches_split_by_memory_budget(self):
+        query = synthetic_sequence(self.rng, 30)
+        references = [synthetic_sequence(self.rng, m) for m in (25, 40, 5, 31)]
+        np.testing.assert_allclose(
+            dtw_distances(query, references, max_batch_bytes=1),
+            dtw_distances(query, references),
+        )
+
+    def test_band(self):
+        a = synthetic_sequence(self.rng, 40)
+        b = synthetic_sequence(self.rng, 55)
+        exact = dtw_distance(a, b)
+        self.assertGreaterEqual(dtw_distance(a, b, band=2), exact - 1e-9)
+        self.assertAlmostEqual(dtw_distance(a, b, band=100), exact, places=9)
+        # Very unequal lengths still have a path through the band
+        c = synthetic_sequence(self.rng, 5)
+        self.assertTrue(np.isfinite(dtw_distance(a, c, band=0)))
+
+    def test_empty_query(self):
+        b = synthetic_sequence(self.rng, 10)
+        self.assertEqual(dtw_distances(np.zeros((0, 33, 4)), [b]).tolist(), [np.inf])
+
+    def test_online_matches_batch_on_every_prefix(self):
+        query = synthetic_sequence(self.rng, 15)
+        references = [synthetic_sequence(self.rng, m) for m in (12, 1, 30, 7)]
+        online = OnlineDTW(StackedReferences(references))
+        for n in range(1, len(query) + 1):
+            online.update(query[n - 1])
+            np.testing.assert_allclose(online.distances(), dtw_distances(query[:n], references), rtol=1e-9)
+
+
+class RepCounterTests(SimpleTestCase):
+    def test_counts_each_cycle_once(self):
+        # Five squats: the knee angle dips from straight and comes back
+        angle = 0.9 - 0.3 * (1 - np.cos(np.linspace(0, 10 * np.pi, 200))) / 2
+        features = np.zeros((len(angle), FEATURE_DIM), dtype=np.float32)
+        features[:, 6] = features[:, 7] = angle
+        features[:, 0] = 0.5
+        features[50:53] = 0  # lost the pose for a moment
+
+        counter = RepCounter(RepProfile(joint=3, hysteresis=0.1))
+        reps = [rep for rep in map(counter.update, features) if rep]
+        self.assertEqual([rep['rep'] for rep in reps], [1, 2, 3, 4, 5])
+        # Bottom of the first dip, give or take the smoothing lag
+        self.assertAlmostEqual(reps[0]['peak_frame'], 20, delta=1)
+        self.assertAlmostEqual(reps[1]['range'], 0.3, delta=0.02)
+
+    def test_segments_cover_each_rep(self):
+        # Stand still, then three reps of 40 frames
+        angle = np.concatenate([np.full(30, 0.9), 0.9 - 0.3 * (1 - np.cos(np.linspace(0, 6 * np.pi, 121))) / 2])
+        features = np.zeros((len(angle), FEATURE_DIM), dtype=np.float32)
+        features[:, 6] = features[:, 7] = angle
+        segments = segment_reps(features, RepProfile(joint=3, hysteresis=0.1))
+        self.assertEqual(len(segments), 3)
+        for (start, end), expected in zip(segments, (30, 70, 110)):
+            self.assertAlmostEqual(start, expected, delta=2)
+            self.assertAlmostEqual(end - start, 40, delta=2)
+
+
+class SearchTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.query = synthetic_sequence(rng, 40)
+        self.references = [synthetic_sequence(rng, m) for m in (30, 45, 0, 60, 38, 50)]
+        self.references.append(self.query[5:35] + 0.001)
+        self.distances = dtw_distances(self.query, self.references)
+
+    def test_bounds_enclose_distances(self):
+        bounds = ReferenceBounds(self.references)
+        lb = lower_bounds(self.query.reshape(40, -1), self.references, bounds)
+        self.assertTrue(np.all(lb <= self.distances + 1e-9))
+
+    def test_bounds_with_single_frames(self):
+        # The first and last cells are the same cell; LB_Kim mustn't count it twice
+        query = self.query[:1]
+        references = [self.references[0][:1], self.references[1]]
+        lb = lower_bounds(query.reshape(1, -1), references, ReferenceBounds(references))
+        distances = dtw_distances(query, references)
+        self.assertTrue(np.all(lb <= distances + 1e-9))
+        self.assertAlmostEqual(search(query, references, mode='exact').best, distances.min())
+
+    def test_float32_references_are_not_converted_whole(self):
+        references = [ref.astype(np.float32) for ref in self.references]
+        self.assertTrue(np.shares_memory(flat_view(references[0]), references[0]))
+        as_float64 = [ref.astype(np.float64) for ref in references]
+        np.testing.assert_array_equal(dtw_distances(self.query, references), dtw_distances(self.query, as_float64))
+        expected = search(self.query, as_float64, mode='exact')
+        with mock.patch('api.search.flatten', wraps=flatten) as converted:
+            result = search(self.query, references, mode='exact')
+        self.assertEqual(converted.call_count, 1)  # the query only
+        self.assertEqual((result.best, result.worst, result.best_index), (expected.best, expected.worst, expected.best_index))
+
+    def test_early_abandon(self):
+        distance = self.distances[0]
+        self.assertEqual(dtw_distance_bounded(self.query, self.references[0], distance * 0.5), np.inf)
+        self.assertAlmostEqual(dtw_distance_bounded(self.query, self.references[0], distance * 2), distance)
+
+    def test_exact_search_matches_full_evaluation(self):
+        for band in (None, 5):
+            distances = dtw_distances(self.query, self.references, band=band)
+            result = search(self.query, self.references, band=band, mode='exact')
+            self.assertAlmostEqual(result.best, distances.min())
+            self.assertEqual(result.worst, distances.max())
+            self.assertEqual(result.best_index, len(self.references) - 1)
+            self.assertLess(result.evaluated, len(self.references))
+
+    def test_top_k_limits_evaluations(self):
+        result = search(self.query, self.references, mode='top_k', top_k=1)
+        self.assertLessEqual(result.evaluated + result.abandoned, 2)
+        self.assertAlmostEqual(result.best, self.distances.min())
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_compare_flags_regressions(self):
+        def results(**timings):
+            return {"results": {name: {"min": seconds} for name, seconds in timings.items()}}
+
+        rows = compare_benchmarks(results(a=1.0, b=1.5, c=0.5, new=1.0), results(a=1.1, b=1.0, c=1.0), threshold=0.25)
+        self.assertEqual([(row[0], row[4]) for row in rows], [('a', 'ok'), ('b', 'regression'), ('c', 'improvement')])
+
+
+class FeatureTests(SimpleTestCase):
+    def test_invariant_to_translation_and_scale(self):
+        keypoints = synthetic_sequence(np.random.default_rng(3), 20)
+        moved = keypoints.copy()
+        moved[..., :2] = moved[..., :2] * 0.5 + 0.3
+        features = keypoint_features(keypoints)
+        self.assertEqual(features.shape, (20, FEATURE_DIM))
+        np.testing.assert_allclose(keypoint_features(moved), features, rtol=1e-4, atol=1e-4)
+
+    def test_missing_pose_gives_zero_features(self):
+        features = keypoint_features(np.zeros((3, 33, 4)))
+        self.assertFalse(features.any())
+
+
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp, 'media'),
+            # Local stand-in for Cloudinary
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            RESULT_VIDEO_STAGING_DIR=os.path.join(self.tmp, 'staging'),
+            ANALYSIS_JOB_UPLOAD_DIR=os.path.join(self.tmp, 'jobs'),
+            KEYPOINT_CACHE_DIR=os.path.join(self.tmp, 'keypoints'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.session = Session.objects.create(title='Squat', description='', video='squat.mp4')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        video_path = os.path.join(self.tmp, 'clip.mp4')
+        synthetic_video(video_path)
+        with open(video_path, 'rb') as f:
+            self.video_bytes = f.read()
+
+    def upload(self, **extra):
+        data = {
+            'uploaded_video': SimpleUploadedFile('clip.mp4', self.video_bytes, content_type='video/mp4'),
+            'session': self.session.id,
+            'title': self.session.title,
+            'weight': 70,
+            **extra,
+        }
+        return self.client.post(reverse('process_video'), data, format='multipart')
+
+    def use_queue(self, queue):
+        jobs._queue = queue
+        self.addCleanup(setattr, jobs, '_queue', None)
+
+    def test_async_upload_with_inline_queue(self):
+        self.use_queue(jobs.InlineQueue())
+        response = self.upload(**{'async': 'true'})
+        self.assertEqual(response.status_code, 202)
+
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.status_code, 200)
+        self.assertEqual(status_response.data['status'], AnalysisJob.STATUS_SUCCEEDED)
+        self.assertEqual(status_response.data['result']['session'], self.session.id)
+        self.assertFalse(AnalysisJob.objects.get().video)
+
+    def test_database_queue_claims_and_retries(self):
+        queue = jobs.DatabaseQueue()
+        self.use_queue(queue)
+        response = self.upload(**{'async': '1'})
+        job = AnalysisJob.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.status, AnalysisJob.STATUS_QUEUED)
+
+        claimed = queue.claim('test-worker')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, AnalysisJob.STATUS_RUNNING)
+        self.assertIsNone(queue.claim('other-worker'))
+
+        jobs.fail_job(claimed, RuntimeError('boom'))
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, AnalysisJob.STATUS_QUEUED)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertGreater(claimed.run_after, claimed.created_at)
+
+        claimed.attempts = 2
+        jobs.fail_job(claimed, AnalysisError('No matching dataset found', 404))
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, AnalysisJob.STATUS_FAILED)
+        self.assertEqual(claimed.error, 'No matching dataset found')
+
+    def test_sync_upload_streams_faststart_video(self):
+        # scripts/sample.mp4 has its moov box first, so it is decoded while uploading
+        sample = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'scripts', 'sample.mp4')
+        with open(sample, 'rb') as f:
+            self.video_bytes = f.read()
+        self.assertTrue(is_streamable(self.video_bytes[:4096]))
+
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['search']['references'], 29)
+        result = UserSessionResult.objects.get(id=response.data['result_id'])
+        self.assertEqual(result.sample_fps, 25.0)
+        self.assertEqual(result.duration, round(58 / 25 / 60, 2))
+
+    def test_rejected_uploads_stop_pose_estimation(self):
+        sample = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'scripts', 'sample.mp4')
+        with open(sample, 'rb') as f:
+            self.video_bytes = f.read()
+
+        anonymous = APIClient()
+        with mock.patch('api.views.StreamingVideoUploadHandler') as handler:
+            response = anonymous.post(reverse('process_video'), {'uploaded_video': SimpleUploadedFile(
+                'clip.mp4', self.video_bytes, content_type='video/mp4')}, format='multipart')
+        self.assertEqual(response.status_code, 401)
+        handler.assert_not_called()
+
+        original = StreamingExtraction.cancel
+        for extra, expected in (({'session': 9999}, 404), ({'scoring_mode': 'nope'}, 400), ({'title': ''}, 400)):
+            with mock.patch.object(StreamingExtraction, 'cancel', autospec=True, side_effect=original) as cancel:
+                response = self.upload(**extra)
+            self.assertEqual(response.status_code, expected)
+            cancel.assert_called()
+
+    def test_unavailable_pose_estimation_is_a_503(self):
+        with mock.patch('api.analysis.extract_keypoints', side_effect=PoolExhausted("No pose estimator became free")):
+            response = self.upload()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+        # A streamed upload that couldn't get an estimator isn't decoded a second time
+        sample = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'scripts', 'sample.mp4')
+        with open(sample, 'rb') as f:
+            self.video_bytes = f.read()
+        with mock.patch('api.uploads.extract_keypoints', side_effect=PoseServerError("No pose server")), \
+                mock.patch('api.analysis.extract_keypoints') as fallback:
+            response = self.upload()
+        self.assertEqual(response.status_code, 503)
+        fallback.assert_not_called()
+        self.assertFalse(UserSessionResult.objects.exists())
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_stage_timings_and_metrics(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        stages = dict(item.split(';dur=') for item in response['Server-Timing'].split(', '))
+        for name in ('upload', 'decode', 'inference', 'references', 'dtw', 'storage', 'db', 'total'):
+            self.assertIn(name, stages)
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('gymfreak_stage_seconds_bucket{event="process_video",stage="dtw",le="+Inf"}', body)
+        self.assertIn('gymfreak_reference_sequences{exercise="squat"} 29', body)
+
+    def test_metrics_disabled(self):
+        self.assertNotIn('Server-Timing', self.upload())
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    def test_sync_upload_falls_back_to_file(self):
+        # OpenCV writes moov last, which can't be demuxed from a pipe
+        self.assertFalse(is_streamable(self.video_bytes))
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserSessionResult.objects.get().sample_fps, 10.0)
+
+    def test_result_video_is_uploaded_after_response(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.upload()
+        result = UserSessionResult.objects.get(id=response.data['result_id'])
+        self.assertEqual(result.video_status, UserSessionResult.VIDEO_PENDING)
+        self.assertFalse(result.uploaded_video)
+        self.assertEqual(len(callbacks), 1)
+        staged = result.staged_video
+
+        self.assertIsNone(video_uploads.upload_result_video(result.id))
+        result.refresh_from_db()
+        self.assertEqual(result.video_status, UserSessionResult.VIDEO_STORED)
+        self.assertFalse(result.staged_video)
+        with result.uploaded_video.open('rb') as f:
+            self.assertEqual(f.read(), self.video_bytes)
+        self.assertFalse(staged.storage.exists(staged.name))
+
+    def test_failed_result_video_upload_is_retried(self):
+        result_id = self.upload().data['result_id']
+        with mock.patch.object(FileSystemStorage, '_save', side_effect=OSError('storage offline')):
+            self.assertEqual(video_uploads.upload_result_video(result_id), 10)
+        result = UserSessionResult.objects.get(id=result_id)
+        self.assertEqual((result.video_status, result.video_attempts), (UserSessionResult.VIDEO_PENDING, 1))
+        self.assertIn('storage offline', result.video_error)
+
+        # Not due until the backoff has passed
+        self.assertEqual(video_uploads.upload_due_videos(), 0)
+        UserSessionResult.objects.filter(id=result_id).update(video_upload_after=timezone.now())
+        self.assertEqual(video_uploads.upload_due_videos(), 1)
+        result.refresh_from_db()
+        self.assertEqual((result.video_status, result.video_attempts), (UserSessionResult.VIDEO_STORED, 2))
+
+    def test_background_retries_wait_off_the_pool(self):
+        result_id = self.upload().data['result_id']
+        with mock.patch.object(FileSystemStorage, '_save', side_effect=OSError('storage offline')), \
+                mock.patch('api.video_uploads.threading.Timer') as timer:
+            video_uploads._upload_in_background(result_id)
+        timer.assert_called_once_with(10, video_uploads._submit_upload, args=(result_id,))
+        timer.return_value.start.assert_called_once_with()
+
+    def test_duplicate_upload_hits_keypoint_cache(self):
+        first = self.upload()
+        second = self.upload()
+        self.assertEqual(first.data['accuracy_score'], second.data['accuracy_score'])
+        stats = get_keypoint_cache().stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (1, 1, 1))
+
+    def test_other_users_jobs_are_hidden(self):
+        self.use_queue(jobs.DatabaseQueue())
+        job_id = self.upload(**{'async': '1'}).data['job_id']
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='pw'))
+        self.assertEqual(other.get(reverse('analysis-job-detail', args=[job_id])).status_code, 404)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.session = Session.objects.create(title='Squat', description='', video='tutorial_videos/squat.mp4')
+
+    def test_conditional_get_and_invalidation(self):
+        first = self.client.get(reverse('session-list'))
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        hits = catalog_cache.stats()['hits']
+        cached = self.client.get(reverse('session-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(catalog_cache.stats()['hits'], hits + 1)
+        since = self.client.get(reverse('session-list'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.session.title = 'Back Squat'
+            self.session.save()
+        changed = self.client.get(reverse('session-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(changed.json()[0]['title'], 'Back Squat')
+
+    def test_missing_session_is_not_cached(self):
+        self.assertEqual(self.client.get(reverse('session-detail', args=[999])).status_code, 404)
+        detail = self.client.get(reverse('session-detail', args=[self.session.id]))
+        self.assertEqual(detail.json()['title'], 'Squat')
+
+
+class ListingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_rows(self, count):
+        for i in range(count):
+            session = Session.objects.create(title=f'Session {i}', description='', video='tutorial_videos/s.mp4')
+            History.objects.create(user=self.user, session=session, accuracy_score=i, weight=70)
+            UserSessionResult.objects.create(user=self.user, session=session, accuracy_score=i)
+
+    def test_cursor_pages_cover_every_row_newest_first(self):
+        self.add_rows(7)
+        scores = []
+        url = reverse('history-list') + '?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 3)
+            scores += [row['accuracy_score'] for row in page['results']]
+            url = page['next']
+        self.assertEqual(scores, [6, 5, 4, 3, 2, 1, 0])
+
+    def test_results_filtered_by_session(self):
+        self.add_rows(3)
+        session = Session.objects.get(title='Session 1')
+        UserSessionResult.objects.create(user=self.user, session=session, accuracy_score=50)
+        url = reverse('session_result')
+        page = self.client.get(url, {'session': session.id, 'page_size': 1}).json()
+        self.assertEqual([row['accuracy_score'] for row in page['results']], [50])
+        self.assertIsNotNone(page['next'])
+        self.assertEqual(self.client.get(url, {'session': 'squat'}).status_code, 400)
+
+    def test_query_count_does_not_grow_with_history(self):
+        for extra in (2, 20):
+            self.add_rows(extra)
+            for name in ('history-list', 'session_result'):
+                with self.assertNumQueries(1):
+                    self.client.get(reverse(name))
+
+
+class HistoryUpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.squat = Session.objects.create(title='Squat', description='', video='tutorial_videos/s.mp4')
+        self.plank = Session.objects.create(title='Plank', description='', video='tutorial_videos/p.mp4')
+
+    def test_post_updates_the_existing_entry(self):
+        url = reverse('history-list')
+        self.assertEqual(self.client.post(url, {'session': self.squat.id, 'weight': 70, 'accuracy_score': 61.26}).status_code, 201)
+        response = self.client.post(url, {'session': self.squat.id, 'accuracy_score': 80})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], "History updated successfully")
+        self.assertEqual((response.data['accuracy_score'], response.data['weight']), (80.0, 70.0))
+        self.assertEqual(History.objects.count(), 1)
+        # Nothing to update and no weight to create with
+        self.assertEqual(self.client.post(url, {'session': self.plank.id, 'accuracy_score': 50}).status_code, 400)
+
+    def test_sync_upserts_a_batch_in_one_statement(self):
+        History.objects.create(user=self.user, session=self.squat, accuracy_score=40, weight=70)
+        entries = [
+            {'session': self.squat.id, 'weight': 71, 'accuracy_score': 55},
+            {'session': self.plank.id, 'weight': 71, 'accuracy_score': 60},
+            {'session': self.squat.id, 'weight': 72, 'accuracy_score': 65},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('history-sync'), {'entries': entries}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['saved'], 2)
+        self.assertEqual(sum(q['sql'].startswith('INSERT') for q in queries.captured_queries), 1)
+        rows = {h.session_id: (h.accuracy_score, h.weight) for h in History.objects.all()}
+        self.assertEqual(rows, {self.squat.id: (65, 72), self.plank.id: (60, 71)})
+
+        bad = self.client.post(reverse('history-sync'), {'entries': [{'session': self.squat.id}]}, format='json')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_partial_sync_keeps_omitted_fields(self):
+        created = datetime.datetime(2026, 1, 2, 10, tzinfo=datetime.timezone.utc)
+        History.objects.create(user=self.user, session=self.squat, accuracy_score=40, weight=70, created_at=created)
+        entries = [
+            {'session': self.squat.id, 'weight': 72},
+            {'session': self.plank.id, 'weight': 71, 'accuracy_score': 60, 'created_at': '2026-01-03T10:00:00Z'},
+        ]
+        response = self.client.post(reverse('history-sync'), {'entries': entries}, format='json')
+        self.assertEqual(response.data['saved'], 2)
+        squat = History.objects.get(session=self.squat)
+        self.assertEqual((squat.accuracy_score, squat.weight, squat.created_at), (40, 72, created))
+        self.assertEqual(History.objects.get(session=self.plank).accuracy_score, 60)
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.squat = Session.objects.create(title='Squat', description='', video='tutorial_videos/s.mp4')
+        self.plank = Session.objects.create(title='Plank', description='', video='tutorial_videos/p.mp4')
+
+    def add(self, session, score, day):
+        created = datetime.datetime(2026, 3, day, 12, tzinfo=datetime.timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=created):
+            return UserSessionResult.objects.create(
+                user=self.user, session=session, accuracy_score=score, calories=score / 4, duration=0.5)
+
+    def snapshot(self):
+        fields = ['results', 'calories', 'duration', 'accuracy_sum', 'accuracy_min', 'accuracy_max']
+        return (
+            list(UserStats.objects.values(*fields, 'last_day', 'current_streak', 'longest_streak')),
+            list(SessionStats.objects.order_by('session_id').values('session_id', *fields)),
+            list(DailyStats.objects.order_by('day').values('day', *fields)),
+        )
+
+    def test_incremental_updates_match_a_rebuild(self):
+        self.add(self.squat, 60, 1)
+        self.add(self.squat, 80, 2)
+        low = self.add(self.plank, 40, 2)
+        self.add(self.plank, 70, 3)
+        lone = self.add(self.squat, 90, 5)
+        low.delete()
+        lone.delete()
+
+        incremental = self.snapshot()
+        rebuild_stats([self.user.id])
+        self.assertEqual(self.snapshot(), incremental)
+        totals = incremental[0][0]
+        self.assertEqual((totals['results'], totals['accuracy_min'], totals['accuracy_max']), (3, 60, 80))
+        self.assertEqual((totals['last_day'], totals['current_streak']), (datetime.date(2026, 3, 3), 3))
+
+    def test_endpoint_reads_summary_rows(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for day in (1, 2, 3):
+            self.add(self.squat, 50 + day, day)
+        with self.assertNumQueries(3):
+            response = client.get(reverse('user-stats') + '?days=366')
+        self.assertEqual(response.data['totals']['results'], 3)
+        self.assertEqual(response.data['totals']['accuracy_avg'], 52)
+        self.assertEqual([row['day'] for row in response.data['days']], ['2026-03-01', '2026-03-02', '2026-03-03'])
+        self.assertEqual(response.data['sessions'][0]['session_title'], 'Squat')
+
+
+class KeypointUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.session = Session.objects.create(title='Squat', description='', video='squat.mp4')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        _, references = get_reference_index().references_for_title('Squat')
+        self.keypoints = np.asarray(references[0][1], dtype=np.float16)
+
+    def post(self, array, fps=30, compressed=True):
+        buffer = io.BytesIO()
+        if compressed:
+            np.savez_compressed(buffer, keypoints=array)
+        else:
+            np.save(buffer, array)
+        return self.client.post(reverse('process_keypoints'), {
+            'keypoints': SimpleUploadedFile('keypoints.npz', buffer.getvalue()),
+            'fps': fps,
+            'session': self.session.id,
+            'title': self.session.title,
+            'weight': 70,
+        }, format='multipart')
+
+    def test_scores_a_reference_sequence_without_video(self):
+        response = self.post(self.keypoints)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['accuracy_score'], 99)
+        result = UserSessionResult.objects.get(id=response.data['result_id'])
+        self.assertEqual(result.video_status, UserSessionResult.VIDEO_NONE)
+        self.assertEqual(result.duration, round(len(self.keypoints) / 30 / 60, 2))
+        self.assertEqual(self.post(self.keypoints, compressed=False).status_code, 200)
+
+    def test_scores_each_rep(self):
+        _, references = get_reference_index().references_for_title('Squat')
+        keypoints = np.concatenate([np.asarray(array, dtype=np.float16) for _, array in references[1:4]])
+        response = self.post(keypoints)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.data['rep_count'], 3)
+        self.assertEqual(len(response.data['reps']), response.data['rep_count'])
+        accuracies = [rep['accuracy'] for rep in response.data['reps']]
+        self.assertEqual(response.data['accuracy_score'], round(sum(accuracies) / len(accuracies), 1))
+        result = UserSessionResult.objects.get(id=response.data['result_id'])
+        self.assertEqual(result.rep_scores, response.data['reps'])
+
+        with override_settings(REP_SCORING_ENABLED=False):
+            response = self.post(keypoints)
+        self.assertIsNone(response.data['rep_count'])
+        self.assertIsNone(response.data['reps'])
+
+    def test_rejects_malformed_sequences(self):
+        self.assertEqual(self.post(self.keypoints[:, :, :3]).status_code, 400)
+        self.assertEqual(self.post(self.keypoints.astype(np.int16)).status_code, 400)
+        self.assertEqual(self.post(self.keypoints, fps=0).status_code, 400)
+        with override_settings(KEYPOINT_UPLOAD_MAX_FRAMES=len(self.keypoints) - 1):
+            self.assertIn('frames', self.post(self.keypoints).data['error'])
+
+
+class StreamTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='lifter', password='pw')
+        self.session = Session.objects.create(title='Squat', description='', video='squat.mp4')
+        self.token = str(AccessToken.for_user(self.user))
+        _, references = get_reference_index().references_for_title('Squat')
+        self.keypoints = np.asarray(references[0][1], dtype=np.float32)
+
+    def connect(self, **params):
+        query = {'token': self.token, 'session': self.session.id, 'fps': 30, 'weight': 70, **params}
+        scope = {
+            'type': 'websocket',
+            'path': '/ws/stream/',
+            'query_string': '&'.join(f'{key}={value}' for key, value in query.items()).encode(),
+            'headers': [],
+        }
+        return ApplicationCommunicator(route_websockets(None), scope)
+
+    async def open(self, communicator):
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        return json.loads((await communicator.receive_output())['text'])
+
+    async def test_running_score_ends_at_the_upload_score(self):
+        communicator = self.connect()
+        ready = await self.open(communicator)
+        self.assertEqual(ready['exercise'], 'squat')
+
+        progress = None
+        for start in range(0, len(self.keypoints), 100):
+            chunk = self.keypoints[start:start + 100].tobytes()
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': chunk})
+            while True:
+                message = json.loads((await communicator.receive_output())['text'])
+                if message['type'] == 'progress':
+                    break
+                self.assertEqual(message['type'], 'rep')
+            self.assertEqual(message['frames'], min(start + 100, len(self.keypoints)))
+            progress = message
+        expected = await sync_to_async(score_keypoints)(self.keypoints, 'Squat')
+        self.assertEqual(progress['accuracy'], expected)
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'end', 'save': True})})
+        summary = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual((await communicator.receive_output())['code'], 1000)
+        self.assertEqual(summary['accuracy_score'], expected)
+        result = await UserSessionResult.objects.aget(id=summary['result_id'])
+        self.assertEqual(result.video_status, UserSessionResult.VIDEO_NONE)
+
+    async def test_rejects_bad_tokens_and_frames(self):
+        communicator = self.connect(token='nope')
+        self.assertEqual((await self.open(communicator))['type'], 'error')
+        self.assertEqual((await communicator.receive_output())['code'], 4401)
+
+        communicator = self.connect()
+        await self.open(communicator)
+        await communicator.send_input({'type': 'websocket.receive', 'bytes': b'\0' * 12})
+        self.assertIn('whole', json.loads((await communicator.receive_output())['text'])['error'])
+        self.assertEqual((await communicator.receive_output())['code'], 4400)
+
+
+class FakePose:
+    """Stands in for mp_pose.Pose: a pose on every other frame."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def process(self, frame):
+        self.calls += 1
+        if self.calls % 2 == 0:
+            return mock.Mock(pose_landmarks=None)
+        landmarks = [mock.Mock(x=self.calls / 100, y=0.5, z=0.0, visibility=1.0) for _ in range(33)]
+        return mock.Mock(pose_landmarks=mock.Mock(landmark=landmarks))
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class UncountedCapture:
+    """A capture whose container doesn't report its frame count, like a pipe."""
+
+    open_capture = cv2.VideoCapture
+
+    def __init__(self, path):
+        self.capture = self.open_capture(path)
+
+    def get(self, prop):
+        return 0 if prop == cv2.CAP_PROP_FRAME_COUNT else self.capture.get(prop)
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+class PreprocessingTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.source = os.path.join(self.tmp, 'workout')
+        self.output = os.path.join(self.tmp, 'Workout_npy')
+        os.makedirs(os.path.join(self.source, 'squat'))
+        for name in ('a.mp4', 'b.mp4'):
+            self.write_clip(name, b'clip ' + name.encode())
+        self.failing = set()
+        self.processed = []
+        # Threads instead of processes so the patched _process_video is used
+        for name, value in (('ProcessPoolExecutor', ThreadPoolExecutor),
+                            ('_init_worker', lambda: None),
+                            ('_process_video', self.process_video)):
+            patcher = mock.patch.object(preprocessing, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_clip(self, name, content):
+        with open(os.path.join(self.source, 'squat', name), 'wb') as f:
+            f.write(content)
+
+    def process_video(self, video_path, output_path, options, csv):
+        name = os.path.basename(video_path)
+        self.processed.append(name)
+        if name in self.failing:
+            raise ValueError("no frames could be decoded")
+        np.save(output_path, np.full((3, 33, 4), os.path.getsize(video_path), dtype=np.float32))
+        return 3, 0.1
+
+    def run_preprocess(self, **kwargs):
+        self.processed = []
+        summary = preprocessing.preprocess_dataset(self.source, self.output, report=lambda message: None, **kwargs)
+        return summary, sorted(self.processed)
+
+    def test_only_new_or_changed_clips_are_extracted(self):
+        summary, processed = self.run_preprocess()
+        self.assertEqual((summary['extracted'], processed), (2, ['a.mp4', 'b.mp4']))
+        self.assertEqual(self.run_preprocess()[1], [])
+
+        # Touched but identical
+        clip = os.path.join(self.source, 'squat', 'a.mp4')
+        os.utime(clip, (time.time() + 60, time.time() + 60))
+        summary, processed = self.run_preprocess()
+        self.assertEqual((summary['skipped'], processed), (2, []))
+        manifest = preprocessing.load_manifest(self.output)
+        self.assertEqual(manifest['videos']['squat/a.mp4']['mtime'], os.stat(clip).st_mtime)
+
+        self.write_clip('b.mp4', b'new take')
+        self.assertEqual(self.run_preprocess()[1], ['b.mp4'])
+
+        # Different sampling options invalidate every output
+        summary, processed = self.run_preprocess(options=SamplingOptions(target_fps=10))
+        self.assertEqual(processed, ['a.mp4', 'b.mp4'])
+        self.assertEqual(self.run_preprocess(options=SamplingOptions(target_fps=10))[1], [])
+
+    def test_deleted_clips_are_pruned(self):
+        self.run_preprocess()
+        os.unlink(os.path.join(self.source, 'squat', 'a.mp4'))
+        summary, processed = self.run_preprocess()
+        self.assertEqual((summary['pruned'], processed), (0, []))
+        summary, _ = self.run_preprocess(prune=True)
+        self.assertEqual((summary['pruned'], summary['changed']), (1, ['squat_npy']))
+        self.assertEqual(os.listdir(os.path.join(self.output, 'squat_npy')), ['b.npy'])
+        self.assertEqual(list(preprocessing.load_manifest(self.output)['videos']), ['squat/b.mp4'])
+
+    def test_consolidated_stores_are_kept_current(self):
+        self.run_preprocess()
+        convert_folder(os.path.join(self.output, 'squat_npy'), self.output, remove_source=True)
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'squat_npy')))
+        # Outputs in the store count as extracted
+        self.assertEqual(self.run_preprocess()[1], [])
+
+        self.write_clip('b.mp4', b'new take')
+        summary, processed = self.run_preprocess()
+        self.assertEqual(processed, ['b.mp4'])
+        preprocessing.update_stores(self.output, summary, report=lambda message: None)
+        stored = dict(load_store(self.output, 'squat', mmap=False))
+        self.assertEqual(sorted(stored), ['a.npy', 'b.npy'])
+        self.assertEqual((stored['a.npy'][0, 0, 0], stored['b.npy'][0, 0, 0]), (len(b'clip a.mp4'), len(b'new take')))
+
+        os.unlink(os.path.join(self.source, 'squat', 'a.mp4'))
+        summary, _ = self.run_preprocess(prune=True)
+        preprocessing.update_stores(self.output, summary, report=lambda message: None)
+        self.assertEqual([name for name, _ in load_store(self.output, 'squat')], ['b.npy'])
+
+    def test_failed_clips_are_retried(self):
+        self.failing = {'a.mp4'}
+        summary, _ = self.run_preprocess()
+        self.assertEqual((summary['extracted'], list(summary['failed'])), (1, ['squat/a.mp4']))
+        self.assertNotIn('squat/a.mp4', preprocessing.load_manifest(self.output)['videos'])
+        self.failing = set()
+        summary, processed = self.run_preprocess()
+        self.assertEqual((summary['extracted'], summary['failed'], processed), (1, {}, ['a.mp4']))
+
+
+class PosePoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('api.pose.create_pose', lambda **options: FakePose())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def idle(self, pool, count):
+        # Instances are reset and returned on a background thread
+        deadline = time.monotonic() + 5
+        while pool._idle.qsize() < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return pool._idle.qsize()
+
+    def test_times_out_when_every_instance_is_out(self):
+        pool = PosePool(size=1, timeout=0.05)
+        with pool.acquire() as pose:
+            with self.assertRaises(PoolExhausted):
+                with pool.acquire():
+                    pass
+        self.assertEqual(self.idle(pool, 1), 1)
+        with pool.acquire() as again:
+            self.assertIs(again, pose)
+        self.assertEqual(pool.stats["created"], 1)
+
+    def test_instances_that_fail_are_not_lent_again(self):
+        pool = PosePool(size=1)
+        with self.assertRaises(RuntimeError):
+            with pool.acquire() as broken:
+                raise RuntimeError("graph failed")
+        self.assertEqual((pool.stats["replaced"], pool._live), (1, 0))
+        with self.assertLogs('api.pose', 'ERROR'):
+            with pool.acquire() as pose:
+                self.assertIsNot(pose, broken)
+                pose.reset = mock.Mock(side_effect=RuntimeError("reset failed"))
+            deadline = time.monotonic() + 5
+            while pool.stats["replaced"] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual((pool.stats["replaced"], pool._live, pool._idle.qsize()), (2, 0, 0))
+
+    def test_health_check_replaces_broken_instances(self):
+        pool = PosePool(size=2)
+        pool.warm()
+        broken = pool._idle.get_nowait()
+        broken.process = mock.Mock(side_effect=RuntimeError("graph failed"))
+        pool._idle.put(broken)
+        with self.assertLogs('api.pose', 'ERROR'):
+            self.assertEqual(pool.check_health(), {"healthy": 1, "failed": 1, "live": 1, "size": 2})
+        with pool.acquire() as first, pool.acquire() as second:
+            self.assertNotIn(broken, (first, second))
+        self.assertEqual(pool.stats["created"], 3)
+
+
+class KeypointReaderTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.video = os.path.join(self.tmp, 'clip.mp4')
+        synthetic_video(self.video, frames=12)
+        patcher = mock.patch.object(PosePool, '_create', lambda pool: FakePose())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blocks_match_whole_read(self):
+        keypoints = KeypointReader(self.video, pool=PosePool()).read()
+        self.assertEqual(keypoints.dtype, np.float32)
+        self.assertEqual(keypoints.shape, (12, 33, 4))
+        self.assertFalse(keypoints[1].any())
+        blocks = list(KeypointReader(self.video, pool=PosePool()).blocks(5))
+        self.assertEqual([len(block) for block in blocks], [5, 5, 2])
+        np.testing.assert_array_equal(np.concatenate(blocks), keypoints)
+
+    def test_buffer_grows_past_a_wrong_frame_count(self):
+        with mock.patch('api.pose.cv2.VideoCapture', UncountedCapture), mock.patch('api.pose.GROW_FRAMES', 4):
+            reader = KeypointReader(self.video, options=SamplingOptions(target_fps=5), pool=PosePool())
+            keypoints = reader.read()
+        self.assertEqual(keypoints.shape, (6, 33, 4))
+        self.assertAlmostEqual(reader.duration_seconds, 1.2)
+
+    def test_sampling_options(self):
+        def sample(**options):
+            return extract_keypoints(self.video, options=SamplingOptions(**options), pool=PosePool())
+
+        for target_fps, frames, sample_fps in ((None, 12, 10), (5, 6, 5), (3, 4, 10 / 3), (20, 12, 10)):
+            extraction = sample(target_fps=target_fps)
+            self.assertEqual(len(extraction.keypoints), frames)
+            self.assertAlmostEqual(extraction.sample_fps, sample_fps, places=3)
+
+        with mock.patch('api.pose.cv2.cvtColor', wraps=cv2.cvtColor) as convert:
+            self.assertEqual(len(sample(max_dimension=80).keypoints), 12)
+        self.assertEqual({call.args[0].shape for call in convert.call_args_list}, {(60, 80, 3)})
+
+        extraction = sample(max_duration=0.5)
+        self.assertEqual((len(extraction.keypoints), extraction.sample_fps), (5, 10))
+        # Still the length of the whole video
+        self.assertAlmostEqual(extraction.duration_seconds, 1.2)
+        self.assertEqual(len(sample(target_fps=5, max_duration=0.5).keypoints), 3)
+
+    def test_limits_raise_and_keep_the_pose(self):
+        pool = PosePool()
+        for options in (SamplingOptions(max_frames=10), SamplingOptions(max_bytes=10 * 33 * 4 * 4)):
+            with self.assertRaises(ExtractionTooLarge):
+                KeypointReader(self.video, options=options, pool=pool).read()
+        self.assertEqual(KeypointReader(self.video, SamplingOptions(max_frames=12), pool=pool).read().shape[0], 12)
+        self.assertEqual(pool.stats["replaced"], 0)
+
+
+class PoseServerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.video = os.path.join(self.tmp, 'clip.mp4')
+        synthetic_video(self.video, frames=12)
+        self.socket = os.path.join(self.tmp, 'pose.sock')
+        server = PoseServer(self.socket, workers=2, batch_size=2, window=2, max_videos=2, pose_factory=FakePose)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.stop)
+        self.assertTrue(server.ready.wait(10))
+
+    def test_remote_keypoints_match_local(self):
+        with mock.patch.object(PosePool, '_create', lambda pool: FakePose()):
+            local = KeypointReader(self.video, pool=PosePool()).read()
+        remote = KeypointReader(self.video, pool=RemotePosePool(self.socket, timeout=10)).read()
+        np.testing.assert_array_equal(remote, local)
+
+    def test_busy_once_full(self):
+        pool = RemotePosePool(self.socket, timeout=10)
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        with pool.acquire() as first, pool.acquire() as second:
+            first.process(frame)
+            second.process(frame)
+            with self.assertRaises(PoolExhausted):
+                with pool.acquire() as third:
+                    third.process(frame)
+        stats = pool.server_stats()
+        self.assertEqual((stats["busy"], stats["frames"], stats["workers"]), (1, 2, 2))
+
+
+class KeypointCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_key_depends_on_extraction_options(self):
+        cache = KeypointCache(self.tmp, max_bytes=10 ** 6)
+        keys = {
+            cache.key('abc', options)
+            for options in (SamplingOptions(), SamplingOptions(target_fps=10),
+                            SamplingOptions(max_frames=100), SamplingOptions(max_bytes=10 ** 6))
+        }
+        self.assertEqual(len(keys), 4)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        extraction = Extraction(np.zeros((100, 33, 4)), 30.0, 30.0, 3.3)
+        cache = KeypointCache(self.tmp, max_bytes=10 ** 9)
+        for key in 'abc':
+            cache.put(key, extraction)
+            path = os.path.join(self.tmp, f'{key}.npz')
+            os.utime(path, (1000 + ord(key), 1000 + ord(key)))
+        cache.get('a')  # now the most recently used
+
+        cache.max_bytes = 2 * os.path.getsize(path)
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+
+class ReferenceIndexTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.rng = np.random.default_rng(4)
+        self.add_reference('Push_Up_npy', 'push_up_0.npy')
+        self.add_reference('squat_npy', 'squat_0.npy')
+        Session.objects.create(title='Push Up', description='', video='tutorial_videos/p.mp4')
+
+    def add_reference(self, folder, name):
+        os.makedirs(os.path.join(self.tmp, folder), exist_ok=True)
+        np.save(os.path.join(self.tmp, folder, name), synthetic_sequence(self.rng, 10))
+
+    def test_session_titles_map_to_exercises(self):
+        index = ReferenceIndex(self.tmp)
+        key, references = index.references_for_title('Push Up')
+        self.assertEqual((key, [name for name, _ in references]), ('push_up', ['push_up_0.npy']))
+        # A session created after the index was loaded
+        self.assertEqual(index.exercise_key('Squat'), 'squat')
+        self.assertEqual(index.references_for_title('Deadlift'), (None, []))
+
+    @override_settings(REFERENCE_INDEX_RELOAD_INTERVAL=60)
+    def test_reloads_when_the_dataset_changes(self):
+        index = ReferenceIndex(self.tmp)
+        snapshot = index.load()
+        index._last_check = 0
+        self.assertEqual(len(index.references('squat')), 1)
+        self.assertIs(index._snapshot, snapshot)
+
+        self.add_reference('squat_npy', 'squat_1.npy')
+        self.add_reference('lunge_npy', 'lunge_0.npy')
+        folder = os.path.join(self.tmp, 'squat_npy')
+        mtime = os.stat(folder).st_mtime_ns + 10 ** 9
+        os.utime(folder, ns=(mtime, mtime))
+        # Not checked again within the interval
+        self.assertEqual(len(index.references('squat')), 1)
+        index._last_check = 0
+        self.assertEqual(len(index.references('squat')), 2)
+        self.assertIsNot(index._snapshot, snapshot)
+        self.assertEqual(index.exercise_key('Lunge'), 'lunge')
+
+
+class ReferenceStoreTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        rng = np.random.default_rng(2)
+        folder = os.path.join(self.tmp, 'squat_npy')
+        os.makedirs(folder)
+        self.sequences = {}
+        for i, frames in enumerate((30, 0, 45)):
+            seq = synthetic_sequence(rng, frames).astype(np.float32).astype(np.float64)
+            self.sequences[f'squat_{i}.npy'] = seq
+            np.save(os.path.join(folder, f'squat_{i}.npy'), seq)
+
+    def test_store_replaces_folder_and_is_memory_mapped(self):
+        convert_folder(os.path.join(self.tmp, 'squat_npy'), self.tmp)
+        index = ReferenceIndex(self.tmp)
+        references = index.references('squat')
+
+        self.assertEqual([name for name, _ in references], sorted(self.sequences))
+        for name, array in references:
+            if len(array):
+                self.assertIsInstance(array, np.memmap)
+            self.assertEqual(array.dtype, np.float32)
+            np.testing.assert_array_equal(array, self.sequences[name])
+        self.assertEqual(index.stats()['memory_bytes'], 0)
+
+        self.assertIn('squat', find_stores(self.tmp, FEATURES))
+        for (name, features), (ref_name, array) in zip(index.features('squat'), references):
+            self.assertEqual(name, ref_name)
+            np.testing.assert_allclose(features, keypoint_features(array))
+
+    def test_float16_store_scores_like_the_original(self):
+        convert_folder(os.path.join(self.tmp, 'squat_npy'), self.tmp, dtype='float16', remove_source=True)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'squat_npy')))
+        references = [array for _, array in ReferenceIndex(self.tmp).references('squat')]
+        query = self.sequences['squat_0.npy'][5:25]
+        np.testing.assert_allclose(
+            dtw_distances(query, references),
+            dtw_distances(query, [self.sequences[name] for name in sorted(self.sequences)]),
+            rtol=1e-3, atol=0.05,
+        )
+
+
+class TemplateTests(TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(5)
+
+    def warped_copies(self, sequence, count):
+        copies = []
+        for _ in range(count):
+            # Repeat or drop random frames, then add noise
+            frames = np.sort(self.rng.choice(len(sequence), size=len(sequence) + self.rng.integers(-5, 6)))
+            copies.append(sequence[frames] + self.rng.normal(scale=0.01, size=sequence[frames].shape))
+        return copies
+
+    def test_clusters_and_averages_warped_copies(self):
+        a, b = synthetic_sequence(self.rng, 30), synthetic_sequence(self.rng, 30) + 0.5
+        copies = self.warped_copies(a, 6) + self.warped_copies(b, 6)
+        labels, medoids = kmedoids(pairwise_dtw(copies), 2)
+        self.assertEqual(len(set(labels[:6])), 1)
+        self.assertEqual(len(set(labels[6:])), 1)
+        self.assertNotEqual(labels[0], labels[6])
+
+        average = dba(copies[:6], copies[0])
+        self.assertLess(dtw_distance(average, a), np.mean([dtw_distance(copy, a) for copy in copies[:6]]))
+
+    def index_with_templates(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        folder = os.path.join(tmp, 'squat_npy')
+        os.makedirs(folder)
+        for i, sequence in enumerate(self.warped_copies(synthetic_sequence(self.rng, 25), 5)):
+            np.save(os.path.join(folder, f'squat_{i}.npy'), sequence)
+        index = ReferenceIndex(tmp)
+        built = build_templates(index.references('squat'), index.features('squat'), clusters=2, iterations=3)
+        write_templates(tmp, 'squat', built)
+        index.load()
+        return tmp, index, built
+
+    def test_templates_are_stored_and_loaded_with_their_spread(self):
+        tmp, index, built = self.index_with_templates()
+        self.assertIn('squat', find_stores(tmp, TEMPLATES))
+        templates, spread = index.templates('squat')
+        self.assertEqual(len(templates), 2)
+        self.assertEqual(spread.tolist(), [stats['spread_max'] for _, _, stats in built['keypoints']])
+        self.assertEqual(len(index.templates('squat', features=True)[0]), 2)
+
+        query = index.references('squat')[0][1]
+        result = search_templates(query, templates, spread)
+        self.assertLessEqual(result.best, result.worst)
+        self.assertEqual(result.evaluated, 2)
+
+    def test_reference_mode_picks_the_set_scored_whole(self):
+        _, index, _ = self.index_with_templates()
+        extraction = Extraction(index.references('squat')[0][1][3:20], 30.0, 30.0, 0.6)
+        with mock.patch('api.analysis.get_reference_index', return_value=index):
+            with override_settings(REP_SCORING_ENABLED=False):
+                scored = {
+                    mode: analyze_extraction(extraction, 'Squat', 70, references_from=mode)['search']['references']
+                    for mode in ('references', 'templates')
+                }
+            self.assertEqual(scored, {'references': 5, 'templates': 2})
+
+            # Rep scoring doesn't use them; a clip without reps falls back to the templates
+            with mock.patch('api.analysis.score_reps', return_value=None):
+                analysis = analyze_extraction(extraction, 'Squat', 70, references_from='templates')
+            self.assertEqual((analysis['search']['references'], analysis['reps']), (2, []))
+
+
+class LoadTestTests(TestCase):
+    def test_mix_ramp_and_summary(self):
+        self.assertEqual(loadtest.parse_mix("sessions=3,token"), {"sessions": 3.0, "token": 1.0})
+        self.assertEqual(loadtest.parse_ramp("1:5, 4:10"), [(1, 5.0), (4, 10.0)])
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix("admin=1")
+        with self.assertRaises(ValueError):
+            loadtest.parse_ramp("0:5")
+
+        samples = [("sessions", 200, 0.01)] * 9 + [("sessions", 500, 0.2), ("token", None, 1.0)]
+        summary = loadtest.summarize(samples, 2.0)
+        self.assertEqual(summary["sessions"]["requests"], 10)
+        self.assertEqual(summary["sessions"]["error_rate"], 0.1)
+        self.assertEqual(summary["sessions"]["statuses"], {"200": 9, "500": 1})
+        self.assertEqual(summary["all"]["errors"], 2)
+        self.assertEqual(summary["all"]["rps"], 5.5)
+
+    def test_seeded_catalog_is_served_from_local_storage(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        storages = [(field, field.storage) for field in (Session._meta.get_field('video'), Tutorial._meta.get_field('video'))]
+        self.addCleanup(lambda: [setattr(field, 'storage', storage) for field, storage in storages])
+        use_local_media_storage()
+
+        with override_settings(MEDIA_ROOT=tmp, MEDIA_URL='/media/'):
+            sessions = loadtest.seed(users=2, results_per_user=2)
+            self.assertEqual(loadtest.seed(users=2, results_per_user=2), sessions)
+            response = APIClient().get(reverse('session-list'))
+        self.assertEqual(len(response.json()), sessions)
+        self.assertTrue(response.json()[0]['video_url'].startswith('/media/tutorial_videos/'))
+        self.assertEqual(UserSessionResult.objects.filter(user__username='loadtest-1').count(), 2)
@@ -0,0 +1,180 @@
+"""
+Upload handling for process_video.
+
+StreamingVideoUploadHandler spools the uploaded video to a temporary file,
+the same way Django's TemporaryFileUploadHandler does. When the container
+can be demuxed front to back (WebM/Matroska, or MP4 with the moov box ahead
+of mdat), it also feeds every chunk into a pipe that a background thread
+decodes and runs pose estimation on, so analysis overlaps the upload.
+Anything else is decoded from the finished temp file, once. The SHA-256
+of the upload is computed on the way through for the keypoint cache.
+"""
+import hashlib
+import logging
+import os
+import struct
+import threading
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .pose import ExtractionTooLarge, PoolExhausted, extract_keypoints
+
+logger = logging.getLogger(__name__)
+
+# Give up deciding whether a file can be streamed after this many bytes
+SNIFF_LIMIT = 1024 * 1024
+
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+
+
+def is_streamable(head):
+    """
+    True if a video starting with ``head`` can be decoded from a pipe, False
+    if not, None if more bytes are needed to tell.
+    """
+    if len(head) < 8:
+        return None
+    if head.startswith(EBML_MAGIC):
+        return True
+
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if offset == 0 and box_type != b'ftyp':
+            return False
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False
+        offset += size
+    return None
+
+
+class StreamingExtraction:
+    """Pose extraction running in a thread, reading the video from a pipe."""
+
+    def __init__(self, options):
+        self._read_fd, self._write_fd = os.pipe()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(options,), daemon=True)
+        self._thread.start()
+
+    def _run(self, options):
+        try:
+            self.result = extract_keypoints(f"/dev/fd/{self._read_fd}", options=options, cancel=self._cancel)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            # Unblocks the writer with EPIPE if we stopped early
+            os.close(self._read_fd)
+            self._done.set()
+
+    def feed(self, data):
+        if self._write_fd is None:
+            return
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(self._write_fd, view)
+                view = view[written:]
+        except OSError:
+            # The decoder stopped reading (max duration, error or cancel)
+            self.finish()
+
+    def finish(self):
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+
+    def cancel(self):
+        self._cancel.set()
+        self.finish()
+
+    def wait(self, timeout=None):
+        """
+        The Extraction, or None if streaming failed and the file must be
+        decoded. Raises ExtractionTooLarge if the video was over the limits,
+        and PoolExhausted if no pose estimator was available.
+        """
+        self.finish()
+        self._done.wait(timeout)
+        if isinstance(self.error, (ExtractionTooLarge, PoolExhausted)):
+            # Decoding the file again would hit the same limit or the same pool
+            raise self.error
+        if self.error is not None:
+            logger.warning("Streaming extraction failed, decoding the file instead: %s", self.error)
+            return None
+        if self.result is None or len(self.result.keypoints) == 0:
+            return None
+        return self.result
+
+
+class StreamingVideoUploadHandler(FileUploadHandler):
+    """Upload handler for the process_video ``uploaded_video`` field."""
+
+    def __init__(self, request=None, field_name='uploaded_video', options=None):
+        super().__init__(request)
+        self.target_field = field_name
+        self.options = options
+        self.active = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name == self.target_field
+        if not self.active:
+            return
+        self.file = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.head = b''
+        self.hasher = hashlib.sha256()
+        self.streaming = None
+        self.decided = not os.path.isdir('/dev/fd')
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.file.write(raw_data)
+        self.hasher.update(raw_data)
+
+        if self.streaming is not None:
+            self.streaming.feed(raw_data)
+        elif not self.decided:
+            self.head += raw_data
+            verdict = is_streamable(self.head)
+            if verdict is None and len(self.head) >= SNIFF_LIMIT:
+                verdict = False
+            if verdict is not None:
+                self.decided = True
+                if verdict:
+                    self.streaming = StreamingExtraction(self.options)
+                    self.streaming.feed(self.head)
+                self.head = b''
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        if self.streaming is not None:
+            self.streaming.finish()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.streaming_extraction = self.streaming
+        self.file.sha256 = self.hasher.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if self.active:
+            if self.streaming is not None:
+                self.streaming.cancel()
+            self.file.close()
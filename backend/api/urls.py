@@ -1,8 +1,8 @@
 from django.urls import path
 from .views import (
-    UserCreateView, TutorialList, SessionList, process_video, 
+    UserCreateView, TutorialList, SessionList, process_video, process_keypoints, 
     UserSessionResultView, HistoryList, SessionDetail, 
-    SessionUpdateDetail, HistoryDetail
+    SessionUpdateDetail, HistoryDetail, HistorySync, AnalysisJobDetail, UserStatsView, metrics_view
 )
 
 urlpatterns = [
@@ -10,8 +10,13 @@ urlpatterns = [
     path('tutorials/', TutorialList.as_view(), name='tutorial-list'),
     path('sessions/', SessionList.as_view(), name='session-list'),
     path('process_video/', process_video, name='process_video'),
+    path('process_keypoints/', process_keypoints, name='process_keypoints'),
+    path('process_video/jobs/<int:pk>/', AnalysisJobDetail.as_view(), name='analysis-job-detail'),
+    path('metrics/', metrics_view, name='metrics'),
     path('usersessionresult/', UserSessionResultView.as_view(), name='session_result'),
+    path('stats/', UserStatsView.as_view(), name='user-stats'),
     path('history/', HistoryList.as_view(), name='history-list'),
+    path('history/sync/', HistorySync.as_view(), name='history-sync'),
     path('history/<int:pk>/', HistoryDetail.as_view(), name='history-detail'),
     path('sessions/<int:pk>/', SessionDetail.as_view(), name='session-detail'),
     # Remove the SessionUpdateDetail if not needed, or use a different path
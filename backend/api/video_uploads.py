@@ -0,0 +1,146 @@
+"""
+Copying analysed uploads to the result video storage in the background.
+
+save_result stages the upload on local disk (``staged_video``) and marks the
+row ``pending``; the response doesn't wait for the copy to the default
+storage (Cloudinary in production, see STORAGES in settings). Once the
+request's transaction commits the row is handed to a small per-process
+thread pool. A failed attempt is retried with exponential backoff by a
+timer that submits it to the pool again, so waiting out the backoff never
+holds one of the pool's threads.
+
+Rows are claimed with a conditional update and a lease, so an upload whose
+process died mid-way is picked up again by ``upload_due_videos``, which
+run_analysis_worker calls whenever its queue is empty.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import UserSessionResult
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RESULT_VIDEO_UPLOAD_THREADS,
+            thread_name_prefix='video-upload',
+        )
+    return _executor
+
+
+def schedule_upload(result):
+    """Copy ``result``'s staged video to storage, in the background unless disabled."""
+    if not settings.RESULT_VIDEO_UPLOAD_ASYNC:
+        upload_result_video(result.id)
+        return
+    # The row must be visible to the upload thread's own connection
+    transaction.on_commit(lambda: _submit_upload(result.id))
+
+
+def _submit_upload(result_id):
+    get_executor().submit(_upload_in_background, result_id)
+
+
+def _upload_in_background(result_id):
+    try:
+        delay = upload_result_video(result_id)
+    except Exception:
+        logger.exception("Video upload thread for result %s crashed", result_id)
+        return
+    finally:
+        connection.close()
+    if delay is not None:
+        # The row is due again at video_upload_after; upload_due_videos
+        # picks it up if this process exits first
+        timer = threading.Timer(delay, _submit_upload, args=(result_id,))
+        timer.daemon = True
+        timer.start()
+
+
+def _due(now):
+    # Pending uploads whose retry time has come, and uploads whose lease ran out
+    return Q(
+        video_status__in=[UserSessionResult.VIDEO_PENDING, UserSessionResult.VIDEO_UPLOADING],
+        video_upload_after__lte=now,
+    )
+
+
+def upload_result_video(result_id):
+    """
+    Make one attempt at uploading a result's staged video. Returns the
+    seconds to wait before the next attempt, or None when there is nothing
+    more to do (stored, failed for good, or claimed by someone else).
+    """
+    now = timezone.now()
+    claimed = UserSessionResult.objects.filter(_due(now), id=result_id).update(
+        video_status=UserSessionResult.VIDEO_UPLOADING,
+        video_attempts=F('video_attempts') + 1,
+        video_upload_after=now + timedelta(seconds=settings.RESULT_VIDEO_UPLOAD_TIMEOUT),
+    )
+    if not claimed:
+        return None
+    result = UserSessionResult.objects.get(id=result_id)
+
+    try:
+        with result.staged_video.open('rb') as staged:
+            result.uploaded_video.save(os.path.basename(result.staged_video.name), File(staged), save=False)
+    except Exception as exc:
+        return _upload_failed(result, exc)
+
+    staged_name = result.staged_video.name
+    UserSessionResult.objects.filter(id=result.id).update(
+        uploaded_video=result.uploaded_video.name,
+        staged_video='',
+        video_status=UserSessionResult.VIDEO_STORED,
+        video_upload_after=None,
+        video_error='',
+    )
+    result.staged_video.storage.delete(staged_name)
+    return None
+
+
+def _upload_failed(result, exc):
+    message = f"{type(exc).__name__}: {exc}"
+    rows = UserSessionResult.objects.filter(id=result.id, video_status=UserSessionResult.VIDEO_UPLOADING)
+    if result.video_attempts >= settings.RESULT_VIDEO_UPLOAD_MAX_ATTEMPTS:
+        # The staged file is kept so the video isn't lost
+        rows.update(video_status=UserSessionResult.VIDEO_FAILED, video_upload_after=None, video_error=message)
+        logger.error("Video upload for result %s failed: %s", result.id, message)
+        return None
+
+    delay = settings.RESULT_VIDEO_UPLOAD_RETRY_DELAY * (2 ** (result.video_attempts - 1))
+    rows.update(
+        video_status=UserSessionResult.VIDEO_PENDING,
+        video_upload_after=timezone.now() + timedelta(seconds=delay),
+        video_error=message,
+    )
+    logger.warning("Video upload for result %s attempt %s failed, retrying in %ss: %s",
+                   result.id, result.video_attempts, delay, message)
+    return delay
+
+
+def upload_due_videos(limit=10):
+    """Attempt the uploads that are due; returns how many were attempted."""
+    ids = list(
+        UserSessionResult.objects
+        .filter(_due(timezone.now()))
+        .order_by('id')
+        .values_list('id', flat=True)[:limit]
+    )
+    for result_id in ids:
+        upload_result_video(result_id)
+    return len(ids)
@@ -1,4 +1,10 @@
+import datetime
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
@@ -11,16 +17,19 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.generics import RetrieveUpdateAPIView
 
-import tempfile
-import numpy as np
-import cv2
-import mediapipe as mp
-import os
-
-from .models import Tutorial, Session, UserSessionResult, History
-from .serializer import UserSerializer, TutorialSerializer, SessionSerializer, UserSessionResultSerializer, HistorySerializer
-
-mp_pose = mp.solutions.pose
+from .models import Tutorial, Session, UserSessionResult, History, AnalysisJob, DailyStats, SessionStats
+from .serializer import UserSerializer, TutorialSerializer, SessionSerializer, UserSessionResultSerializer, HistorySerializer, AnalysisJobSerializer
+from .serializer import HistoryEntrySerializer, HistorySyncSerializer
+from .serializer import DailyStatsSerializer, SessionStatsSerializer, UserStatsSerializer
+from .analysis import AnalysisError, analyze_extraction, analyze_upload, sampling_options, save_result, scoring_mode
+from . import metrics
+from .catalog_cache import catalog_response
+from .history import sync_history, upsert_history
+from .stats import current_streak, get_user_stats
+from .jobs import create_job
+from .keypoint_upload import keypoint_extraction, read_keypoints
+from .pagination import CreatedAtCursorPagination
+from .uploads import StreamingVideoUploadHandler
 
 class UserCreateView(generics.CreateAPIView):
     serializer_class = UserSerializer
@@ -37,29 +46,73 @@ class UserCreateView(generics.CreateAPIView):
 
 class TutorialList(APIView):
     def get(self, request):
-        tutorials = Tutorial.objects.all()
-        serializer = TutorialSerializer(tutorials, many=True)
-        return Response(serializer.data)
+        return catalog_response(
+            request, 'tutorials',
+            lambda: TutorialSerializer(Tutorial.objects.all(), many=True).data,
+        )
 
 class SessionList(APIView):
     def get(self, request):
-        sessions = Session.objects.all()
-        serializer = SessionSerializer(sessions, many=True)
-        return Response(serializer.data)
-
-from fastdtw import fastdtw
-from scipy.spatial.distance import euclidean
+        return catalog_response(
+            request, 'sessions',
+            lambda: SessionSerializer(Session.objects.all(), many=True).data,
+        )
 
-def dtw_distance(seq1, seq2):
-    seq1_flat = seq1.reshape(seq1.shape[0], -1)
-    seq2_flat = seq2.reshape(seq2.shape[0], -1)
-    distance, path = fastdtw(seq1_flat, seq2_flat, dist=euclidean)
-    return distance
+def error_response(exc):
+    """The JSON response for an AnalysisError, with Retry-After when it's temporary."""
+    response = Response({"error": exc.message}, status=exc.status_code)
+    if exc.retry_after is not None:
+        response['Retry-After'] = str(exc.retry_after)
+    return response
+
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def wants_async_by_default(request):
+    # Decided without parsing the request body
+    value = request.query_params.get('async')
+    if value is None:
+        return settings.ANALYSIS_ASYNC_DEFAULT
+    return _is_true(value)
+
+def wants_async(request):
+    value = request.data.get('async')
+    if value is None:
+        return wants_async_by_default(request)
+    return _is_true(value)
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def process_video(request):
-    uploaded_file = request.FILES.get('uploaded_video')
+    with metrics.timed('process_video') as timer:
+        response = _process_video(request)
+        metrics.note(outcome={200: 'ok', 202: 'queued'}.get(response.status_code, 'error'))
+    if timer is not None:
+        response['Server-Timing'] = timer.server_timing()
+    return response
+
+def _process_video(request):
+    # Checked before the upload handler is installed, so a rejected request
+    # never starts pose estimation (authentication doesn't read the body)
+    if not request.user or not request.user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
+
+    if not wants_async_by_default(request):
+        # Start pose estimation while the upload is still arriving
+        request.upload_handlers.insert(0, StreamingVideoUploadHandler(request, options=sampling_options()))
+
+    uploaded_file = None
+    try:
+        with metrics.stage('upload'):
+            uploaded_file = request.FILES.get('uploaded_video')
+        return _analyze_video_request(request, uploaded_file)
+    finally:
+        # Whatever the outcome, stop decoding; once the analysis used it this is a no-op
+        streaming = getattr(uploaded_file, 'streaming_extraction', None)
+        if streaming is not None:
+            streaming.cancel()
+
+def _analyze_video_request(request, uploaded_file):
     session_id = request.data.get('session')
     session_name = request.data.get('title')
     weight = float(request.data.get('weight', 0))  # make sure it's float
@@ -67,127 +120,115 @@ def process_video(request):
     if not uploaded_file or not session_id or not session_name:
         return Response({"error": "Missing video file, session id, or title"}, status=400)
 
-    if not request.user or not request.user.is_authenticated:
-        return Response({"error": "Authentication required"}, status=401)
-
     session_obj = get_object_or_404(Session, id=session_id)
 
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".mp4") as temp_video:
-        for chunk in uploaded_file.chunks():
-            temp_video.write(chunk)
-        temp_video.flush()
-        user_keypoints = extract_keypoints_from_video(temp_video.name)
-        
-        # Get video duration in minutes
-        cap = cv2.VideoCapture(temp_video.name)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        duration_seconds = frame_count / fps
-        cap.release()
-
-        duration_minutes = round(duration_seconds / 60, 2)
-
-    ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    BASE_DIR = os.path.join(ROOT_DIR, "Workout_npy")
-
-    def normalize_name(name):
-        return name.lower().replace(' ', '_')
-
-    def strip_suffix(name, suffix="_npy"):
-        if name.lower().endswith(suffix):
-            return name[:-len(suffix)]
-        return name
-
-    normalized_session = normalize_name(session_name)
-
-    folder_to_use = None
-    for foldername in os.listdir(BASE_DIR):
-        folder_base = strip_suffix(foldername)
-        if normalized_session == folder_base.lower():
-            folder_to_use = os.path.join(BASE_DIR, foldername)
-            break
-
-    if not folder_to_use:
-        return Response({"error": "No matching dataset found"}, status=404)
-
-    distances = []
-    for npy_file in os.listdir(folder_to_use):
-        if not npy_file.endswith(".npy"):
-            continue
-        dataset_keypoints = np.load(os.path.join(folder_to_use, npy_file))
-        dist = dtw_distance(user_keypoints, dataset_keypoints)
-        distances.append(dist)
-
-    if not distances:
-        return Response({"error": "No .npy files found in dataset folder"}, status=404)
-
-    best_dist = min(distances)
-    avg_dist = sum(distances) / len(distances)
-    max_dist = max(distances) if distances else 1
-    best_accuracy = max(0, 100 * (1 - best_dist / max_dist))
-    avg_accuracy = max(0, 100 * (1 - avg_dist / max_dist))
-    raw_accuracy = best_accuracy if best_accuracy > avg_accuracy else avg_accuracy
-    
-    # Round to 1 decimal place for consistency
-    accuracy_score = round(raw_accuracy, 1)
-
-    # MET values
-    MET_VALUES = {
-        "pushup": 4.0,
-        "pullup": 8.0,
-        "russian_twist": 4.0,
-        "leg_raise": 3.5,
-        "deadlift": 6.0,
-        "bench_press": 6.0,
-        "tricep_pushdown": 3.5,
-        "lateral_raise": 3.5,
-        "squat": 5.0
-    }
-
-    met_value = MET_VALUES.get(normalized_session, 4.0)  # default 4.0 if not found
-    calories = round(met_value * float(weight) * duration_minutes * 0.0175, 2)
+    # Optional 'scoring_mode' field: 'keypoints' or 'features'
+    requested_mode = request.data.get('scoring_mode') or None
+    try:
+        mode = scoring_mode(requested_mode)
+    except AnalysisError as exc:
+        return error_response(exc)
+
+    if wants_async(request):
+        streaming = getattr(uploaded_file, 'streaming_extraction', None)
+        if streaming is not None:
+            streaming.cancel()
+        job = create_job(request.user, session_obj, session_name, weight, uploaded_file, requested_mode)
+        return Response({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": reverse('analysis-job-detail', args=[job.id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    try:
+        analysis = analyze_upload(uploaded_file, session_name, weight, mode)
+    except AnalysisError as exc:
+        return error_response(exc)
+
+    accuracy_score = analysis["accuracy_score"]
+    calories = analysis["calories"]
 
     # Save result in DB
-    user_session_result = UserSessionResult.objects.create(
-        user=request.user,
-        session=session_obj,
-        accuracy_score=accuracy_score,
-        uploaded_video=uploaded_file,
-        calories=calories,
-        duration=duration_minutes,
-    )
+    user_session_result = save_result(request.user, session_obj, analysis, uploaded_file)
 
     return Response({
         "accuracy_score": accuracy_score,
         "calories_burned": calories,
-        "result_id": user_session_result.id
+        "result_id": user_session_result.id,
+        "rep_count": user_session_result.rep_count,
+        "reps": analysis["reps"],
+        # How many reference DTWs ran in full, were abandoned early or pruned
+        "search": analysis["search"],
     })
 
-def extract_keypoints_from_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    keypoints_all_frames = []
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+def process_keypoints(request):
+    """
+    Score a keypoint sequence computed on the client instead of a video
+    (see api/keypoint_upload.py). Form fields: ``keypoints`` (.npy or .npz
+    file), ``fps``, ``session``, ``title``, ``weight`` and optionally
+    ``scoring_mode``.
+    """
+    with metrics.timed('process_keypoints') as timer:
+        response = _process_keypoints(request)
+        metrics.note(outcome='ok' if response.status_code == 200 else 'error')
+    if timer is not None:
+        response['Server-Timing'] = timer.server_timing()
+    return response
+
+def _process_keypoints(request):
+    with metrics.stage('upload'):
+        keypoints_file = request.FILES.get('keypoints')
+    session_id = request.data.get('session')
+    session_name = request.data.get('title')
 
-    with mp_pose.Pose(static_image_mode=False, min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+    if not keypoints_file or not session_id or not session_name or not request.data.get('fps'):
+        return Response({"error": "Missing keypoints file, fps, session id, or title"}, status=400)
 
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = pose.process(frame_rgb)
+    if not request.user or not request.user.is_authenticated:
+        return Response({"error": "Authentication required"}, status=401)
 
-            if results.pose_landmarks:
-                frame_keypoints = []
-                for lm in results.pose_landmarks.landmark:
-                    frame_keypoints.append([lm.x, lm.y, lm.z, lm.visibility])
-                keypoints_all_frames.append(frame_keypoints)
-            else:
-                keypoints_all_frames.append(np.zeros((33, 4)))
+    session_obj = get_object_or_404(Session, id=session_id)
+    try:
+        weight = float(request.data.get('weight', 0))
+        fps = float(request.data.get('fps'))
+    except ValueError:
+        return Response({"error": "weight and fps must be numbers"}, status=400)
+
+    try:
+        mode = scoring_mode(request.data.get('scoring_mode') or None)
+        with metrics.stage('decode'):
+            keypoints = read_keypoints(keypoints_file)
+        extraction = keypoint_extraction(keypoints, fps, sampling_options())
+        analysis = analyze_extraction(extraction, session_name, weight, mode)
+    except AnalysisError as exc:
+        return error_response(exc)
+
+    user_session_result = save_result(request.user, session_obj, analysis)
+    return Response({
+        "accuracy_score": analysis["accuracy_score"],
+        "calories_burned": analysis["calories"],
+        "result_id": user_session_result.id,
+        "rep_count": user_session_result.rep_count,
+        "reps": analysis["reps"],
+        "search": analysis["search"],
+    })
 
-    cap.release()
-    return np.array(keypoints_all_frames)
+def metrics_view(request):
+    """Prometheus metrics (see api/metrics.py); 404 unless METRICS_ENABLED."""
+    if not metrics.enabled():
+        raise Http404
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics.render(metrics.collect(), metrics.reference_gauges()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
 
 class UserSessionResultView(APIView):
+    """The user's results, newest first; ?session=<id> limits them to one session."""
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -196,14 +237,62 @@ class UserSessionResultView(APIView):
             .filter(user=request.user)
             .select_related("session")  # avoids extra DB hits
         )
-        serializer = UserSessionResultSerializer(results, many=True)
-        return Response(serializer.data)
+        session = request.query_params.get('session')
+        if session is not None:
+            try:
+                results = results.filter(session_id=int(session))
+            except ValueError:
+                return Response({"error": "session must be an integer"}, status=400)
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        serializer = UserSessionResultSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+class UserStatsView(APIView):
+    """
+    Totals, per-session and per-day aggregates of the user's results, read
+    from the summary tables (api/stats.py). ?days=N (default 30) picks how
+    many recent days are listed.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), settings.STATS_MAX_DAYS)
+        except ValueError:
+            return Response({"error": "days must be an integer"}, status=400)
+        stats = get_user_stats(request.user)
+        since = timezone.localdate(timezone=datetime.timezone.utc) - datetime.timedelta(days=days - 1)
+        daily = DailyStats.objects.filter(user=request.user, day__gte=since).order_by('day')
+        sessions = SessionStats.objects.filter(user=request.user).select_related('session').order_by('session_id')
+        return Response({
+            "totals": {**UserStatsSerializer(stats).data, "current_streak": current_streak(stats)},
+            "sessions": SessionStatsSerializer(sessions, many=True).data,
+            "days": DailyStatsSerializer(daily, many=True).data,
+        })
+
+class AnalysisJobDetail(RetrieveAPIView):
+    serializer_class = AnalysisJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return (
+            AnalysisJob.objects
+            .filter(user=self.request.user)
+            .select_related("result__session")
+        )
 
 class SessionDetail(RetrieveAPIView):
     queryset = Session.objects.all()
     serializer_class = SessionSerializer
     permission_classes = [AllowAny] 
 
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(
+            request, f"session:{kwargs['pk']}",
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+
 class SessionUpdateDetail(RetrieveUpdateAPIView):
     queryset = Session.objects.all()
     serializer_class = SessionSerializer
@@ -213,45 +302,42 @@ class HistoryList(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        history = History.objects.filter(user=request.user)
-        serializer = HistorySerializer(history, many=True)
-        return Response(serializer.data)
+        # HistorySerializer reads the session's title, description and video
+        history = History.objects.filter(user=request.user).select_related("session")
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(history, request, view=self)
+        serializer = HistorySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
     
     def post(self, request):
-        data = request.data.copy()
-        data['user'] = request.user.id
-        session_id = data.get('session')
-        
-        # Round accuracy_score to 1 decimal place if provided
-        if 'accuracy_score' in data:
-            data['accuracy_score'] = round(float(data['accuracy_score']), 1)
-        
-        # Check if history already exists for this user and session
-        existing_history = History.objects.filter(
-            user=request.user, 
-            session=session_id
-        ).first()
-        
-        if existing_history:
-            # Update existing history
-            serializer = HistorySerializer(existing_history, data=data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                return Response({
-                    **serializer.data,
-                    "message": "History updated successfully"
-                }, status=status.HTTP_200_OK)
+        serializer = HistoryEntrySerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            # Create new history
-            serializer = HistorySerializer(data=data)
-            if serializer.is_valid():
-                serializer.save()
-                return Response({
-                    **serializer.data,
-                    "message": "History created successfully"
-                }, status=status.HTTP_201_CREATED)
+        entry = serializer.validated_data
+        outcome = upsert_history(request.user, entry)
+        if outcome is None:
+            return Response({"weight": ["Required for a new history entry."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        history = History.objects.select_related("session").get(user=request.user, session=entry['session'])
+        return Response({
+            **HistorySerializer(history).data,
+            "message": f"History {outcome} successfully"
+        }, status=status.HTTP_201_CREATED if outcome == 'created' else status.HTTP_200_OK)
+
+class HistorySync(APIView):
+    """Upsert a batch of history entries from an offline client in one transaction."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = HistorySyncSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        sessions = sync_history(request.user, serializer.validated_data['entries'])
+        history = History.objects.filter(user=request.user, session__in=sessions).select_related("session")
+        return Response({
+            "saved": len(sessions),
+            "results": HistorySerializer(history, many=True).data,
+        })
 
 class HistoryDetail(APIView):
     permission_classes = [IsAuthenticated]
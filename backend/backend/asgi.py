@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# WebSocket live scoring (api/streaming.py) next to the Django views. The
+# Procfile runs this as a separate "stream" process and keeps HTTP on WSGI
+# (backend/wsgi.py): Django's ASGI handler reads the whole request body
+# before the view runs, which defeats the streaming upload handler of
+# process_video (api/uploads.py), and runs every sync view in one thread.
+from api.streaming import route_websockets  # noqa: E402
+
+application = route_websockets(django_application)
+
+# Load reference keypoints and pose graphs once per worker instead of on the
+# first upload. Run gunicorn without --preload: MediaPipe graphs don't survive fork.
+from django.conf import settings  # noqa: E402
+from api.reference_index import warm_reference_index  # noqa: E402
+from api.pose import get_pose_pool  # noqa: E402
+
+warm_reference_index()
+if settings.POSE_POOL_PRELOAD:
+    get_pose_pool().warm()
@@ -75,6 +75,15 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cursor pagination of the history and result listings (see api/pagination.py);
+# clients can ask for up to LISTING_MAX_PAGE_SIZE items with ?page_size=
+LISTING_PAGE_SIZE = int(os.environ.get('LISTING_PAGE_SIZE', 50))
+LISTING_MAX_PAGE_SIZE = int(os.environ.get('LISTING_MAX_PAGE_SIZE', 200))
+# Largest batch accepted by history/sync/
+HISTORY_SYNC_MAX_ENTRIES = int(os.environ.get('HISTORY_SYNC_MAX_ENTRIES', 500))
+# Most recent days stats/ will list (?days=)
+STATS_MAX_DAYS = int(os.environ.get('STATS_MAX_DAYS', 366))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -159,5 +168,159 @@ STATIC_URL = 'static/'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.VideoMediaCloudinaryStorage'
 
+# Storage for files without an explicit one, i.e. analysed upload videos
+# (UserSessionResult.uploaded_video). Django 5 ignores DEFAULT_FILE_STORAGE.
+# MEDIA_STORAGE_BACKEND=django.core.files.storage.FileSystemStorage keeps
+# them under MEDIA_ROOT instead of sending them to Cloudinary.
+STORAGES = {
+    'default': {
+        'BACKEND': os.environ.get('MEDIA_STORAGE_BACKEND', 'cloudinary_storage.storage.VideoMediaCloudinaryStorage'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'media'))
+# Keep every file under MEDIA_ROOT, including the tutorial and session videos
+# whose fields name Cloudinary explicitly, so nothing talks to Cloudinary
+# (offline development and load tests, see api/loadtest.py)
+MEDIA_LOCAL_ONLY = os.environ.get('MEDIA_LOCAL_ONLY', 'False') == 'True'
+if MEDIA_LOCAL_ONLY:
+    STORAGES['default']['BACKEND'] = 'django.core.files.storage.FileSystemStorage'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Tutorial and session catalog responses (see api/catalog_cache.py).
+    # LocMemCache evicts least recently used entries; use a shared backend
+    # (e.g. django.core.cache.backends.redis.RedisCache) so that changes
+    # invalidate every worker at once.
+    'catalog': {
+        'BACKEND': os.environ.get('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', 'catalog'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 1000))},
+    },
+}
+CATALOG_CACHE_ENABLED = os.environ.get('CATALOG_CACHE_ENABLED', 'True') == 'True'
+CATALOG_CACHE_ALIAS = 'catalog'
+# Seconds a cached response lives; bounds staleness in workers that don't
+# share the cache with the one where the catalog changed
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
+# Reference keypoints used to score uploads (see api/reference_index.py)
+REFERENCE_DATA_DIR = BASE_DIR / 'Workout_npy'
+# Raw reference clips, one folder per exercise (manage.py preprocess_references)
+REFERENCE_SOURCE_DIR = BASE_DIR / 'datasets' / 'workout'
+REFERENCE_INDEX_PRELOAD = os.environ.get('REFERENCE_INDEX_PRELOAD', 'True') == 'True'
+# Seconds between checks for changes on disk; 0 disables automatic reloads
+REFERENCE_INDEX_RELOAD_INTERVAL = int(os.environ.get('REFERENCE_INDEX_RELOAD_INTERVAL', 0))
+# Open consolidated stores (manage.py build_reference_store) memory-mapped so
+# worker processes share their pages
+REFERENCE_STORE_MMAP = os.environ.get('REFERENCE_STORE_MMAP', 'True') == 'True'
+# Sakoe-Chiba band radius in frames for DTW scoring; unset means exact DTW
+DTW_BAND = int(os.environ['DTW_BAND']) if os.environ.get('DTW_BAND') else None
+# 'keypoints' (raw landmarks) or 'features' (joint angles and normalised limb
+# vectors, see api/features.py); process_video accepts a per-request override
+SCORING_MODE = os.environ.get('SCORING_MODE', 'keypoints')
+# How references are searched (api/search.py): 'exact' prunes with lower
+# bounds but gives the same scores as 'all'; 'top_k' runs at most
+# DTW_SEARCH_TOP_K + 1 full DTWs and is approximate
+DTW_SEARCH_MODE = os.environ.get('DTW_SEARCH_MODE', 'exact')
+DTW_SEARCH_TOP_K = int(os.environ.get('DTW_SEARCH_TOP_K', 3))
+# 'references' compares whole clips with every reference recording,
+# 'templates' with the DBA templates of manage.py build_templates (see
+# api/templates.py; exercises without templates fall back to 'references').
+# Only whole-clip scoring uses it: with REP_SCORING_ENABLED, it applies to
+# clips where no rep is found, since reps are scored against single-rep
+# templates either way
+REFERENCE_MODE = os.environ.get('REFERENCE_MODE', 'references')
+# Score uploads rep by rep (api/reps.py): the clip is split into repetitions
+# and each is compared with single-rep templates cut from the references,
+# so scoring cost grows linearly with clip length. Clips where no rep is
+# found are still scored whole
+REP_SCORING_ENABLED = os.environ.get('REP_SCORING_ENABLED', 'True') == 'True'
+# Single-rep templates kept per exercise, spread evenly over the references
+REP_TEMPLATES_MAX = int(os.environ.get('REP_TEMPLATES_MAX', 48))
+
+
+# Warm MediaPipe Pose graphs kept per process (see api/pose.py)
+POSE_POOL_SIZE = int(os.environ.get('POSE_POOL_SIZE', 1))
+POSE_POOL_PRELOAD = os.environ.get('POSE_POOL_PRELOAD', 'True') == 'True'
+# Seconds to wait for a free instance before failing; unset waits forever
+POSE_POOL_TIMEOUT = float(os.environ['POSE_POOL_TIMEOUT']) if os.environ.get('POSE_POOL_TIMEOUT') else None
+# Seconds between health checks of idle instances; 0 disables them
+POSE_POOL_HEALTH_INTERVAL = int(os.environ.get('POSE_POOL_HEALTH_INTERVAL', 300))
+
+# Unix socket of a shared pose server (manage.py run_pose_server, see
+# api/pose_server.py). When set, web workers send frames there instead of
+# running MediaPipe themselves and the POSE_POOL_* sizes above are unused.
+POSE_SERVER_SOCKET = os.environ.get('POSE_SERVER_SOCKET') or None
+# Inference processes, frames per batch sent to one, frames one video may
+# have queued, and videos served at once
+POSE_SERVER_WORKERS = int(os.environ.get('POSE_SERVER_WORKERS', 2))
+POSE_SERVER_BATCH_SIZE = int(os.environ.get('POSE_SERVER_BATCH_SIZE', 4))
+POSE_SERVER_WINDOW = int(os.environ.get('POSE_SERVER_WINDOW', 8))
+POSE_SERVER_MAX_VIDEOS = int(os.environ.get('POSE_SERVER_MAX_VIDEOS', 32))
+
+# Frame sampling before pose inference (see api.pose.SamplingOptions). Unset
+# means every frame at full size. Reference data must be generated with the
+# same values (scripts/preprocess_videos.py --target-fps ...).
+POSE_TARGET_FPS = float(os.environ['POSE_TARGET_FPS']) if os.environ.get('POSE_TARGET_FPS') else None
+POSE_MAX_DIMENSION = int(os.environ['POSE_MAX_DIMENSION']) if os.environ.get('POSE_MAX_DIMENSION') else None
+POSE_MAX_DURATION = float(os.environ['POSE_MAX_DURATION']) if os.environ.get('POSE_MAX_DURATION') else None
+# Hard limits on the frames analysed per video and on the memory their
+# keypoints take; longer videos are rejected with 413 rather than truncated
+POSE_MAX_FRAMES = int(os.environ.get('POSE_MAX_FRAMES', 18000))
+POSE_MAX_KEYPOINT_BYTES = int(os.environ.get('POSE_MAX_KEYPOINT_BYTES', 16 * 1024 * 1024))
+
+# Per-stage timings of process_video and analysis jobs: Server-Timing header,
+# JSON log lines on the api.metrics logger and Prometheus histograms at
+# /api/metrics/ (see api/metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+# Shared directory where every process writes its metrics so the endpoint can
+# sum them (needed with several gunicorn workers or run_analysis_worker)
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+# When set, /api/metrics/ requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# Limits on client-side keypoint sequences sent to process_keypoints (see
+# api/keypoint_upload.py); 18000 frames is ten minutes at 30 fps
+KEYPOINT_UPLOAD_MAX_BYTES = int(os.environ.get('KEYPOINT_UPLOAD_MAX_BYTES', 16 * 1024 * 1024))
+KEYPOINT_UPLOAD_MAX_FRAMES = int(os.environ.get('KEYPOINT_UPLOAD_MAX_FRAMES', 18000))
+KEYPOINT_UPLOAD_MAX_FPS = float(os.environ.get('KEYPOINT_UPLOAD_MAX_FPS', 240))
+
+# Live scoring of client-side keypoints over a WebSocket (see api/streaming.py,
+# served by backend/asgi.py as the Procfile's separate "stream" process). Each streamed frame is compared with at most
+# STREAM_MAX_REFERENCE_FRAMES reference frames, which bounds the work per
+# frame; exercises with more use an evenly spread subset of their references
+STREAM_PATH = '/ws/stream/'
+STREAM_MAX_REFERENCE_FRAMES = int(os.environ.get('STREAM_MAX_REFERENCE_FRAMES', 12000))
+STREAM_MAX_MESSAGE_FRAMES = int(os.environ.get('STREAM_MAX_MESSAGE_FRAMES', 120))
+
+# Keypoints of previously seen uploads, keyed by content hash (see api/keypoint_cache.py)
+KEYPOINT_CACHE_ENABLED = os.environ.get('KEYPOINT_CACHE_ENABLED', 'True') == 'True'
+KEYPOINT_CACHE_DIR = os.environ.get('KEYPOINT_CACHE_DIR', str(BASE_DIR / 'keypoint_cache'))
+KEYPOINT_CACHE_MAX_BYTES = int(os.environ.get('KEYPOINT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Background video analysis (see api/jobs.py). The queue backend decides how
+# queued jobs reach a worker; job state always lives in the AnalysisJob table.
+ANALYSIS_QUEUE_BACKEND = os.environ.get('ANALYSIS_QUEUE_BACKEND', 'api.jobs.DatabaseQueue')
+# Run process_video asynchronously even when the client doesn't ask for it
+ANALYSIS_ASYNC_DEFAULT = os.environ.get('ANALYSIS_ASYNC_DEFAULT', 'False') == 'True'
+ANALYSIS_JOB_UPLOAD_DIR = os.environ.get('ANALYSIS_JOB_UPLOAD_DIR', str(BASE_DIR / 'job_uploads'))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+ANALYSIS_JOB_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_TIMEOUT', 300))
+ANALYSIS_JOB_RETRY_DELAY = int(os.environ.get('ANALYSIS_JOB_RETRY_DELAY', 30))
+
+# Analysed uploads are staged on local disk and copied to the default storage
+# after the response is sent (see api/video_uploads.py). With
+# RESULT_VIDEO_UPLOAD_ASYNC off the copy happens inside the request.
+RESULT_VIDEO_UPLOAD_ASYNC = os.environ.get('RESULT_VIDEO_UPLOAD_ASYNC', 'True') == 'True'
+RESULT_VIDEO_STAGING_DIR = os.environ.get('RESULT_VIDEO_STAGING_DIR', str(BASE_DIR / 'result_uploads'))
+RESULT_VIDEO_UPLOAD_THREADS = int(os.environ.get('RESULT_VIDEO_UPLOAD_THREADS', 2))
+RESULT_VIDEO_UPLOAD_MAX_ATTEMPTS = int(os.environ.get('RESULT_VIDEO_UPLOAD_MAX_ATTEMPTS', 5))
+RESULT_VIDEO_UPLOAD_RETRY_DELAY = int(os.environ.get('RESULT_VIDEO_UPLOAD_RETRY_DELAY', 10))
+# Seconds after which an upload that hasn't finished is considered lost and retried
+RESULT_VIDEO_UPLOAD_TIMEOUT = int(os.environ.get('RESULT_VIDEO_UPLOAD_TIMEOUT', 600))
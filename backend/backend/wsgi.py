@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Load reference keypoints and pose graphs once per worker instead of on the
+# first upload. Run gunicorn without --preload: MediaPipe graphs don't survive fork.
+from django.conf import settings  # noqa: E402
+from api.reference_index import warm_reference_index  # noqa: E402
+from api.pose import get_pose_pool  # noqa: E402
+
+warm_reference_index()
+if settings.POSE_POOL_PRELOAD:
+    get_pose_pool().warm()
@@ -20,3 +20,11 @@ api.interceptors.request.use(
 )
 
 export default api
+
+// history/ and usersessionresult/ are cursor-paginated, newest first: fetch
+// one page (a path with params, or a page's "next" link) and follow "next"
+// only when more is shown
+export const fetchPage = async (url, params) => {
+    const res = await api.get(url, { params })
+    return res.data
+}
@@ -1,19 +1,20 @@
 import { useEffect, useState } from "react";
-import axios from "axios";
 import "../styles/metrics.css";
 import {
   PieChart, Pie, Cell,
   BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend,
   LineChart, Line, ResponsiveContainer
 } from "recharts";
-import { ACCESS_TOKEN } from "../constants";
+import api, { fetchPage } from "../api";
 import { useColor } from "../context/ColorContext";
 
+// Results plotted on the calories chart
+const RECENT_RESULTS = 50;
+
 export default function MetricsSection() {
   const [pieData, setPieData] = useState([]);
   const [barData, setBarData] = useState([]);
   const [lineData, setLineData] = useState([]);
-  const token = localStorage.getItem(ACCESS_TOKEN);
   const { color } = useColor();
   const COLORS = ["#051130ff", "#001f86ff", "#00B8D9", "#36B37E", "#FF6B6B"];
 
@@ -23,11 +24,13 @@ export default function MetricsSection() {
 
   const fetchChartData = async () => {
     try {
-      const res = await axios.get(`${import.meta.env.VITE_API_URL}/api/usersessionresult/`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-
-      const data = res.data;
+      // The latest results for the pie and line charts, per-session totals
+      // from the stats summary for the bars
+      const [page, stats] = await Promise.all([
+        fetchPage("/api/usersessionresult/", { page_size: RECENT_RESULTS }),
+        api.get("/api/stats/").then((res) => res.data),
+      ]);
+      const data = page.results;
 
       if (!data || data.length === 0) {
         setPieData([]);
@@ -36,22 +39,16 @@ export default function MetricsSection() {
         return;
       }
 
-      const sortedData = data.sort((a, b) => new Date(b.created_at) - new Date(a.created_at));
-      const last5Entries = sortedData.slice(0, 5);
+      const last5Entries = data.slice(0, 5);
 
       const pie = last5Entries.map((item) => ({
         name: `${item.session_title}`,
         value: Number(parseFloat(item.accuracy_score).toFixed(2)),
       }));
 
-      const counts = {};
-      data.forEach((item) => {
-        const sessionName = item.session_title;
-        counts[sessionName] = (counts[sessionName] || 0) + 1;
-      });
-      const bar = Object.keys(counts).map((name) => ({
-        name,
-        value: counts[name],
+      const bar = stats.sessions.map((item) => ({
+        name: item.session_title,
+        value: item.results,
       }));
 
       const line = data.map((item) => ({
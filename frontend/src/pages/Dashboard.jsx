@@ -1,4 +1,3 @@
-import axios from "axios";
 import MetricsSection from "../components/MetricsSection";
 import Overview from "../components/Overview";
 import Sidebar from "../components/Sidebar";
@@ -6,14 +5,13 @@ import Topbar from "../components/Topbar";
 import Tutorial from "../components/Tutorial";
 import "../styles/Dashboard.css"; 
 import { useEffect, useState } from "react";
-import { ACCESS_TOKEN } from "../constants";
+import api from "../api";
 import { useColor } from "../context/ColorContext";
 
 export default function Dashboard() {
   const [calories, setCalories] = useState(null);
   const [duration, setDuration] = useState(null);
   const [accuracy, setAccuracy] = useState(null);
-  const token = localStorage.getItem(ACCESS_TOKEN);
   const { color } = useColor();
 
   useEffect(() => {
@@ -22,27 +20,14 @@ export default function Dashboard() {
 
   const getMetrics = async () => {
     try {
-      const res = await axios.get(
-        `${import.meta.env.VITE_API_URL}/api/usersessionresult/`,
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-
-      const results = res.data; // Array of session results
-
-      if (Array.isArray(results) && results.length > 0) {
-        const totalCalories = parseFloat(
-          results.reduce((sum, r) => sum + (r.calories || 0), 0)
-        ).toFixed(2);
-
-        const totalDuration = results.reduce((sum, r) => sum + (r.duration || 0), 0);
-
-        const bestAccuracy = parseFloat(
-          Math.max(...res.data.map((r) => r.accuracy_score))
-        ).toFixed(2);
-
-        setCalories(totalCalories);
-        setDuration(parseFloat(totalDuration).toFixed(2));
-        setAccuracy(bestAccuracy);
+      // Totals kept up to date on the server
+      const res = await api.get("/api/stats/");
+      const totals = res.data.totals;
+
+      if (totals.results > 0) {
+        setCalories(parseFloat(totals.calories).toFixed(2));
+        setDuration(parseFloat(totals.duration).toFixed(2));
+        setAccuracy(parseFloat(totals.accuracy_max).toFixed(2));
       }
     } catch (err) {
       console.log(err);
@@ -1,30 +1,32 @@
 import { useEffect, useState } from "react";
-import axios from "axios";
 import "../styles/history.css";
-import { ACCESS_TOKEN } from "../constants";
+import { fetchPage } from "../api";
 import { useNavigate } from "react-router-dom";
 
 export default function History() {
   const [history, setHistory] = useState([]);
+  const [next, setNext] = useState(null);
   const [w, setW] = useState(0);
   const navigate = useNavigate();
 
-  useEffect(() => {
-    axios
-      .get(`${import.meta.env.VITE_API_URL}/api/history/`, {
-        headers: {
-          Authorization: `Bearer ${localStorage.getItem(ACCESS_TOKEN)}`,
-        },
-      })
-      .then((response) => {
-        setHistory(response.data);
-        if (response.data.length > 0 && response.data[0].weight) {
-          setW(response.data[0].weight);
-        }
+  const loadPage = (url, params) =>
+    fetchPage(url, params)
+      .then((page) => {
+        setHistory((items) => [...items, ...page.results]);
+        setNext(page.next);
+        return page.results;
       })
       .catch((error) => {
         console.error("Error fetching history:", error);
+        return [];
       });
+
+  useEffect(() => {
+    loadPage("/api/history/").then((items) => {
+      if (items.length > 0 && items[0].weight) {
+        setW(items[0].weight);
+      }
+    });
   }, []);
 
   const handleRetry = (sessionId) => {
@@ -68,6 +70,11 @@ export default function History() {
           ))}
         </div>
       )}
+      {next && (
+        <button className="Retry" onClick={() => loadPage(next)}>
+          Load more
+        </button>
+      )}
     </section>
   );
 }
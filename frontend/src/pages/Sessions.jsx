@@ -2,6 +2,7 @@ import { useEffect, useState, useRef } from "react";
 import axios from "axios";
 import "../styles/session.css";
 import { ACCESS_TOKEN } from "../constants";
+import { fetchPage } from "../api";
 import { useParams, useLocation } from "react-router-dom";
 
 function Session() {
@@ -105,14 +106,10 @@ function Session() {
 
   const fetchUserResults = async () => {
     try {
-      const res = await axios.get(`${import.meta.env.VITE_API_URL}/api/usersessionresult/`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      const sessionResults = res.data.filter((r) => r.session === selectedSession);
-      if (sessionResults.length > 0) {
-        const latest = sessionResults.reduce((prev, current) =>
-          new Date(prev.created_at) > new Date(current.created_at) ? prev : current
-        );
+      // Newest first, so the first result is the latest
+      const page = await fetchPage("/api/usersessionresult/", { session: selectedSession, page_size: 1 });
+      const latest = page.results[0];
+      if (latest) {
         setResults((prevResults) => ({ ...prevResults, [latest.session]: latest }));
         return latest;
       }
@@ -240,6 +237,7 @@ function Session() {
               <div className="accuracy-display latest-accuracy">
                 <strong>Latest Accuracy Score:</strong>{" "}
                 {parseFloat(results[s.id].accuracy_score || 0).toFixed(1)}%
+                {results[s.id].rep_count != null && ` (${results[s.id].rep_count} reps)`}
               </div>
             )}
           </div>